@@ -0,0 +1,171 @@
+"""
+Masked vs. Unmasked Data Benchmark
+
+Times the evaluation of typical operations on a 4D (time, lev, lat, lon) field without missing
+values (whose mask is nomask) and on the same field with a single missing value (whose mask is
+a full boolean array), both for PhysArray operations and for a complete DataFlow.
+
+This is not a unit test.  Run it (with pyconform installed) from any writable directory, since it
+writes and removes its own input and output files:
+
+    python benchmarks/maskingBenchmark.py [--shape T,Z,Y,X] [--repeat N]
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from os import remove
+from os.path import exists
+from time import time
+from argparse import ArgumentParser
+from collections import OrderedDict
+from pyconform import datasets, dataflow
+from pyconform.physarray import PhysArray
+from pyconform.flownodes import DataNode, EvalNode, ValidateNode
+from pyconform.datasets import VariableDesc, DimensionDesc
+from pyconform.functions import find_function, find_operator
+
+import netCDF4
+import numpy
+
+
+DIMENSIONS = ('time', 'lev', 'lat', 'lon')
+UNITS = OrderedDict([('time', 'days since 1979-01-01'), ('lev', '1'), ('lat', 'degrees_north'),
+                     ('lon', 'degrees_east'), ('T', 'K'), ('U', 'm/s'), ('Q', 'kg/kg')])
+DEFINITIONS = OrderedDict([('ta', ('T * 1.0', 'K')),
+                           ('ua', ('0.5 * (U + U * Q) / 86400', 'm/s')),
+                           ('wa', ('sqrt(U * U * Q)', 'm/s')),
+                           ('tm', ('mean(T, "time")', 'K'))])
+
+
+#===============================================================================
+# Command-Line Interface
+#===============================================================================
+def cli(argv=None):
+    parser = ArgumentParser(description='Benchmark operations on masked and unmasked 4D data')
+    parser.add_argument('--shape', default='12,30,96,144',
+                        help='Comma-separated sizes of the time, lev, lat and lon dimensions')
+    parser.add_argument('--repeat', default=3, type=int,
+                        help='Number of timings of each operation (the best time is reported)')
+    return parser.parse_args(argv)
+
+
+#===============================================================================
+# make_fields - Create the test fields, with or without a missing value
+#===============================================================================
+def make_fields(shape, missing):
+    numpy.random.seed(0)
+    fields = OrderedDict()
+    for name in ('T', 'U', 'Q'):
+        data = numpy.ma.asarray(numpy.random.rand(*shape).astype('f') + 1)
+        if missing:
+            data[(0,) * len(shape)] = numpy.ma.masked
+        fields[name] = PhysArray(data, name=name, units=UNITS[name], dimensions=DIMENSIONS)
+    return fields
+
+
+#===============================================================================
+# best_time - Best time of repeated function calls
+#===============================================================================
+def best_time(func, repeat):
+    times = []
+    for _ in xrange(repeat):
+        start = time()
+        func()
+        times.append(time() - start)
+    return min(times)
+
+
+#===============================================================================
+# operations - Operations on PhysArray fields to benchmark
+#===============================================================================
+def operations(fields):
+    U, Q = fields['U'], fields['Q']
+    NT, NU = DataNode(fields['T']), DataNode(fields['U'])
+    sqrt = find_function('sqrt')(DataNode(U * U * Q))
+    mean = find_function('mean')(NT, 'time')
+    mean.blocksize = 2
+    vdesc = VariableDesc('ua', datatype='float', dimensions=tuple(DimensionDesc(d) for d in DIMENSIONS),
+                         attributes={'units': 'm/s', 'ok_min_mean_abs': 1e-9, 'ok_max_mean_abs': 1.0})
+    validate = ValidateNode(vdesc, EvalNode('ua', find_operator('/', numargs=2), NU, 86400.0))
+    ops = OrderedDict()
+    ops['U * 2 + U * Q'] = lambda: U * 2.0 + U * Q
+    ops['(U + U * Q) / 86400'] = lambda: (U + U * Q) / 86400.0
+    ops['sqrt(U * U * Q)'] = lambda: sqrt[{}]
+    ops['mean(T, "time")'] = lambda: mean[{}]
+    ops['validate(U / 86400)'] = lambda: validate[{}]
+    return ops
+
+
+#===============================================================================
+# write_inputs - Write the test fields to an input file
+#===============================================================================
+def write_inputs(fname, fields):
+    shape = fields['T'].shape
+    with netCDF4.Dataset(fname, 'w') as ncf:
+        for d, n in zip(DIMENSIONS, shape):
+            ncf.createDimension(d, n)
+            ncv = ncf.createVariable(d, 'd', (d,))
+            ncv.units = UNITS[d]
+            ncv[:] = numpy.arange(n)
+        ncf.variables['time'].calendar = 'noleap'
+        for name, field in fields.iteritems():
+            ncv = ncf.createVariable(name, 'f', DIMENSIONS, fill_value=1e20)
+            ncv.units = UNITS[name]
+            ncv[:] = field
+
+
+#===============================================================================
+# make_dataflow - Create a DataFlow converting the test fields in an input file
+#===============================================================================
+def make_dataflow(fname):
+    inpds = datasets.InputDatasetDesc('inpds', [fname])
+    vdicts = OrderedDict()
+    for d in DIMENSIONS:
+        vdicts[d] = OrderedDict([('datatype', 'double'), ('dimensions', (d,)), ('definition', d),
+                                 ('attributes', OrderedDict([('units', UNITS[d])]))])
+    vdicts['time']['attributes']['calendar'] = 'noleap'
+    for name, (definition, units) in DEFINITIONS.iteritems():
+        dims = tuple(d for d in DIMENSIONS if d != 'time') if name == 'tm' else DIMENSIONS
+        vdicts[name] = OrderedDict([('datatype', 'float'), ('dimensions', dims), ('definition', definition),
+                                    ('attributes', OrderedDict([('units', units)])),
+                                    ('file', OrderedDict([('filename', 'bench_{}.nc'.format(name))]))])
+    return dataflow.DataFlow(inpds, datasets.OutputDatasetDesc('outds', vdicts))
+
+
+#===============================================================================
+# main
+#===============================================================================
+def main(argv=None):
+    args = cli(argv)
+    shape = tuple(int(n) for n in args.shape.split(','))
+    print 'Field shape: {} ({} elements)'.format(shape, numpy.prod(shape))
+    print
+
+    timings = OrderedDict()
+    for label, missing in [('unmasked', False), ('masked', True)]:
+        fields = make_fields(shape, missing)
+        for opname, op in operations(fields).iteritems():
+            timings.setdefault(opname, {})[label] = best_time(op, args.repeat)
+
+        fname = 'bench_input_{}.nc'.format(label)
+        write_inputs(fname, fields)
+        flow = make_dataflow(fname)
+        timings.setdefault('DataFlow.execute()', {})[label] = best_time(
+            lambda: flow.execute(chunks={'time': 1}), args.repeat)
+        for name in DEFINITIONS.keys() + ['input_{}'.format(label)]:
+            if exists('bench_{}.nc'.format(name)):
+                remove('bench_{}.nc'.format(name))
+
+    print
+    print '{:<24s} {:>12s} {:>12s} {:>8s}'.format('Operation', 'Masked (s)', 'Unmasked (s)', 'Speedup')
+    for opname, times in timings.iteritems():
+        print '{:<24s} {:>12.4f} {:>12.4f} {:>7.2f}x'.format(opname, times['masked'], times['unmasked'],
+                                                             times['masked'] / times['unmasked'])
+
+
+#===============================================================================
+# Command-Line Operation
+#===============================================================================
+if __name__ == '__main__':
+    main()
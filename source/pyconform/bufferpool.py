@@ -0,0 +1,143 @@
+"""
+Temporary Buffer Pool
+
+This module contains the BufferPool class, which keeps released NumPy arrays (keyed by shape and
+datatype) for reuse as temporary buffers, so that repeated arithmetic on same-sized chunks of data
+does not need to allocate new temporary arrays for every operation.  The number of bytes served
+from the pool (instead of newly allocated) is counted as the bytes saved by the pool.
+
+A single, process-wide pool is returned by the 'buffer_pool' function.
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from threading import RLock
+
+import numpy
+
+
+#=========================================================================
+# BufferPool
+#=========================================================================
+class BufferPool(object):
+    """
+    A pool of reusable temporary NumPy arrays
+
+    Buffers obtained with 'get' must be returned with 'release' once they are no longer in use,
+    and they must never be returned to the pool while any other object refers to them.
+    """
+
+    def __init__(self, maxbytes=2**28):
+        """
+        Initializer
+
+        Parameters:
+            maxbytes (int): The maximum number of bytes of released buffers to keep in the pool
+        """
+        self._buffers = {}
+        self._lock = RLock()
+        self._nbytes = 0
+        self._allocated = 0
+        self._saved = 0
+        self.maxbytes = maxbytes
+
+    @property
+    def maxbytes(self):
+        """The maximum number of bytes of released buffers to keep in the pool"""
+        return self._maxbytes
+
+    @maxbytes.setter
+    def maxbytes(self, maxbytes):
+        """The maximum number of bytes of released buffers to keep in the pool"""
+        if not isinstance(maxbytes, (int, long)) or maxbytes < 0:
+            raise ValueError('Maximum number of pooled bytes must be a non-negative integer')
+        with self._lock:
+            self._maxbytes = maxbytes
+            if self._nbytes > maxbytes:
+                self.clear()
+
+    @property
+    def nbytes(self):
+        """The number of bytes of released buffers currently kept in the pool"""
+        return self._nbytes
+
+    @property
+    def allocated(self):
+        """The number of bytes of new buffers allocated by the pool"""
+        return self._allocated
+
+    @property
+    def saved(self):
+        """The number of bytes of buffers reused from the pool (instead of newly allocated)"""
+        return self._saved
+
+    def __len__(self):
+        return sum(len(bufs) for bufs in self._buffers.itervalues())
+
+    def get(self, shape, dtype):
+        """
+        Return a buffer (with undefined contents) of the given shape and datatype
+
+        Parameters:
+            shape (tuple): The shape of the buffer
+            dtype (dtype): The datatype of the buffer
+        """
+        key = (tuple(shape), numpy.dtype(dtype).str)
+        with self._lock:
+            bufs = self._buffers.get(key, None)
+            if bufs:
+                buf = bufs.pop()
+                self._nbytes -= buf.nbytes
+                self._saved += buf.nbytes
+                return buf
+        buf = numpy.empty(shape, dtype=dtype)
+        with self._lock:
+            self._allocated += buf.nbytes
+        return buf
+
+    def release(self, *buffers):
+        """
+        Return buffers obtained from 'get' to the pool
+
+        Parameters:
+            buffers: The buffers to return to the pool (None values are ignored)
+        """
+        with self._lock:
+            for buf in buffers:
+                if buf is None or self._nbytes + buf.nbytes > self._maxbytes:
+                    continue
+                self._buffers.setdefault((buf.shape, buf.dtype.str), []).append(buf)
+                self._nbytes += buf.nbytes
+
+    def clear(self):
+        """
+        Remove all released buffers from the pool
+        """
+        with self._lock:
+            self._buffers.clear()
+            self._nbytes = 0
+
+    def reset_counters(self):
+        """
+        Reset the allocated and saved byte counters
+        """
+        with self._lock:
+            self._allocated = 0
+            self._saved = 0
+
+
+#=========================================================================
+# The process-wide buffer pool
+#=========================================================================
+_POOL_ = BufferPool()
+
+
+#=========================================================================
+# buffer_pool
+#=========================================================================
+def buffer_pool():
+    """
+    Return the process-wide BufferPool
+    """
+    return _POOL_
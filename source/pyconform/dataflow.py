@@ -20,13 +20,23 @@ from pyconform.datasets import InputDatasetDesc, OutputDatasetDesc, DefinitionWa
 from pyconform.parsing import parse_definition, VarType, FuncType, OpType
 from pyconform.functions import find_operator, find_function
 from pyconform.physarray import PhysArray
-from pyconform.flownodes import DataNode, ReadNode, EvalNode, iter_dfs
-from pyconform.flownodes import MapNode, ValidateNode, WriteNode
+from pyconform.flownodes import FlowNode, DataNode, ReadNode, EvalNode, iter_dfs
+from pyconform.flownodes import MapNode, ValidateNode, WriteNode, ChunkCache, PRECISIONS
+from pyconform.flownodes import promoted_dtype
+from pyconform.kernels import is_elementwise
+from pyconform.filepool import dataset_pool
+from pyconform.bufferpool import buffer_pool
 from asaptools.simplecomm import create_comm, SimpleComm
 from asaptools.partition import WeightBalanced
 from warnings import warn
+from time import time
+from collections import OrderedDict
+from imp import load_source
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+from multiprocessing import Pool, current_process
 
 import numpy
+import sys
 
 
 #=========================================================================
@@ -44,7 +54,20 @@ class DataFlow(object):
     An object describing the flow of data from input to output
     """
 
-    def __init__(self, inpds, outds):
+    # Assumed throughput rates (bytes read per second, bytes written per second, and weighted
+    # elements computed per second) used to convert the cost estimates into estimated times
+    _READ_RATE_ = 200.0e6
+    _WRITE_RATE_ = 100.0e6
+    _COMPUTE_RATE_ = 200.0e6
+
+    # Available schedules for distributing output files over parallel ranks
+    SCHEDULES = ('static', 'dynamic', 'affinity')
+
+    # Fractional load imbalance (relative to the mean estimated time per rank) allowed when
+    # placing output files on ranks with shared inputs under the 'affinity' schedule
+    _AFFINITY_TOLERANCE_ = 0.1
+
+    def __init__(self, inpds, outds, precision='single', fuse=True):
         """
         Initializer
 
@@ -53,6 +76,13 @@ class DataFlow(object):
                 parsing variable definitions
             outds (OutputDatasetDesc): The output dataset defining the output variables and
                 their definitions or data
+            precision (str, dict): The precision policy for single-precision floating-point
+                input data ('double' to promote it to double precision, or 'single' to keep it
+                in single precision), or a dictionary of output variable names and precision
+                policies (variables not in the dictionary use 'single').  Functions that need
+                double precision always promote their input to double precision.
+            fuse (bool): Whether to evaluate each maximal tree of elementwise operators (+, -, *,
+                /, ** and negation) in the definitions as a single blocked kernel
         """
         # Input dataset
         if not isinstance(inpds, InputDatasetDesc):
@@ -64,6 +94,19 @@ class DataFlow(object):
             raise TypeError('Output dataset must be of OutputDatasetDesc type')
         self._ods = outds
 
+        # Precision policy for each output variable
+        precisions = precision.values() if isinstance(precision, dict) else [precision]
+        for p in precisions:
+            if p not in PRECISIONS:
+                raise ValueError('Precision must be one of {}, not {!r}'.format(
+                    ', '.join(PRECISIONS), p))
+        self._precision = precision
+
+        # Cache of FlowNodes keyed by the structure of the parsed expression they compute, used
+        # to share identical sub-expressions across all output variable definitions
+        self._flowcache = {}
+        self._ndedup = 0
+
         # Create a dictionary of DataNodes from variables with non-string
         # definitions
         datnodes = self._create_data_nodes_()
@@ -72,6 +115,9 @@ class DataFlow(object):
         # definitions
         defnodes = self._create_definition_nodes_(datnodes)
 
+        # Fuse the elementwise operator trees of the definitions into single kernels
+        self._nfused = DataFlow._fuse_elementwise_(defnodes) if fuse else 0
+
         # Compute the definition node info objects (zero-sized physarrays)
         definfos = self._compute_node_infos_(defnodes)
 
@@ -91,11 +137,27 @@ class DataFlow(object):
         # Create the WriteNodes for each time-series output file
         self._writenodes = self._create_write_nodes_()
 
-        # Compute the bytesizes of each output variable
-        varsizes = self._compute_variable_sizes_()
+        # Estimate the cost of writing each output file
+        self._filecosts = self._compute_file_costs_()
+        self._fileinputs = self._compute_file_inputs_()
+
+    def __getstate__(self):
+        """
+        Support pickling, so that the DataFlow can be built once and sent to other processes
 
-        # Compute the file sizes for each output file
-        self._filesizes = self._compute_file_sizes(varsizes)
+        The cache of FlowNodes used while constructing the graph is not needed after construction.
+        """
+        state = self.__dict__.copy()
+        state['_flowcache'] = {}
+        return state
+
+    def _variable_precision_(self, vname):
+        """
+        Return the precision policy of an output variable
+        """
+        if isinstance(self._precision, dict):
+            return self._precision.get(vname, 'single')
+        return self._precision
 
     def _create_data_nodes_(self):
         datnodes = {}
@@ -110,7 +172,7 @@ class DataFlow(object):
                 vdims = vdesc.dimensions.keys()
                 varray = PhysArray(vdata, name=vname,
                                    units=vunits, dimensions=vdims)
-                datnodes[vname] = DataNode(varray)
+                datnodes[vname] = DataNode(varray, precision=self._variable_precision_(vname))
         return datnodes
 
     def _create_definition_nodes_(self, datnodes):
@@ -120,7 +182,8 @@ class DataFlow(object):
             if isinstance(vdesc.definition, basestring):
                 try:
                     pdef = parse_definition(vdesc.definition)
-                    vnode = self._construct_flow_(pdef, datnodes=datnodes)
+                    vnode = self._construct_flow_(pdef, datnodes=datnodes,
+                                                  precision=self._variable_precision_(vname))
                 except VariableNotFoundError, err:
                     warn('{}. Skipping output variable {}.'.format(
                         str(err), vname), DefinitionWarning)
@@ -128,13 +191,121 @@ class DataFlow(object):
                     defnodes[vname] = vnode
         return defnodes
 
-    def _construct_flow_(self, obj, datnodes={}):
+    @property
+    def deduplicated_nodes(self):
+        """The number of FlowNodes eliminated by sharing common sub-expressions"""
+        return self._ndedup
+
+    @property
+    def fused_nodes(self):
+        """The number of operator FlowNodes fused into the elementwise kernels of other nodes"""
+        return self._nfused
+
+    @staticmethod
+    def _fuse_elementwise_(defnodes):
+        """
+        Fuse each maximal tree of elementwise operator EvalNodes into a kernel evaluated by its root
+
+        An operator node is fused into the node that consumes its data only if that is its only
+        consumer and it is also an elementwise operator node.  Returns the number of fused nodes.
+        """
+        consumers = {}
+        nodes = set()
+        for vnode in defnodes.itervalues():
+            consumers[vnode] = consumers.get(vnode, 0) + 1
+            nodes.update(nd for nd in iter_dfs(vnode) if isinstance(nd, FlowNode))
+        for nd in nodes:
+            for inp in nd.inputs:
+                if isinstance(inp, FlowNode):
+                    consumers[inp] = consumers.get(inp, 0) + 1
+
+        fusible = set(nd for nd in nodes if isinstance(nd, EvalNode) and is_elementwise(nd.function))
+        interior = set(inp for nd in fusible for inp in nd.inputs if inp in fusible and consumers[inp] == 1)
+        nfused = 0
+        for nd in fusible - interior:
+            if any(inp in interior for inp in nd.inputs):
+                try:
+                    nd.fuse(interior)
+                except ValueError:
+                    continue  # Invalid units or dimensions are reported when computing the node infos
+                nfused += nd.function.size - 1
+        return nfused
+
+    @staticmethod
+    def _structural_key_(obj):
+        """
+        Compute a hashable key identifying the structure of a parsed definition object
+
+        Parameters:
+            obj: A parsed definition object (VarType, OpType, FuncType or constant)
+        """
+        if isinstance(obj, VarType):
+            return ('var', obj.key, tuple(DataFlow._structural_key_(i) for i in obj.ind))
+        elif isinstance(obj, OpType):
+            return ('op', obj.key, tuple(DataFlow._structural_key_(a) for a in obj.args))
+        elif isinstance(obj, FuncType):
+            args = tuple(DataFlow._structural_key_(a) for a in obj.args)
+            kwds = tuple(sorted((k, DataFlow._structural_key_(obj.kwds[k])) for k in obj.kwds))
+            return ('func', obj.key, args, kwds)
+        elif isinstance(obj, slice):
+            return ('slice', obj.start, obj.stop, obj.step)
+        else:
+            return (type(obj).__name__, obj)
+
+    @staticmethod
+    def _count_nodes_(obj):
+        """
+        Count the number of FlowNodes that would be constructed from a parsed definition object
+        """
+        if isinstance(obj, VarType):
+            return 1
+        elif isinstance(obj, OpType):
+            return 1 + sum(DataFlow._count_nodes_(a) for a in obj.args)
+        elif isinstance(obj, FuncType):
+            return (1 + sum(DataFlow._count_nodes_(a) for a in obj.args) +
+                    sum(DataFlow._count_nodes_(obj.kwds[k]) for k in obj.kwds))
+        else:
+            return 0
+
+    def _promotes_(self, obj):
+        """
+        Whether a parsed definition object reads any single-precision floating-point input data
+
+        Only such objects are constructed differently under the 'double' precision policy.
+        """
+        if isinstance(obj, VarType):
+            vdesc = self._ids.variables.get(obj.key, None)
+            return (vdesc is not None and vdesc.dtype is not None and
+                    promoted_dtype(vdesc.dtype, 'double') != vdesc.dtype)
+        elif isinstance(obj, OpType):
+            return any(self._promotes_(a) for a in obj.args)
+        elif isinstance(obj, FuncType):
+            return (any(self._promotes_(a) for a in obj.args) or
+                    any(self._promotes_(obj.kwds[k]) for k in obj.kwds))
+        else:
+            return False
+
+    def _construct_flow_(self, obj, datnodes={}, precision='single'):
+        if isinstance(obj, (VarType, OpType, FuncType)):
+            if precision == 'double' and not self._promotes_(obj):
+                precision = 'single'
+            key = (precision, DataFlow._structural_key_(obj))
+            if key in self._flowcache:
+                self._ndedup += DataFlow._count_nodes_(obj)
+            else:
+                self._flowcache[key] = self._construct_node_(obj, datnodes=datnodes,
+                                                             precision=precision)
+            return self._flowcache[key]
+        else:
+            return obj
+
+    def _construct_node_(self, obj, datnodes={}, precision='single'):
         if isinstance(obj, VarType):
             vname = obj.key
             if vname in self._ids.variables:
                 indices = numpy.index_exp[tuple(obj.ind)] if len(
                     obj.ind) > 0 else ()
-                return ReadNode(self._ids.variables[vname], index=indices)
+                return ReadNode(self._ids.variables[vname], index=indices, precision=precision)
 
             elif vname in datnodes:
                 return datnodes[vname]
@@ -147,17 +318,17 @@ class DataFlow(object):
             name = obj.key
             nargs = len(obj.args)
             op = find_operator(name, numargs=nargs)
-            args = [self._construct_flow_(arg, datnodes=datnodes)
+            args = [self._construct_flow_(arg, datnodes=datnodes, precision=precision)
                     for arg in obj.args]
             return EvalNode(name, op, *args)
 
         elif isinstance(obj, FuncType):
             name = obj.key
             func = find_function(name)
-            args = [self._construct_flow_(arg, datnodes=datnodes)
+            args = [self._construct_flow_(arg, datnodes=datnodes, precision=precision)
                     for arg in obj.args]
             kwds = {k: self._construct_flow_(
-                obj.kwds[k], datnodes=datnodes) for k in obj.kwds}
+                obj.kwds[k], datnodes=datnodes, precision=precision) for k in obj.kwds}
             return EvalNode(name, func, *args, **kwds)
 
         else:
@@ -170,7 +341,7 @@ class DataFlow(object):
         for name in nodes:
             node = nodes[name]
             try:
-                info = node[None]
+                info = node.info
             except Exception, err:
                 ndef = self._ods.variables[name].definition
                 err_msg = 'Failure to generate variable {!r} info with definition {!r}: {}'.format(
@@ -257,7 +428,7 @@ class DataFlow(object):
         for vname in self._valnodes:
             vnode = self._valnodes[vname]
             for nd in iter_dfs(vnode):
-                if isinstance(nd, EvalNode):
+                if isinstance(nd, EvalNode) and nd.stream_dimension is None:
                     unmapped_sumlike_dimensions.update(nd.sumlike_dimensions)
 
         # Map the sum-like dimensions to output dimensions
@@ -279,23 +450,343 @@ class DataFlow(object):
                 writenodes[wnode.label] = wnode
         return writenodes
 
-    def _compute_variable_sizes_(self):
-        bytesizes = {}
-        for vname in self._valnodes:
-            vdesc = self._ods.variables[vname]
-            vsize = sum(ddesc.size for ddesc in vdesc.dimensions.itervalues())
-            vsize = 1 if vsize == 0 else vsize
-            bytesizes[vname] = vsize * vdesc.dtype.itemsize
-        return bytesizes
+    def _dimension_sizes_(self):
+        dsizes = {}
+        for dname, ddesc in self._ods.dimensions.iteritems():
+            if ddesc.is_set():
+                dsizes[dname] = ddesc.size
+        for dname, ddesc in self._ids.dimensions.iteritems():
+            if ddesc.is_set():
+                dsizes[dname] = ddesc.size
+        return dsizes
+
+    @staticmethod
+    def _info_size_(info, dsizes):
+        size = 1
+        for dname in info.dimensions:
+            size *= dsizes.get(dname, 1)
+        return size
+
+    def _compute_file_costs_(self):
+        """
+        Estimate the cost of writing each output file
+
+        For each output file, this estimates the number of bytes read from the input files, the
+        number of bytes written to the output file, and the amount of computation (the number of
+        data elements into and out of each function, weighted by the function's cost).  These
+        are converted into an estimated time (in seconds) using the assumed throughput rates.
+        The data sizes come from the inferred metadata (info) of each node, so no data is read.
+        """
+        dsizes = self._dimension_sizes_()
+        filecosts = {}
+        for fname, wnode in self._writenodes.iteritems():
+            nodes = set()
+            for vnode in wnode.inputs:
+                nodes.update(nd for nd in iter_dfs(vnode) if isinstance(nd, FlowNode))
+
+            nread = 0
+            ncompute = 0.0
+            for nd in nodes:
+                if isinstance(nd, ReadNode):
+                    nread += nd.nbytes
+                elif isinstance(nd, EvalNode):
+                    nelems = DataFlow._info_size_(nd.info, dsizes)
+                    nelems += sum(DataFlow._info_size_(i.info, dsizes) for i in nd.inputs
+                                  if isinstance(i, FlowNode))
+                    ncompute += nd.cost * nelems
+
+            nwritten = 0
+            for vnode in wnode.inputs:
+                vdesc = self._ods.variables[vnode.label]
+                itemsize = 8 if vdesc.dtype is None else vdesc.dtype.itemsize
+                nwritten += itemsize * DataFlow._info_size_(vnode.info, dsizes)
+
+            seconds = (nread / DataFlow._READ_RATE_ + nwritten / DataFlow._WRITE_RATE_ +
+                       ncompute / DataFlow._COMPUTE_RATE_)
+            filecosts[fname] = {'read': nread, 'written': nwritten, 'compute': ncompute,
+                                'seconds': seconds}
+        return filecosts
+
+    def _compute_file_inputs_(self):
+        """
+        Find the input data read by each output file
+
+        For each output file, this returns a dictionary mapping the (file path, variable name) of
+        each input variable read to the estimated number of bytes read.
+        """
+        fileinputs = {}
+        for fname, wnode in self._writenodes.iteritems():
+            inputs = {}
+            for vnode in wnode.inputs:
+                for nd in iter_dfs(vnode):
+                    if isinstance(nd, ReadNode):
+                        inputs[nd.source] = max(inputs.get(nd.source, 0), nd.nbytes)
+            fileinputs[fname] = inputs
+        return fileinputs
+
+    @staticmethod
+    def _affinity_partition_(costs, inputs, size, tolerance=0.0):
+        """
+        Partition files over ranks, grouping files that read the same inputs
+
+        Files are placed in order of decreasing cost.  Each file is placed on the rank that
+        already reads the most bytes of the file's inputs, among the ranks whose load would not
+        exceed the mean load per rank (times 1 + tolerance).  If no rank has room, then the file
+        is placed on the least loaded rank.
+
+        Parameters:
+            costs (dict): Estimated cost of each file
+            inputs (dict): Dictionary of input names and sizes (in bytes) read by each file
+            size (int): Number of ranks
+            tolerance (float): Fractional load imbalance allowed to keep shared inputs together
+
+        Returns:
+            A list containing the list of files placed on each rank
+        """
+        capacity = (1.0 + tolerance) * sum(costs.itervalues()) / size
+        parts = [[] for _ in xrange(size)]
+        loads = [0.0] * size
+        reads = [set() for _ in xrange(size)]
+        for fname in sorted(costs, key=lambda f: (-costs[f], f)):
+            finputs = inputs[fname]
+            least = min(xrange(size), key=lambda r: (loads[r], r))
+            ranks = [r for r in xrange(size) if loads[r] + costs[fname] <= capacity]
+            if len(ranks) > 0:
+                rank = max(ranks, key=lambda r: (sum(finputs[i] for i in reads[r] if i in finputs),
+                                                 -loads[r], -r))
+            else:
+                rank = least
+            parts[rank].append(fname)
+            loads[rank] += costs[fname]
+            reads[rank].update(finputs)
+        return parts
+
+    def _file_memory_(self, fname, dsizes):
+        """
+        Find the memory needed by each node used to write a file
 
-    def _compute_file_sizes(self, varsizes):
-        filesizes = {}
+        Returns a list of (bytes, output dimensions) tuples, one for each FlowNode in the graph
+        above the file's WriteNode, where the bytes are for the full (unchunked) node data.
+        """
+        nodes = set()
+        for vnode in self._writenodes[fname].inputs:
+            nodes.update(nd for nd in iter_dfs(vnode) if isinstance(nd, FlowNode))
+        memory = []
+        for nd in nodes:
+            info = nd.info
+            if info is None:
+                continue
+            itemsize = 8 if info.dtype is None else numpy.dtype(info.dtype).itemsize
+            nbytes = itemsize * DataFlow._info_size_(info, dsizes)
+            odims = set(self._i2omap.get(d, d) for d in info.dimensions)
+            memory.append((nbytes, odims))
+        return memory
+
+    @staticmethod
+    def _chunk_memory_(memory, chunks, osizes):
+        """
+        Estimate the peak memory (in bytes) needed to write one chunk of a file
+        """
+        total = 0.0
+        for nbytes, odims in memory:
+            for d in odims:
+                if d in chunks:
+                    nbytes *= float(chunks[d]) / osizes[d]
+            total += nbytes
+        return int(total)
+
+    def chunk_sizes(self, memory_limit):
+        """
+        Choose the chunk sizes for each output file to fit within a memory limit
+
+        The peak memory needed to write one chunk of a file is estimated as the total size of all
+        of the data in the file's graph for that chunk.  The file's output dimensions are chunked
+        in order (unlimited dimensions first, then largest first), skipping dimensions that are
+        summed over and string-length dimensions, until the estimate fits within the limit.  If the estimate does not fit even
+        with chunk size 1 along all chunkable dimensions, those chunk sizes are used anyway.
+
+        Parameters:
+            memory_limit (int): Memory limit (in bytes) for writing one chunk
+
+        Returns:
+            dict: A dictionary of file names and (chunks, estimated bytes) tuples, where chunks is
+                an OrderedDict of output dimension names and chunk sizes
+        """
+        dsizes = self._dimension_sizes_()
+        nochunk = set(self._sumlike_dimensions)
+        for vdesc in self._ods.variables.itervalues():
+            if vdesc.dtype is not None and vdesc.dtype.char in 'Sc' and len(vdesc.dimensions) > 0:
+                nochunk.add(vdesc.dimensions.keys()[-1])
+        filechunks = {}
         for fname, wnode in self._writenodes.iteritems():
-            filesizes[fname] = sum(varsizes[vnode.label]
-                                   for vnode in wnode.inputs)
-        return filesizes
+            memory = self._file_memory_(fname, dsizes)
+            odims = []
+            for vnode in wnode.inputs:
+                for d in self._ods.variables[vnode.label].dimensions:
+                    if d not in odims:
+                        odims.append(d)
+            osizes = {d: self._ods.dimensions[d].size for d in odims}
+            candidates = sorted((d for d in odims if d not in nochunk),
+                                key=lambda d: (not self._ods.dimensions[d].unlimited, -osizes[d], d))
+
+            chunks = OrderedDict()
+            for d in candidates:
+                if DataFlow._chunk_memory_(memory, chunks, osizes) <= memory_limit:
+                    break
+                if osizes[d] <= 1:
+                    continue
+                chunks[d] = 1
+                nbytes1 = DataFlow._chunk_memory_(memory, chunks, osizes)
+                if nbytes1 > memory_limit:
+                    continue
+                chunks[d] = osizes[d]
+                perunit = (DataFlow._chunk_memory_(memory, chunks, osizes) - nbytes1) / (osizes[d] - 1.0)
+                chunks[d] = min(osizes[d], 1 + int((memory_limit - nbytes1) // perunit))
+                break
+            filechunks[fname] = (chunks, DataFlow._chunk_memory_(memory, chunks, osizes))
+        return filechunks
+
+    @property
+    def cost_estimates(self):
+        """
+        Dictionary of estimated costs of writing each output file
 
-    def execute(self, chunks={}, serial=False, history=False, scomm=None, deflate=None, debug=False):
+        Each value is a dictionary containing the estimated number of bytes 'read' and 'written',
+        the estimated amount of 'compute' (weighted data elements), and the estimated total time
+        in 'seconds'.
+        """
+        return self._filecosts
+
+    def _set_blocksizes_(self, fname, chunks):
+        """
+        Stream reductions over chunked dimensions in blocks of the chunk size
+        """
+        for vnode in self._writenodes[fname].inputs:
+            for nd in iter_dfs(vnode):
+                if isinstance(nd, EvalNode) and nd.stream_dimension is not None:
+                    odim = self._i2omap.get(nd.stream_dimension, nd.stream_dimension)
+                    nd.set_blocksize(chunks.get(odim, None))
+
+    def _write_file_(self, fname, prefix, options, gcomm=None):
+        verbose = gcomm is None or gcomm.is_manager()
+        if verbose:
+            print '{}: Writing file: {}'.format(prefix, fname)
+        if options['history']:
+            self._writenodes[fname].enable_history()
+        else:
+            self._writenodes[fname].disable_history()
+        start = time()
+        chunks = options['filechunks'].get(fname, options['chunks'])
+        self._set_blocksizes_(fname, chunks)
+        self._writenodes[fname].execute(chunks=chunks, deflate=options['deflate'],
+                                        cache=options['cache'], threads=options['threads'],
+                                        scomm=gcomm, pipeline=options['pipeline'])
+        if verbose:
+            print '{}: Finished writing file: {} ({:.2f} s, estimated {:.2f} s)'.format(
+                prefix, fname, time() - start, self._filecosts[fname]['seconds'])
+
+    def _write_files_(self, fnames, prefix, options):
+        nworkers = min(options['workers'], len(fnames))
+        if nworkers <= 1:
+            for fname in fnames:
+                self._write_file_(fname, prefix, options)
+            return
+
+        # Close all open input files before forking, and send the data flow to each worker
+        # process as a pickle, so that the user-defined modules can be loaded before unpickling
+        dataset_pool().close()
+        fnames = sorted(fnames, key=lambda f: (-self._filecosts[f]['seconds'], f))
+        print '{}: Writing {} files with {} worker processes.'.format(prefix, len(fnames), nworkers)
+        sys.stdout.flush()
+        pool = Pool(nworkers, initializer=_init_worker_,
+                    initargs=(dumps(self, HIGHEST_PROTOCOL), prefix, options))
+        try:
+            for _ in pool.imap_unordered(_write_worker_, fnames):
+                pass
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _execute_static_(self, scomm, prefix, options):
+        fnames = scomm.partition([(fname, cost['seconds']) for fname, cost in self._filecosts.iteritems()],
+                                 func=WeightBalanced(), involved=True)
+        if scomm.is_manager():
+            print 'Writing {} files across {} MPI processes.'.format(len(self._filecosts), scomm.get_size())
+        scomm.sync()
+
+        print '{}: Writing {} files: {}'.format(prefix, len(fnames), ', '.join(fnames))
+        scomm.sync()
+
+        self._write_files_(fnames, prefix, options)
+
+    def _execute_affinity_(self, scomm, prefix, options):
+        costs = {fname: cost['seconds'] for fname, cost in self._filecosts.iteritems()}
+        parts = DataFlow._affinity_partition_(costs, self._fileinputs, scomm.get_size(),
+                                              tolerance=DataFlow._AFFINITY_TOLERANCE_)
+        fnames = parts[scomm.get_rank()]
+        if scomm.is_manager():
+            nread = sum(sum(self._fileinputs[f].itervalues()) for f in self._filecosts)
+            nread_placed = 0
+            for part in parts:
+                inputs = {}
+                for f in part:
+                    inputs.update(self._fileinputs[f])
+                nread_placed += sum(inputs.itervalues())
+            print 'Writing {} files across {} MPI processes, grouped by shared inputs.'.format(
+                len(self._filecosts), scomm.get_size())
+            print 'Estimated input bytes read: {} (vs. {} without grouping)'.format(
+                nread_placed, nread)
+        scomm.sync()
+
+        print '{}: Writing {} files: {}'.format(prefix, len(fnames), ', '.join(fnames))
+        scomm.sync()
+
+        self._write_files_(fnames, prefix, options)
+
+    def _execute_groups_(self, scomm, prefix, options, affinity=False):
+        gsize = min(options['groupsize'], scomm.get_size())
+        ngroups = (scomm.get_size() + gsize - 1) // gsize
+        group = scomm.get_rank() // gsize
+        gcomm, _ = scomm.divide(group)
+
+        costs = {fname: cost['seconds'] for fname, cost in self._filecosts.iteritems()}
+        inputs = self._fileinputs if affinity else {fname: {} for fname in costs}
+        parts = DataFlow._affinity_partition_(costs, inputs, ngroups,
+                                              tolerance=DataFlow._AFFINITY_TOLERANCE_)
+        fnames = parts[group]
+        if scomm.is_manager():
+            mode = 'parallel writes' if WriteNode.parallel_support() else 'gathered writes'
+            print 'Writing {} files across {} groups of up to {} MPI processes ({}).'.format(
+                len(self._filecosts), ngroups, gsize, mode)
+        scomm.sync()
+
+        if gcomm.is_manager():
+            print '{}: Group {} writing {} files: {}'.format(prefix, group, len(fnames), ', '.join(fnames))
+        scomm.sync()
+
+        for fname in fnames:
+            self._write_file_(fname, prefix, options, gcomm=gcomm)
+
+    def _execute_dynamic_(self, scomm, prefix, options):
+        if scomm.is_manager():
+            nworkers = scomm.get_size() - 1
+            print 'Dynamically scheduling {} files across {} MPI worker processes.'.format(
+                len(self._filecosts), nworkers)
+            fnames = sorted(self._filecosts, key=lambda f: (-self._filecosts[f]['seconds'], f))
+            for fname in fnames:
+                scomm.ration(fname)
+            for _ in xrange(nworkers):
+                scomm.ration(None)
+        else:
+            fname = scomm.ration()
+            while fname is not None:
+                self._write_file_(fname, prefix, options)
+                fname = scomm.ration()
+
+    def execute(self, chunks={}, serial=False, history=False, scomm=None, deflate=None, debug=False,
+                cachesize=0, schedule='static', workers=1, modules=(), threads=1, groupsize=1,
+                pipeline=0, memory_limit=0):
         """
         Execute the Data Flow
 
@@ -312,7 +803,54 @@ class DataFlow(object):
                 parallel operation
             deflate (int): Override all output file deflate levels with given value
             debug (bool): Whether to enable some rudimentary debugging features
+            cachesize (int): Number of bytes of memory to use for caching data pulled from nodes
+                shared by multiple consumers within each chunk (0 disables caching)
+            schedule (str): How to distribute the output files over parallel (MPI) ranks.  The
+                'static' schedule partitions the files across all ranks before writing, balanced
+                by estimated cost.  The 'dynamic' schedule has the manager rank hand out files
+                one at a time, longest-expected first, to worker ranks as they become free.  The
+                'affinity' schedule partitions the files like 'static', but places files that
+                read the same input variables on the same rank, as long as the load balance
+                stays within a small tolerance.
+            workers (int): Number of worker processes (on each MPI rank) used to write different
+                files at the same time (not used with the 'dynamic' schedule)
+            modules (list): A list of (name, path) tuples of user-defined modules to load in each
+                worker process before it receives the data flow
+            threads (int): Number of threads used to evaluate the variables and chunks of each
+                file at the same time (all writes to the file are still done by one thread)
+            groupsize (int): Number of parallel (MPI) ranks that write each file together, each
+                computing a different set of chunks.  If the NetCDF library supports parallel
+                writes, each rank writes its own chunks, otherwise the first rank in each group
+                writes the data computed by the others.  (Cannot be used with the 'dynamic'
+                schedule or with multiple worker processes.)
+            pipeline (int): If positive, prefetch the input data of upcoming chunks and compute
+                the data for each file on background threads while already computed data is
+                written, with each stage running at most this many chunks ahead of the next
+                (0 disables pipelining)
+            memory_limit (int): If positive, the approximate number of bytes of memory that may be
+                used (by all threads) to write a chunk of each file.  The chunk sizes of each file
+                are then chosen automatically, and the 'chunks' argument is ignored.
         """
+        # Check the schedule type
+        if schedule not in DataFlow.SCHEDULES:
+            raise ValueError('Unknown schedule {!r}.  Must be one of: {}'.format(
+                schedule, ', '.join(DataFlow.SCHEDULES)))
+
+        # Check the number of worker processes
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError('Number of worker processes must be a positive integer')
+        if not isinstance(threads, int) or threads < 1:
+            raise ValueError('Number of threads must be a positive integer')
+        if not isinstance(groupsize, int) or groupsize < 1:
+            raise ValueError('Number of ranks per group must be a positive integer')
+        if not isinstance(pipeline, int) or pipeline < 0:
+            raise ValueError('Pipeline depth must be a non-negative integer')
+        if not isinstance(memory_limit, (int, long)) or memory_limit < 0:
+            raise ValueError('Memory limit must be a non-negative integer')
+        if groupsize > 1 and (schedule == 'dynamic' or workers > 1):
+            raise ValueError('Groups of ranks cannot be used with the dynamic schedule or with '
+                             'multiple worker processes')
+
         # Check chunks type
         if not isinstance(chunks, dict):
             raise TypeError('Chunks must be specified with a dictionary')
@@ -350,39 +888,93 @@ class DataFlow(object):
         prefix = '[{}/{}]'.format(scomm.get_rank(), scomm.get_size())
         if scomm.is_manager():
             print 'Beginning execution of data flow...'
+            if self._ndedup > 0:
+                print 'Shared common sub-expressions eliminated {} duplicate nodes.'.format(self._ndedup)
+            if self._nfused > 0:
+                print 'Fused {} elementwise operator nodes into kernels.'.format(self._nfused)
             print 'Mapping Input Dimensions to Output Dimensions:'
             for d in sorted(self._i2omap):
                 print '   {} --> {}'.format(d, self._i2omap[d])
-            if len(chunks) > 0:
+            if memory_limit > 0:
+                if len(chunks) > 0:
+                    print 'Ignoring chunk sizes given, because a memory limit was given.'
+            elif len(chunks) > 0:
                 print 'Chunking over Output Dimensions:'
                 for d in chunks:
                     print '   {}: {}'.format(d, chunks[d])
             else:
                 print 'Not chunking output.'
 
-        # Partition the output files/variables over available parallel (MPI)
-        # ranks
-        fnames = scomm.partition(
-            self._filesizes.items(), func=WeightBalanced(), involved=True)
-        if scomm.is_manager():
-            print 'Writing {} files across {} MPI processes.'.format(len(self._filesizes), scomm.get_size())
-        scomm.sync()
+        # Choose the chunk sizes for each file to fit within the memory limit, if given
+        filechunks = {}
+        if memory_limit > 0:
+            for fname, (fchunks, nbytes) in self.chunk_sizes(memory_limit // threads).iteritems():
+                filechunks[fname] = fchunks
+                if scomm.is_manager():
+                    chunkstr = ', '.join('{}: {}'.format(d, c) for d, c in fchunks.iteritems())
+                    print 'Chunking file {} over {} (estimated {} bytes per chunk)'.format(
+                        fname, '{' + chunkstr + '}' if chunkstr else 'nothing', nbytes)
+
+        # Create the per-chunk data cache, if requested
+        cache = ChunkCache(cachesize) if cachesize > 0 else None
+        options = {'chunks': chunks, 'history': history, 'deflate': deflate, 'cache': cache,
+                   'workers': workers, 'modules': tuple(modules), 'threads': threads,
+                   'groupsize': groupsize, 'pipeline': pipeline, 'filechunks': filechunks}
+
+        # Write the output files, scheduled over the available parallel (MPI) ranks
+        if groupsize > 1 and scomm.get_size() > 1:
+            self._execute_groups_(scomm, prefix, options, affinity=(schedule == 'affinity'))
+        elif schedule == 'dynamic' and scomm.get_size() > 1:
+            self._execute_dynamic_(scomm, prefix, options)
+        elif schedule == 'affinity':
+            self._execute_affinity_(scomm, prefix, options)
+        else:
+            self._execute_static_(scomm, prefix, options)
 
-        # Standard output
-        print '{}: Writing {} files: {}'.format(prefix, len(fnames), ', '.join(fnames))
-        scomm.sync()
+        if cache is not None:
+            print '{}: Chunk cache hits: {}, misses: {}'.format(prefix, cache.hits, cache.misses)
 
-        # Loop over output files and write using given chunking
-        for fname in fnames:
-            print '{}: Writing file: {}'.format(prefix, fname)
-            if history:
-                self._writenodes[fname].enable_history()
-            else:
-                self._writenodes[fname].disable_history()
-            self._writenodes[fname].execute(chunks=chunks, deflate=deflate)
-            print '{}: Finished writing file: {}'.format(prefix, fname)
+        # Report the input file pool statistics and close all input files
+        pool = dataset_pool()
+        print '{}: Input file pool hits: {}, misses: {}'.format(prefix, pool.hits, pool.misses)
+        pool.close()
+
+        # Report the temporary buffers reused by arithmetic operators (and free the pooled buffers)
+        bpool = buffer_pool()
+        print '{}: Arithmetic buffer pool bytes allocated: {}, saved: {}'.format(prefix, bpool.allocated, bpool.saved)
+        bpool.clear()
 
         scomm.sync()
         if scomm.is_manager():
             print 'All output variables written.'
             print
+
+
+#=========================================================================
+# Process-pool worker state, set once in each worker process
+#=========================================================================
+_WORKER_ = {}
+
+
+#=========================================================================
+# _init_worker_ - Initialize a worker process for writing files
+#=========================================================================
+def _init_worker_(dfpickle, prefix, options):
+    for modname, modpath in options['modules']:
+        if modname not in sys.modules:
+            load_source(modname, modpath)
+    options = dict(options)
+    if options['cache'] is not None:
+        options['cache'] = ChunkCache(options['cache'].maxbytes)
+    _WORKER_['dataflow'] = loads(dfpickle)
+    _WORKER_['prefix'] = '{}[{}]'.format(prefix, current_process().name)
+    _WORKER_['options'] = options
+
+
+#=========================================================================
+# _write_worker_ - Write a single file in a worker process
+#=========================================================================
+def _write_worker_(fname):
+    _WORKER_['dataflow']._write_file_(fname, _WORKER_['prefix'], _WORKER_['options'])
+    sys.stdout.flush()
+    return fname
@@ -9,13 +9,16 @@ LICENSE: See the LICENSE.rst file for details
 """
 
 from os import linesep
-from os.path import exists
+from os.path import exists, basename
+from re import compile as re_compile
 from copy import deepcopy
 from collections import OrderedDict
 from numpy import dtype
 from netCDF4 import Dataset as NC4Dataset
 from cf_units import Unit
 from warnings import warn
+from multiprocessing import Pool
+from asaptools.partition import Duplicate, EqualStride
 from pyconform.physarray import PhysArray
 
 
@@ -248,6 +251,9 @@ class VariableDesc(object):
         # Initially, no files are associated with the variables, but it is modifiable after construction
         self._files = {}
 
+        # Initially, the variable is not aggregated across files, but it is modifiable after construction
+        self._aggregation = None
+
     @property
     def name(self):
         """Name of the variable"""
@@ -282,6 +288,27 @@ class VariableDesc(object):
         """Dictionary of file descriptors for files containing this variable"""
         return self._files
 
+    @property
+    def aggregation(self):
+        """
+        Tuple of the aggregated dimension name and a tuple of (filename, start, stop) segments
+        giving the range of that dimension stored in each file, or None if not aggregated
+        """
+        return self._aggregation
+
+    @aggregation.setter
+    def aggregation(self, aggregation):
+        """Set the aggregated dimension name and file segments (or None)"""
+        if aggregation is not None:
+            dname, segments = aggregation
+            if dname not in self.dimensions:
+                err_msg = ('Cannot aggregate variable {!r} along dimension {!r} on which it does '
+                           'not depend').format(self.name, dname)
+                raise ValueError(err_msg)
+            segments = tuple((str(f), int(s0), int(s1)) for f, s0, s1 in segments)
+            aggregation = (dname, segments)
+        self._aggregation = aggregation
+
     def __eq__(self, other):
         if not isinstance(other, VariableDesc):
             return False
@@ -602,6 +629,131 @@ class DatasetDesc(object):
         return self._files
 
 
+#===================================================================================================
+# _scan_file_
+#===================================================================================================
+def _scan_file_(fname):
+    """
+    Read the header of a single NetCDF file
+
+    Returns a tuple containing the FileDesc describing the file and a dictionary of the first
+    values of the coordinate variables of its (non-empty) unlimited dimensions.  (This is a
+    module-level function so that it can be sent to other processes.)
+
+    Parameters:
+        fname (str): The name of the NetCDF file to read
+    """
+    with NC4Dataset(fname) as ncfile:
+
+        # Get file format
+        ffmt = ncfile.file_format
+
+        # Get global attributes
+        fattrs = OrderedDict()
+        for aname in ncfile.ncattrs():
+            fattrs[aname] = ncfile.getncattr(aname)
+
+        # Parse variables and their dimensions
+        fvars = []
+        fdims = OrderedDict()
+        for vname, vobj in ncfile.variables.iteritems():
+
+            vattrs = OrderedDict()
+            for vattr in vobj.ncattrs():
+                vattrs[vattr] = vobj.getncattr(vattr)
+
+            for dname in vobj.dimensions:
+                if dname not in fdims:
+                    dobj = ncfile.dimensions[dname]
+                    size = len(dobj)
+                    unlimited = dobj.isunlimited()
+                    slen = True if dname == vobj.dimensions[-1] and vobj.dtype == dtype('S1') else False
+                    fdims[dname] = DimensionDesc(dname, size=size, unlimited=unlimited, stringlen=slen)
+
+            vdims = [fdims[dname] for dname in vobj.dimensions]
+
+            fvars.append(VariableDesc(vname, datatype=vobj.dtype, dimensions=vdims, attributes=vattrs))
+
+        # Get the first values of the unlimited coordinate variables
+        ufirst = {}
+        for dname, dobj in ncfile.dimensions.iteritems():
+            if dobj.isunlimited() and len(dobj) > 0 and dname in ncfile.variables:
+                ufirst[dname] = ncfile.variables[dname][0]
+
+    return FileDesc(fname, format=ffmt, attributes=fattrs, variables=fvars), ufirst
+
+
+#===================================================================================================
+# _probe_file_
+#===================================================================================================
+def _probe_file_(fname):
+    """
+    Return the set of variable names in a NetCDF file (without reading the rest of the header)
+
+    Parameters:
+        fname (str): The name of the NetCDF file to read
+    """
+    with NC4Dataset(fname) as ncfile:
+        return set(ncfile.variables)
+
+
+#===================================================================================================
+# prune_filenames
+#===================================================================================================
+def prune_filenames(filenames, varnames, pattern=None, nprocs=1, cache=None):
+    """
+    Return the subset of input files needed to provide the given input variables
+
+    Every file containing at least one of the given variables is kept, so that all of the files
+    of a series (e.g., the time segments of one variable) are kept, even if some of them contain
+    other variables too.  The variable names in each file are read from the header cache (if
+    given) or from the file.
+
+    If a pattern is given, it should be a regular expression with a group named 'var' that is
+    searched for in the base name of each file.  Files whose names match but with a 'var' group
+    that is not one of the given variable names are skipped without opening them.
+
+    Parameters:
+        filenames (list): List of input filenames
+        varnames (set): Set of input variable names that are needed
+        pattern (str): Regular expression with a 'var' group, matching the file base names
+        nprocs (int): Number of local processes to use to read the variable names
+        cache (HeaderCache): A cache of file headers from which to read the variable names
+    """
+    varnames = set(varnames)
+    regex = None if pattern is None else re_compile(pattern)
+    if regex is not None and 'var' not in regex.groupindex:
+        raise ValueError('Input filename pattern {!r} has no group named \'var\''.format(pattern))
+
+    # Find the files that can be skipped by name alone
+    toprobe = []
+    for fname in filenames:
+        match = None if regex is None else regex.search(basename(fname))
+        if match is None or match.group('var') in varnames:
+            toprobe.append(fname)
+
+    # Read the variable names in each remaining file
+    fvars = OrderedDict()
+    if cache is not None:
+        for fname in toprobe:
+            names = cache.variable_names(fname)
+            if names is not None:
+                fvars[fname] = names
+    uncached = [fname for fname in toprobe if fname not in fvars]
+    if nprocs > 1 and len(uncached) > 1:
+        pool = Pool(min(nprocs, len(uncached)))
+        try:
+            fvars.update(zip(uncached, pool.map(_probe_file_, uncached)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        fvars.update((fname, _probe_file_(fname)) for fname in uncached)
+
+    # Keep the files containing any needed variables
+    return [fname for fname in toprobe if len(fvars[fname] & varnames) > 0]
+
+
 #===================================================================================================
 # InputDatasetDesc
 #===================================================================================================
@@ -614,56 +766,187 @@ class InputDatasetDesc(DatasetDesc):
     standard DatasetDesc definition.
     
     Variables in an InputDatasetDesc must have unset "definition" parameters, and the "filenames"
-    parameter will contain the names of files from which the variable data can be read.  
+    parameter will contain the names of files from which the variable data can be read.
+
+    If "aggregate" is True, then the files may contain consecutive pieces of the same variables
+    along their unlimited dimension (e.g., a series of monthly history files), and each such
+    variable is described as a single (virtual) variable spanning all of the files.  The
+    "aggregation" attribute of each aggregated VariableDesc locates the data in each file.
     """
 
-    def __init__(self, name='input', filenames=()):
+    def __init__(self, name='input', filenames=(), aggregate=False, scomm=None, nprocs=1,
+                 cache=None):
         """
         Initializer
 
         Parameters:
             name (str): String name to optionally give to a dataset
-            filenames (tuple): List of filenames in the dataset
+            filenames (tuple): List of filenames in the dataset (only needed on the manager rank,
+                if a parallel SimpleComm is given)
+            aggregate (bool): Whether to aggregate variables spread across multiple files along
+                their unlimited dimension into single (virtual) variables
+            scomm (SimpleComm): A SimpleComm object used to distribute the reading of the file
+                headers across all ranks (must then be called on all ranks)
+            nprocs (int): Number of local processes to use to read the file headers on each rank
+            cache (HeaderCache): A persistent cache of file headers to reuse (and update) instead
+                of reading the headers of unchanged files
         """
-        files = []
+        scans = InputDatasetDesc._scan_files_(filenames, scomm=scomm, nprocs=nprocs, cache=cache)
+        files = [fdesc for fdesc, _ in scans]
+
+        # Aggregate the unlimited dimensions across files, if requested
+        if aggregate:
+            firsts = {fdesc.name: ufirst for fdesc, ufirst in scans}
+            segments = InputDatasetDesc._aggregate_files_(files, firsts)
+        else:
+            segments = {}
 
-        # Loop over all of the input filenames
-        for fname in filenames:
-            with NC4Dataset(fname) as ncfile:
+        # Call the base class initializer to check self-consistency
+        super(InputDatasetDesc, self).__init__(name, files=files)
 
-                # Get file format
-                ffmt = ncfile.file_format
+        # Store the file segments of each aggregated variable
+        for vname, aggregation in segments.iteritems():
+            self.variables[vname].aggregation = aggregation
 
-                # Get global attributes
-                fattrs = OrderedDict()
-                for aname in ncfile.ncattrs():
-                    fattrs[aname] = ncfile.getncattr(aname)
+    @staticmethod
+    def _scan_files_(filenames, scomm=None, nprocs=1, cache=None):
+        """
+        Read the headers of a list of files, possibly in parallel
 
-                # Parse variables and their dimensions
-                fvars = []
-                fdims = OrderedDict()
-                for vname, vobj in ncfile.variables.iteritems():
+        Headers found in the cache (if given) are reused.  The remaining files are divided across
+        the ranks of the SimpleComm (if given and parallel), and each rank reads its files with a
+        pool of 'nprocs' local processes (if greater than 1).  The results are merged (and newly
+        read headers are stored in the cache) on the manager rank and sent back to all ranks.
+        Returns a list of the results of '_scan_file_' for each file, in the order of the given
+        filenames.
 
-                    vattrs = OrderedDict()
-                    for vattr in vobj.ncattrs():
-                        vattrs[vattr] = vobj.getncattr(vattr)
+        Parameters:
+            filenames (tuple): List of filenames (only needed on the manager rank)
+            scomm (SimpleComm): A SimpleComm object used to distribute the reading
+            nprocs (int): Number of local processes to use to read the file headers
+            cache (HeaderCache): A cache of file headers (only used on the manager rank)
+        """
+        parallel = scomm is not None and scomm.get_size() > 1
+        manager = scomm is None or scomm.is_manager()
+
+        # Look up the cached headers on the manager rank
+        if manager:
+            allnames = list(filenames)
+            scans = OrderedDict()
+            if cache is not None:
+                for fname in allnames:
+                    scan = cache.get(fname)
+                    if scan is not None:
+                        scans[fname] = scan
+            toscan = [fname for fname in allnames if fname not in scans]
+        else:
+            toscan = None
 
-                    for dname in vobj.dimensions:
-                        if dname not in fdims:
-                            dobj = ncfile.dimensions[dname]
-                            size = len(dobj)
-                            unlimited = dobj.isunlimited()
-                            slen = True if dname == vobj.dimensions[-1] and vobj.dtype == dtype('S1') else False
-                            fdims[dname] = DimensionDesc(dname, size=size, unlimited=unlimited, stringlen=slen)
+        if parallel:
+            mynames = scomm.partition(toscan, func=EqualStride(), involved=True)
+        else:
+            mynames = toscan
+
+        if nprocs > 1 and len(mynames) > 1:
+            pool = Pool(min(nprocs, len(mynames)))
+            try:
+                myscans = pool.map(_scan_file_, mynames)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            myscans = [_scan_file_(fname) for fname in mynames]
+
+        if manager:
+            newscans = zip(mynames, myscans)
+            if parallel:
+                for _ in xrange(scomm.get_size() - 1):
+                    _, rscans = scomm.collect()
+                    newscans.extend((fdesc.name, (fdesc, ufirst)) for fdesc, ufirst in rscans)
+            if cache is not None and len(newscans) > 0:
+                cache.update(newscans)
+            scans.update(newscans)
+            scans = [scans[fname] for fname in allnames]
+        else:
+            scomm.collect(myscans)
+            scans = None
 
-                    vdims = [fdims[dname] for dname in vobj.dimensions]
+        if parallel:
+            scans = scomm.partition(scans, func=Duplicate(), involved=True)
+        return scans
 
-                    fvars.append(VariableDesc(vname, datatype=vobj.dtype, dimensions=vdims, attributes=vattrs))
+    @staticmethod
+    def _aggregate_files_(files, firsts):
+        """
+        Aggregate the unlimited dimensions of a list of FileDescs
+
+        The files containing each unlimited dimension are ordered by the first value of the
+        dimension's coordinate variable (or by name, if the coordinate variable is not found in
+        every file), and grouped into series of files containing the same variables along the
+        dimension (e.g., the files of one time-series variable).  Each series must have the same
+        total size along the dimension, and the dimension size in each file is set to this total
+        size.  Returns a
+        dictionary mapping the name of each aggregated variable to a tuple of the dimension name
+        and a list of (filename, start, stop) segments locating the data in the files of the first
+        series containing the variable.
 
-                files.append(FileDesc(fname, format=ffmt, attributes=fattrs, variables=fvars))
+        Parameters:
+            files (list): List of FileDesc objects
+            firsts (dict): Dictionary mapping each filename to a dictionary of the first values of
+                the coordinate variables of its (non-empty) unlimited dimensions
+        """
+        udims = OrderedDict()
+        for fdesc in files:
+            for dname, ddesc in fdesc.dimensions.iteritems():
+                if ddesc.unlimited:
+                    udims[dname] = None
+        if len(udims) > 1:
+            err_msg = ('Cannot aggregate input files along more than one unlimited dimension: '
+                       '{}').format(', '.join(udims))
+            raise ValueError(err_msg)
+
+        segments = {}
+        for dname in udims:
+            dfiles = [fdesc for fdesc in files if dname in fdesc.dimensions]
+
+            # Order the files by the first value of the coordinate (in common units), if possible
+            if all(dname in firsts[fdesc.name] for fdesc in dfiles):
+                units = dfiles[0].variables[dname].cfunits()
+                values = [fdesc.variables[dname].cfunits().convert(firsts[fdesc.name][dname], units)
+                          for fdesc in dfiles]
+                order = sorted(range(len(dfiles)), key=lambda i: (values[i], dfiles[i].name))
+            else:
+                order = sorted(range(len(dfiles)), key=lambda i: dfiles[i].name)
+
+            # Group the files into series containing the same variables along the dimension
+            series = OrderedDict()
+            for i in order:
+                dvars = frozenset(v.name for v in dfiles[i].variables.itervalues() if dname in v.dimensions)
+                series.setdefault(dvars, []).append(dfiles[i])
+
+            # Compute the offsets of each file along the aggregated dimension in each series
+            sizes = OrderedDict()
+            for sfiles in series.itervalues():
+                ssegments = []
+                offset = 0
+                for fdesc in sfiles:
+                    size = fdesc.dimensions[dname].size
+                    ssegments.append((fdesc.name, offset, offset + size))
+                    offset += size
+                sizes[sfiles[0].name] = offset
+                for vname, vdesc in sfiles[0].variables.iteritems():
+                    if dname in vdesc.dimensions and vname not in segments:
+                        segments[vname] = (dname, ssegments)
+            if len(set(sizes.itervalues())) > 1:
+                err_msg = ('Cannot aggregate input file series of different sizes along dimension '
+                           '{!r}: {}').format(dname, ', '.join('{} ({})'.format(f, n)
+                                                             for f, n in sizes.iteritems()))
+                raise ValueError(err_msg)
 
-        # Call the base class initializer to check self-consistency
-        super(InputDatasetDesc, self).__init__(name, files=files)
+            # Set the aggregated dimension size in all files
+            for fdesc in dfiles:
+                fdesc.dimensions[dname].set(DimensionDesc(dname, size=offset, unlimited=True))
+        return segments
 
 
 #===================================================================================================
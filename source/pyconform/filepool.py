@@ -0,0 +1,139 @@
+"""
+NetCDF Dataset Pool
+
+This module contains the DatasetPool class, which keeps a limited number of read-only NetCDF
+datasets open for reuse, so that repeated reads from the same input files do not need to open
+and close the files each time.  Datasets are closed in least-recently-used (LRU) order when the
+maximum number of open datasets is reached.
+
+A single, process-wide pool is returned by the 'dataset_pool' function.
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from netCDF4 import Dataset
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import RLock
+
+
+#=========================================================================
+# DatasetPool
+#=========================================================================
+class DatasetPool(object):
+    """
+    A least-recently-used pool of open, read-only NetCDF datasets
+
+    All access to the datasets in the pool should be done through the 'dataset' context manager,
+    which holds the pool's lock while the dataset is in use.  (The NetCDF library is not
+    thread-safe, so this also serializes NetCDF calls made from multiple threads.)
+    """
+
+    def __init__(self, maxopen=32):
+        """
+        Initializer
+
+        Parameters:
+            maxopen (int): The maximum number of datasets to keep open at once
+        """
+        self._datasets = OrderedDict()
+        self._lock = RLock()
+        self._hits = 0
+        self._misses = 0
+        self.maxopen = maxopen
+
+    @property
+    def maxopen(self):
+        """The maximum number of datasets to keep open at once"""
+        return self._maxopen
+
+    @maxopen.setter
+    def maxopen(self, maxopen):
+        """The maximum number of datasets to keep open at once"""
+        if not isinstance(maxopen, int) or maxopen < 1:
+            raise ValueError('Maximum number of open datasets must be a positive integer')
+        with self._lock:
+            self._maxopen = maxopen
+            self._trim_(maxopen)
+
+    @property
+    def lock(self):
+        """The lock that must be held when using any dataset in the pool"""
+        return self._lock
+
+    @property
+    def hits(self):
+        """The number of dataset requests satisfied by an already-open dataset"""
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of dataset requests that required opening the dataset"""
+        return self._misses
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def __contains__(self, filename):
+        return filename in self._datasets
+
+    def _trim_(self, size):
+        while len(self._datasets) > size:
+            _, ncfile = self._datasets.popitem(last=False)
+            ncfile.close()
+
+    @contextmanager
+    def dataset(self, filename):
+        """
+        Context manager returning the open (read-only) dataset for a given file
+
+        Parameters:
+            filename (str): The name of the NetCDF file to open
+        """
+        with self._lock:
+            if filename in self._datasets:
+                self._hits += 1
+                ncfile = self._datasets.pop(filename)
+            else:
+                self._misses += 1
+                self._trim_(self._maxopen - 1)
+                ncfile = Dataset(filename, 'r')
+            self._datasets[filename] = ncfile
+            yield ncfile
+
+    def close(self, filename=None):
+        """
+        Close datasets in the pool
+
+        Parameters:
+            filename (str): The name of the file to close, or None to close all datasets
+        """
+        with self._lock:
+            if filename is None:
+                self._trim_(0)
+            elif filename in self._datasets:
+                self._datasets.pop(filename).close()
+
+    def reset_counters(self):
+        """
+        Reset the hit and miss counters
+        """
+        self._hits = 0
+        self._misses = 0
+
+
+#=========================================================================
+# The process-wide dataset pool
+#=========================================================================
+_POOL_ = DatasetPool()
+
+
+#=========================================================================
+# dataset_pool
+#=========================================================================
+def dataset_pool():
+    """
+    Return the process-wide DatasetPool
+    """
+    return _POOL_
@@ -7,19 +7,26 @@ Copyright 2017-2018, University Corporation for Atmospheric Research
 LICENSE: See the LICENSE.rst file for details
 """
 
-from pyconform.indexing import index_str, join, align_index, index_tuple
-from pyconform.physarray import PhysArray, CharArray
+from pyconform.indexing import index_str, join, align_index, index_tuple, halo_index, halo_trim
+from pyconform.physarray import PhysArray, CharArray, PhysInfo, getinfo
 from pyconform.datasets import VariableDesc, FileDesc
-from pyconform.functions import Function
+from pyconform.functions import Function, StreamingReduction
+from pyconform.kernels import ElementwiseKernel, is_elementwise
+from pyconform.filepool import dataset_pool
 from cf_units import Unit, num2date
 from datetime import datetime
 from os.path import exists, dirname
 from os import makedirs, rename
 from netCDF4 import Dataset
+from asaptools.partition import Duplicate
 from collections import OrderedDict
 from warnings import warn
+from threading import RLock, Thread, Event
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty, Full
 
 import numpy
+import sys
 
 
 #=========================================================================
@@ -43,6 +50,34 @@ class DateTimeAutoParseWarning(Warning):
     """Warning for not being able to autoparse new filename based on date-time in the file"""
 
 
+#=========================================================================
+# Floating-point precision policies for data read or stored by source FlowNodes
+#   'double': Promote single-precision floating-point data to double precision
+#   'single': Keep single-precision floating-point data in single precision
+#=========================================================================
+PRECISIONS = ('double', 'single')
+
+
+#=========================================================================
+# promoted_dtype
+#=========================================================================
+def promoted_dtype(dtype, precision):
+    """
+    Return the datatype in which data of a given datatype is computed under a precision policy
+
+    Parameters:
+        dtype (dtype): The datatype of the data
+        precision (str): The precision policy (one of PRECISIONS)
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('Precision must be one of {}, not {!r}'.format(', '.join(PRECISIONS),
+                                                                         precision))
+    dtype = numpy.dtype(dtype)
+    if precision == 'double' and issubclass(dtype.type, numpy.floating) and dtype.itemsize < 8:
+        return numpy.dtype(numpy.float64)
+    return dtype
+
+
 #=========================================================================
 # iter_dfs - Depth-First Search Iterator
 #=========================================================================
@@ -113,6 +148,9 @@ class FlowNode(object):
         """
         self._label = label
         self._inputs = list(inputs)
+        self._cache = None
+        self._info = None
+        self._nulldata = None
 
     @property
     def label(self):
@@ -124,6 +162,244 @@ class FlowNode(object):
         """Inputs into this FlowNode"""
         return self._inputs
 
+    @property
+    def info(self):
+        """Metadata (PhysInfo) describing the data returned by this FlowNode"""
+        if self._info is None:
+            self._info = self._infer_()
+        return self._info
+
+    def _infer_(self):
+        """
+        Infer the metadata of this FlowNode's data (by default, from the data returned by index None)
+        """
+        return getinfo(self[None])
+
+    def __getitem__(self, index):
+        """
+        Compute and retrieve the data associated with this FlowNode, using the cache if attached
+
+        The information (zero-size PhysArray) returned when the index is None is computed only
+        once and then stored, since it does not depend on any data.
+        """
+        if index is None:
+            if self._nulldata is None:
+                self._nulldata = self._getitem_(None)
+            return self._nulldata.copy()
+        elif self._cache is not None:
+            return self._cache.get(self, index)
+        else:
+            return self._getitem_(index)
+
+    def _getitem_(self, index):
+        """
+        Compute the data associated with this FlowNode (implemented by derived classes)
+        """
+        raise NotImplementedError('FlowNode {!r} cannot return data'.format(self.label))
+
+
+#=========================================================================
+# ChunkCache
+#=========================================================================
+class ChunkCache(object):
+    """
+    Memoization cache for data pulled from shared FlowNodes while writing a single chunk
+
+    When a FlowNode provides input to more than one downstream FlowNode (i.e., its fan-out is
+    greater than 1), each consumer would otherwise recompute the node's data from scratch.  The
+    ChunkCache stores the data computed by such a node, keyed by the node and the (normalized)
+    requested index, until all of the node's consumers have pulled their data for the current
+    chunk.  Every consumer but the last receives a copy of the stored data, so that consumers
+    are free to modify the data they receive.
+
+    The cache may be used by multiple threads pulling data for the same chunk.  (Two threads
+    requesting the same data at once may both compute it.)
+    """
+
+    def __init__(self, maxbytes=0):
+        """
+        Initializer
+
+        Parameters:
+            maxbytes (int): The maximum number of bytes of data to store in the cache at once
+        """
+        if not isinstance(maxbytes, (int, long)):
+            raise TypeError('Cache size must be an integer number of bytes')
+        self._maxbytes = maxbytes
+        self._nbytes = 0
+        self._entries = {}
+        self._remaining = {}
+        self._hits = 0
+        self._misses = 0
+        self._lock = RLock()
+
+    @property
+    def maxbytes(self):
+        """The maximum number of bytes stored in the cache at once"""
+        return self._maxbytes
+
+    @property
+    def hits(self):
+        """The number of data requests satisfied from the cache"""
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of data requests to cached nodes that required computation"""
+        return self._misses
+
+    @staticmethod
+    def _index_key_(index):
+        if isinstance(index, dict):
+            return tuple(sorted((d, ChunkCache._index_key_(i)) for d, i in index.iteritems()))
+        elif isinstance(index, tuple):
+            return tuple(ChunkCache._index_key_(i) for i in index)
+        elif isinstance(index, slice):
+            return ('slice', index.start, index.stop, index.step)
+        elif isinstance(index, (list, numpy.ndarray)):
+            return ('array', tuple(numpy.ravel(index)))
+        else:
+            return index
+
+    @staticmethod
+    def _nbytes_(data):
+        nbytes = data.nbytes
+        mask = numpy.ma.getmask(data)
+        if mask is not numpy.ma.nomask:
+            nbytes += mask.nbytes
+        return nbytes
+
+    def begin(self, roots):
+        """
+        Attach the cache to all nodes with fan-out greater than 1 in the graph above the roots
+
+        Parameters:
+            roots (list): The FlowNodes that will each be pulled once for the current chunk
+        """
+        self.end()
+        fanout = {}
+        visited = set()
+        tosearch = list(roots)
+        while tosearch:
+            nd = tosearch.pop()
+            if nd in visited:
+                continue
+            visited.add(nd)
+            for inp in nd.inputs:
+                if isinstance(inp, FlowNode):
+                    fanout[inp] = fanout.get(inp, 0) + 1
+                    tosearch.append(inp)
+        for nd, nconsumers in fanout.iteritems():
+            if nconsumers > 1:
+                self._remaining[nd] = nconsumers
+                self._entries[nd] = {}
+                nd._cache = self
+
+    def end(self):
+        """
+        Detach the cache from all nodes and discard all stored data
+        """
+        for nd in self._remaining:
+            nd._cache = None
+        self._remaining = {}
+        self._entries = {}
+        self._nbytes = 0
+
+    def get(self, node, index):
+        """
+        Retrieve data from a node through the cache
+
+        Parameters:
+            node (FlowNode): The FlowNode from which to pull data
+            index: The index of the data to pull
+        """
+        key = ChunkCache._index_key_(index)
+        with self._lock:
+            entries = self._entries[node]
+            self._remaining[node] -= 1
+            last_pull = self._remaining[node] <= 0
+            if key in entries:
+                self._hits += 1
+                data = entries[key]
+                if last_pull:
+                    self._clear_(entries)
+                    return data
+                else:
+                    return data.copy()
+            self._misses += 1
+
+        data = node._getitem_(index)
+
+        with self._lock:
+            shared = False
+            if self._remaining[node] > 0 and key not in entries:
+                nbytes = ChunkCache._nbytes_(data)
+                if self._nbytes + nbytes <= self._maxbytes:
+                    entries[key] = data
+                    self._nbytes += nbytes
+                    shared = True
+            if last_pull:
+                self._clear_(entries)
+
+        return data.copy() if shared else data
+
+    def _clear_(self, entries):
+        self._nbytes -= sum(ChunkCache._nbytes_(d) for d in entries.itervalues())
+        entries.clear()
+
+
+#=========================================================================
+# ReadAheadBuffer
+#=========================================================================
+class ReadAheadBuffer(object):
+    """
+    Data read from ReadNodes ahead of the chunks that need it
+
+    Data read ahead of time for a ReadNode and index is returned (once) by the ReadNode the next
+    time the same index is requested, instead of being read again.  The buffer may be used by
+    multiple threads at once.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._nodes = set()
+        self._lock = RLock()
+
+    def read(self, node, index):
+        """
+        Read data from a ReadNode ahead of time, and attach the buffer to the node
+
+        Parameters:
+            node (ReadNode): The ReadNode from which to read data
+            index: The index of the data to read
+        """
+        data = node._read_(index)
+        with self._lock:
+            self._entries[(node, ChunkCache._index_key_(index))] = data
+            self._nodes.add(node)
+            node._readahead = self
+
+    def pop(self, node, index):
+        """
+        Remove and return the data read ahead of time for a ReadNode and index (or None)
+
+        Parameters:
+            node (ReadNode): The ReadNode from which the data was read
+            index: The index of the data read
+        """
+        with self._lock:
+            return self._entries.pop((node, ChunkCache._index_key_(index)), None)
+
+    def clear(self):
+        """
+        Detach the buffer from all nodes and discard all data read ahead of time
+        """
+        with self._lock:
+            for node in self._nodes:
+                node._readahead = None
+            self._nodes = set()
+            self._entries = {}
+
 
 #=========================================================================
 # DataNode
@@ -135,17 +411,19 @@ class DataNode(FlowNode):
     This is a "source" FlowNode.
     """
 
-    def __init__(self, data):
+    def __init__(self, data, precision='single'):
         """
         Initializer
 
         Parameters:
             data (PhysArray): Data to store in this FlowNode
+            precision (str): Precision policy for floating-point data (one of PRECISIONS)
         """
         # Determine type and upcast, if necessary
         array = PhysArray(data)
-        if issubclass(array.dtype.type, numpy.float) and array.dtype.itemsize < 8:
-            array = array.astype(numpy.float64)
+        dtype = promoted_dtype(array.dtype, precision)
+        if dtype != array.dtype:
+            array = array.astype(dtype)
 
         # Store data
         self._data = array
@@ -153,7 +431,10 @@ class DataNode(FlowNode):
         # Call base class initializer
         super(DataNode, self).__init__(self._data.name)
 
-    def __getitem__(self, index):
+    def _infer_(self):
+        return getinfo(self._data)
+
+    def _getitem_(self, index):
         """
         Compute and retrieve the data associated with this FlowNode operation
         """
@@ -170,7 +451,7 @@ class ReadNode(FlowNode):
     This is a "source" FlowNode.
     """
 
-    def __init__(self, variable, index=slice(None)):
+    def __init__(self, variable, index=slice(None), precision='single'):
         """
         Initializer
 
@@ -178,7 +459,12 @@ class ReadNode(FlowNode):
             variable (VariableDesc): A variable descriptor object
             index (tuple, slice, int, dict): A tuple of slices or ints, or a slice or int,
                 specifying the range of data to read from the file (in file-local indices)
+            precision (str): Precision policy for floating-point data (one of PRECISIONS)
         """
+        if precision not in PRECISIONS:
+            raise ValueError('Precision must be one of {}, not {!r}'.format(', '.join(PRECISIONS),
+                                                                             precision))
+        self._precision = precision
 
         # Check variable descriptor type and existence in the file
         if not isinstance(variable, VariableDesc):
@@ -190,20 +476,43 @@ class ReadNode(FlowNode):
             raise ValueError(
                 'Variable descriptor {} has no associated files'.format(variable.name))
         self._filepath = None
-        for fdesc in variable.files.itervalues():
-            if fdesc.exists():
-                self._filepath = fdesc.name
-                break
+        self._segments = None
+        if variable.aggregation is not None:
+            aggdim, self._segments = variable.aggregation
+            for fname, _, _ in self._segments:
+                if not exists(fname):
+                    raise OSError('File path {!r} not found for aggregated input variable: '
+                                  '{!r}'.format(fname, variable.name))
+            self._filepath = self._segments[0][0]
+        else:
+            for fdesc in variable.files.itervalues():
+                if fdesc.exists():
+                    self._filepath = fdesc.name
+                    break
         if self._filepath is None:
             raise OSError(
                 'File path not found for input variable: {!r}'.format(variable.name))
 
-        # Check that the variable exists in the file
-        with Dataset(self._filepath, 'r') as ncfile:
+        # Check that the variable exists in the file, and read its header information once
+        with dataset_pool().dataset(self._filepath) as ncfile:
             if variable.name not in ncfile.variables:
                 raise OSError('Variable {!r} not found in NetCDF file: {!r}'.format(
                     variable.name, self._filepath))
+            ncvar = ncfile.variables[variable.name]
+            attrs = {a: ncvar.getncattr(a) for a in ncvar.ncattrs()}
+            self._dimensions = ncvar.dimensions
+            self._shape = ncvar.shape
+            self._dtype = ncvar.dtype
+
+        # The shape of an aggregated variable spans all of its files
+        if self._segments is not None:
+            self._aggaxis = self._dimensions.index(aggdim)
+            shape = list(self._shape)
+            shape[self._aggaxis] = self._segments[-1][2]
+            self._shape = tuple(shape)
         self._variable = variable.name
+        self._units = ReadNode._read_units_(attrs)
+        self._positive = attrs.get('positive', None)
 
         # Check if the index means "all"
         is_all = False
@@ -224,64 +533,191 @@ class ReadNode(FlowNode):
             label = '{}[{}]'.format(variable.name, index_str(index))
         super(ReadNode, self).__init__(label)
 
-    def __getitem__(self, index):
+        # Buffer of data read ahead of time (attached while writing a file in a pipeline)
+        self._readahead = None
+
+    @property
+    def shape(self):
+        """Shape of the data read from file (after applying the reading index)"""
+        index1 = align_index(self._index, self._dimensions)
+        return tuple(len(xrange(*i.indices(n))) for i, n in zip(index1, self._shape)
+                     if isinstance(i, slice))
+
+    @property
+    def nbytes(self):
+        """Number of bytes read from file (after applying the reading index)"""
+        return int(numpy.prod(self.shape, dtype=numpy.int64)) * self._dtype.itemsize
+
+    @property
+    def source(self):
+        """The (file path, variable name) tuple identifying the input data read"""
+        return self._filepath, self._variable
+
+    @property
+    def precision(self):
+        """The precision policy for floating-point data read from file"""
+        return self._precision
+
+    @staticmethod
+    def _read_units_(attrs):
+        units_attr = attrs.get('units', 1)
+        calendar_attr = attrs.get('calendar', None)
+        try:
+            units = Unit(units_attr, calendar=calendar_attr)
+        except ValueError:
+            msg = 'Units {!r} unrecognized in UDUNITS.  Assuming unitless.'.format(
+                units_attr)
+            warn(msg, UnitsWarning)
+            units = Unit(1)
+        except:
+            raise
+        return units
+
+    def _infer_(self):
+        index1 = align_index(self._index, self._dimensions)
+        dimensions = tuple(d for d, i in zip(self._dimensions, index1) if isinstance(i, slice))
+        if self._dtype.char in ('S', 'U'):
+            return PhysInfo(self.label, units=Unit('no unit'), dimensions=dimensions, dtype='S1')
+        dtype = promoted_dtype(self._dtype, self._precision)
+        return PhysInfo(self.label, units=self._units, dimensions=dimensions, dtype=dtype,
+                        positive=self._positive)
+
+    def _getitem_(self, index):
+        """
+        Read PhysArray from file (or from the data read ahead of time, if attached)
+        """
+        if self._readahead is not None:
+            data = self._readahead.pop(self, index)
+            if data is not None:
+                return data
+        return self._read_(index)
+
+    def _read_(self, index):
         """
         Read PhysArray from file
         """
-        with Dataset(self._filepath, 'r') as ncfile:
+        # Align the read-indices on dimensions
+        index1 = align_index(self._index, self._dimensions)
 
-            # Get a reference to the variable
-            ncvar = ncfile.variables[self._variable]
+        # Get the dimensions after application of the first index
+        dimensions1 = tuple(d for d, i in zip(
+            self._dimensions, index1) if isinstance(i, slice))
 
-            # Get the attributes into a dictionary, for convenience
-            attrs = {a: ncvar.getncattr(a) for a in ncvar.ncattrs()}
+        # Align the second index on the intermediate dimensions
+        index2 = align_index(index, dimensions1)
 
-            # Read the variable units
-            units_attr = attrs.get('units', 1)
-            calendar_attr = attrs.get('calendar', None)
-            try:
-                units = Unit(units_attr, calendar=calendar_attr)
-            except ValueError:
-                msg = 'Units {!r} unrecognized in UDUNITS.  Assuming unitless.'.format(
-                    units_attr)
-                warn(msg, UnitsWarning)
-                units = Unit(1)
-            except:
-                raise
+        # Get the dimensions after application of the second index
+        dimensions2 = tuple(d for d, i in zip(
+            dimensions1, index2) if isinstance(i, slice))
 
-            # Read the original variable dimensions
-            dimensions0 = ncvar.dimensions
+        # Compute the joined index object
+        index12 = join(self._shape, index1, index2)
 
-            # Read the original variable shape
-            shape0 = ncvar.shape
+        # Read the data from the (pooled) open file(s)
+        if self._segments is None:
+            with dataset_pool().dataset(self._filepath) as ncfile:
+                data = ncfile.variables[self._variable][index12]
+        else:
+            data = self._read_segments_(index12)
 
-            # Align the read-indices on dimensions
-            index1 = align_index(self._index, dimensions0)
+        # Upconvert, if required by the precision policy
+        dtype = promoted_dtype(self._dtype, self._precision)
+        if dtype != self._dtype:
+            data = data.astype(dtype)
 
-            # Get the dimensions after application of the first index
-            dimensions1 = tuple(d for d, i in zip(
-                dimensions0, index1) if isinstance(i, slice))
+        return PhysArray(data, name=self.label, units=self._units, dimensions=dimensions2,
+                         positive=self._positive)
 
-            # Align the second index on the intermediate dimensions
-            index2 = align_index(index, dimensions1)
+    def _read_segments_(self, index):
+        """
+        Read data from only the files of an aggregated variable that overlap the given index
 
-            # Get the dimensions after application of the second index
-            dimensions2 = tuple(d for d, i in zip(
-                dimensions1, index2) if isinstance(i, slice))
+        Parameters:
+            index (tuple): Tuple of slices or ints, in aggregated-variable indices
+        """
+        axis = self._aggaxis
+        size = self._shape[axis]
+        aggidx = index[axis]
+
+        # An integer index is found in exactly one file
+        if not isinstance(aggidx, slice):
+            i = aggidx + size if aggidx < 0 else aggidx
+            for fname, start, stop in self._segments:
+                if start <= i < stop:
+                    local = index[:axis] + (i - start,) + index[axis + 1:]
+                    with dataset_pool().dataset(fname) as ncfile:
+                        return ncfile.variables[self._variable][local]
+            raise IndexError('Index {} out of range for aggregated variable {!r}'.format(
+                aggidx, self._variable))
+
+        # A slice index may span multiple files, with their pieces joined in slice order
+        start0, stop0, step0 = aggidx.indices(size)
+        positions = numpy.arange(start0, stop0, step0)
+        ascending = positions[::-1] if step0 < 0 else positions
+        pieces = []
+        for fname, start, stop in self._segments:
+            lo, hi = numpy.searchsorted(ascending, [start, stop])
+            if lo == hi:
+                continue
+            first = int(ascending[lo]) - start
+            last = int(ascending[hi - 1]) - start
+            if step0 > 0:
+                local = slice(first, last + 1, step0)
+            else:
+                local = slice(last, first - 1 if first > 0 else None, step0)
+            with dataset_pool().dataset(fname) as ncfile:
+                pieces.append(ncfile.variables[self._variable][index[:axis] + (local,) + index[axis + 1:]])
+        if step0 < 0:
+            pieces.reverse()
+
+        if len(pieces) == 0:
+            local = index[:axis] + (slice(0, 0),) + index[axis + 1:]
+            with dataset_pool().dataset(self._filepath) as ncfile:
+                return ncfile.variables[self._variable][local]
+        elif len(pieces) == 1:
+            return pieces[0]
+        else:
+            outaxis = sum(1 for i in index[:axis] if isinstance(i, slice))
+            return numpy.ma.concatenate(pieces, axis=outaxis)
 
-            # Compute the joined index object
-            index12 = join(shape0, index1, index2)
 
-            data = ncvar[index12]
+#=========================================================================
+# PromotedInput
+#=========================================================================
+class PromotedInput(object):
+    """
+    Input to a function that promotes single-precision floating-point data from a FlowNode
 
-            # Upconvert, if possible
-            if issubclass(ncvar.dtype.type, numpy.float) and ncvar.dtype.itemsize < 8:
-                data = data.astype(numpy.float64)
+    This is used for the input of functions that need double precision (e.g., accumulating
+    reductions), regardless of the precision policy of the FlowNode itself.
+    """
 
-            # Read the positive attribute, if available
-            pos = attrs.get('positive', None)
+    def __init__(self, node):
+        """
+        Initializer
 
-        return PhysArray(data, name=self.label, units=units, dimensions=dimensions2, positive=pos)
+        Parameters:
+            node (FlowNode): The FlowNode providing the data
+        """
+        self._node = node
+
+    @property
+    def info(self):
+        """Metadata (PhysInfo) describing the promoted data"""
+        info = self._node.info
+        dtype = promoted_dtype(info.dtype, 'double')
+        if dtype == info.dtype:
+            return info
+        return PhysInfo(info.name, units=info.units, dimensions=info.dimensions, dtype=dtype,
+                        positive=info.positive)
+
+    def __getitem__(self, index):
+        data = self._node[index]
+        if isinstance(data, PhysArray):
+            dtype = promoted_dtype(data.dtype, 'double')
+            if dtype != data.dtype:
+                data = data.astype(dtype)
+        return data
 
 
 #=========================================================================
@@ -311,15 +747,40 @@ class EvalNode(FlowNode):
             args (list): Arguments to the function given by 'func'
             kwds (dict): Keyword arguments to the function given by 'func'
         """
-        # Initialize the function object
-        self._function = func(*args, **kwds)
-
         # Include all references as input
         allargs = tuple(args) + tuple(kwds[k] for k in kwds)
 
+        # Promote the input of functions that need double precision
+        if getattr(func, 'precision', None) == 'double':
+            args = [PromotedInput(a) if isinstance(a, FlowNode) else a for a in args]
+            kwds = {k: PromotedInput(v) if isinstance(v, FlowNode) else v
+                    for k, v in kwds.iteritems()}
+
+        # Initialize the function object
+        self._function = func(*args, **kwds)
+
         # Call the base class initialization
         super(EvalNode, self).__init__(label, *allargs)
 
+    @property
+    def function(self):
+        """The function object evaluated by the node"""
+        return self._function
+
+    def fuse(self, interior):
+        """
+        Evaluate the node's function, and the functions of interior nodes above it, as one kernel
+
+        The node's function must be an elementwise operator, and the interior nodes must be EvalNodes
+        with elementwise operators whose only consumers are other nodes in the same tree.  The leaves
+        of the fused tree become the inputs of the node.
+
+        Parameters:
+            interior (set): The EvalNodes to fuse into this node
+        """
+        self._function = ElementwiseKernel(self._function, interior)
+        self._inputs = [leaf for leaf in self._function.arguments if isinstance(leaf, FlowNode)]
+
     @property
     def sumlike_dimensions(self):
         """
@@ -330,11 +791,77 @@ class EvalNode(FlowNode):
         else:
             return set()
 
-    def __getitem__(self, index):
+    @property
+    def halo_widths(self):
+        """
+        Return the dictionary of stencil dimensions and (before, after) halo widths of the function
+        """
+        if isinstance(self._function, Function):
+            return self._function.halo_widths
+        else:
+            return {}
+
+    @property
+    def stream_dimension(self):
+        """
+        The dimension along which the node's function streams its input in blocks, if any
+
+        The sum-like dimensions of a node with a streaming function can be chunked.
+        """
+        if isinstance(self._function, StreamingReduction):
+            return self._function.stream_dimension
+        else:
+            return None
+
+    def set_blocksize(self, blocksize):
+        """
+        Set the number of elements along the stream dimension pulled from the input at once
+
+        Parameters:
+            blocksize (int): The block size, or None to pull the entire input at once
+        """
+        if isinstance(self._function, StreamingReduction):
+            self._function.blocksize = blocksize
+
+    @property
+    def cost(self):
+        """
+        Relative compute cost of the node's function, per element of input and output data
+        """
+        return getattr(self._function, 'cost', 1.0)
+
+    def _infer_(self):
+        infer = getattr(self._function, 'infer', None)
+        info = infer() if infer is not None else None
+        return super(EvalNode, self)._infer_() if info is None else info
+
+    def _getitem_(self, index):
         """
         Compute and retrieve the data associated with this FlowNode operation
+
+        If the function has stencil dimensions, the data is computed over an index widened by
+        the function's halo along those dimensions, and then the halo is trimmed from the result.
+        An index along a stencil dimension that cannot be widened raises an IndexError.
         """
-        return self._function[index]
+        halos = self.halo_widths
+        if not isinstance(index, dict) or not any(d in index for d in halos):
+            return self._function[index]
+
+        hindex = dict(index)
+        for d in halos:
+            if d in index:
+                hindex[d] = halo_index(index[d], *halos[d])
+                if hindex[d] is index[d]:
+                    raise IndexError(('Cannot widen index {!r} along stencil dimension {!r} of '
+                                      'EvalNode {!r}').format(index[d], d, self.label))
+        data = self._function[hindex]
+        if not isinstance(data, PhysArray):
+            return data
+        trim = {}
+        for i, d in enumerate(data.dimensions):
+            if d in halos and d in index:
+                trim[d] = halo_trim(index[d], hindex[d], data.shape[i])
+        return data[trim]
 
 
 #=========================================================================
@@ -380,43 +907,46 @@ class MapNode(FlowNode):
         # Call base class initializer
         super(MapNode, self).__init__(label, dnode)
 
-    def __getitem__(self, index):
-        """
-        Compute and retrieve the data associated with this FlowNode operation
-        """
-
-        # Request the input information without pulling data
-        inp_info = self.inputs[0][None]
+        # Request the input information (without pulling data) once, to be reused
+        inp_info = dnode.info
 
         # Get the input data dimensions
-        inp_dims = inp_info.dimensions
+        self._inp_dims = inp_info.dimensions
 
         # The input/output dimensions will be the same
         # OR should be contained in the input-to-output dimension map
-        out_dims = tuple(self._i2omap.get(d, d) for d in inp_dims)
+        self._out_dims = tuple(self._i2omap.get(d, d) for d in self._inp_dims)
 
-        # Compute the input index in terms of input dimensions
-        if index is None:
-            inp_index = None
+        # Compute the name of the mapped data
+        if self._inp_dims == self._out_dims:
+            self._name = inp_info.name
+        else:
+            self._name = 'map({}, from=[{}], to=[{}])'.format(
+                inp_info.name, ','.join(self._inp_dims), ','.join(self._out_dims))
 
-        elif isinstance(index, dict):
-            inp_index = dict((self._o2imap.get(d, d), i)
-                             for d, i in index.iteritems())
+    def _infer_(self):
+        inp_info = self.inputs[0].info
+        return PhysInfo(self._name, units=inp_info.units, dimensions=self._out_dims, dtype=inp_info.dtype,
+                        positive=inp_info.positive)
 
+    def _input_index_(self, index):
+        """
+        Compute the index of the input data (in terms of input dimensions) from an output index
+        """
+        if index is None:
+            return None
+        elif isinstance(index, dict):
+            return dict((self._o2imap.get(d, d), i) for d, i in index.iteritems())
         else:
-            out_index = index_tuple(index, len(inp_dims))
-            inp_index = dict((self._o2imap.get(d, d), i)
-                             for d, i in zip(out_dims, out_index))
-
-        # Return the mapped data
-        idims_str = ','.join(inp_dims)
-        odims_str = ','.join(out_dims)
-        if inp_dims == out_dims:
-            name = inp_info.name
-        else:
-            name = 'map({}, from=[{}], to=[{}])'.format(
-                inp_info.name, idims_str, odims_str)
-        return PhysArray(self.inputs[0][inp_index], name=name, dimensions=out_dims)
+            out_index = index_tuple(index, len(self._inp_dims))
+            return dict((self._o2imap.get(d, d), i) for d, i in zip(self._out_dims, out_index))
+
+    def _getitem_(self, index):
+        """
+        Compute and retrieve the data associated with this FlowNode operation
+        """
+        return PhysArray(self.inputs[0][self._input_index_(index)], name=self._name,
+                         dimensions=self._out_dims)
 
 
 #=========================================================================
@@ -467,7 +997,7 @@ class ValidateNode(FlowNode):
         self._vdesc = vdesc
 
         # Initialize the history attribute, if necessary
-        info = dnode[None]
+        info = dnode.info
         if 'history' not in self.attributes:
             self.attributes['history'] = info.name
 
@@ -506,7 +1036,23 @@ class ValidateNode(FlowNode):
         """
         return tuple(self._vdesc.dimensions.keys())
 
-    def __getitem__(self, index):
+    def _infer_(self):
+        info = self.inputs[0].info.copy()
+        if self._vdesc.dtype is not None:
+            if not numpy.can_cast(info.dtype, self._vdesc.dtype, casting='same_kind'):
+                raise TypeError(('Cannot cast datatype {!s} to {!s} in ValidateNode '
+                                 '{!r}').format(info.dtype, self._vdesc.dtype, self.label))
+            info.dtype = self._vdesc.dtype
+        if 'units' in self.attributes:
+            info.units = Unit(self.attributes['units'], calendar=self.attributes.get('calendar', None))
+        if self.dimensions != info.dimensions:
+            info = info.transpose(self.dimensions)
+        positive = self.attributes.get('positive', None)
+        if positive is not None and info.positive != positive:
+            info.flip()
+        return info
+
+    def _getitem_(self, index):
         """
         Compute and retrieve the data associated with this FlowNode operation
         """
@@ -534,7 +1080,7 @@ class ValidateNode(FlowNode):
                     indata.units = ounits
                 else:
                     try:
-                        indata = indata.convert(ounits)
+                        indata = indata.convert(ounits, inplace=True)
                     except Exception as err:
                         err_msg = 'When validating output variable {}: {}'.format(
                             self.label, err)
@@ -579,7 +1125,10 @@ class ValidateNode(FlowNode):
 
         # Compute mean of the absolute value, if necessary
         if ok_min_mean_abs or ok_max_mean_abs:
-            mean_abs = numpy.mean(numpy.abs(indata))
+            if numpy.ma.getmask(indata) is numpy.ma.nomask:
+                mean_abs = numpy.mean(numpy.abs(numpy.ma.getdata(indata)))
+            else:
+                mean_abs = numpy.mean(numpy.abs(indata))
 
         # Validate minimum mean abs
         if ok_min_mean_abs:
@@ -743,11 +1292,39 @@ class WriteNode(FlowNode):
         """
         self._unwritten_attributes.add('history')
 
-    def _open_(self, deflate=None):
+    def _inverted_dims_(self):
+        """
+        Determine the output dimensions that must be inverted to match the coordinate directions
+        """
+        idims = set()
+        for vnode in self.inputs:
+            vname = vnode.label
+            vdesc = self._filedesc.variables[vname]
+            if len(vdesc.dimensions) == 1 and 'axis' in vnode.attributes:
+                if 'direction' in vnode.attributes:
+                    vdir_out = vnode.attributes['direction']
+                    if vdir_out not in ['increasing', 'decreasing']:
+                        raise ValueError(('Unrecognized direction in output coordinate variable '
+                                          '{!r} when writing file {!r}').format(vname, self.label))
+                    vdir_inp = WriteNode._direction_(vnode[:])
+                    if vdir_inp is None:
+                        raise ValueError(('Output coordinate variable {!r} has no calculable '
+                                          'direction').format(vname))
+                    if vdir_inp != vdir_out:
+                        idims.add(vdesc.dimensions.keys()[0])
+        return idims
+
+    def _open_(self, deflate=None, scomm=None):
         """
         Open the file for writing, if not open already
+
+        Parameters:
+            deflate (int): Override the output file deflate level with given value
+            scomm (SimpleComm): If given (with more than one rank), all of its ranks open the file
+                together for parallel writing (requires NetCDF with parallel support)
         """
         if self._file is None:
+            parallel = scomm is not None and scomm.get_size() > 1
 
             # Make the necessary subdirectories to open the file
             fname = self.label
@@ -766,16 +1343,23 @@ class WriteNode(FlowNode):
 
             # Try to open the output file for writing
             try:
-                self._file = Dataset(tmp_fname, 'w', format=fmt)
+                if parallel:
+                    from mpi4py import MPI
+                    self._file = Dataset(tmp_fname, 'w', format=fmt, parallel=True,
+                                         comm=scomm._comm, info=MPI.Info())
+                else:
+                    self._file = Dataset(tmp_fname, 'w', format=fmt)
             except:
                 raise IOError('Failed to open output file {!r}'.format(fname))
 
-            # Write the global attributes
-            self._filedesc.attributes['creation_date'] = datetime.utcnow(
-            ).strftime('%Y-%m-%dT%H:%M:%SZ')
+            # Write the global attributes (the same on all ranks writing in parallel)
+            creation_date = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+            if parallel:
+                creation_date = scomm.partition(creation_date, func=Duplicate(), involved=True)
+            self._filedesc.attributes['creation_date'] = creation_date
             self._file.setncatts(self._filedesc.attributes)
 
-            # Scan over variables for coordinates and dimension information
+            # Scan over variables for dimension information
             req_dims = set()
             for vnode in self.inputs:
                 vname = vnode.label
@@ -788,19 +1372,8 @@ class WriteNode(FlowNode):
                                         'in file {!r}').format(dname, vname, fname))
                     req_dims.add(dname)
 
-                # Determine coordinates and dimensions to invert
-                if len(vdesc.dimensions) == 1 and 'axis' in vnode.attributes:
-                    if 'direction' in vnode.attributes:
-                        vdir_out = vnode.attributes['direction']
-                        if vdir_out not in ['increasing', 'decreasing']:
-                            raise ValueError(('Unrecognized direction in output coordinate variable '
-                                              '{!r} when writing file {!r}').format(vname, fname))
-                        vdir_inp = WriteNode._direction_(vnode[:])
-                        if vdir_inp is None:
-                            raise ValueError(('Output coordinate variable {!r} has no calculable '
-                                              'direction').format(vname))
-                        if vdir_inp != vdir_out:
-                            self._idims.add(vdesc.dimensions.keys()[0])
+            # Determine the dimensions to invert
+            self._idims = self._inverted_dims_()
 
             # Create the required dimensions in the file
             for dname in req_dims:
@@ -848,17 +1421,24 @@ class WriteNode(FlowNode):
                                     avalue, idimstr)
                         ncvar.setncattr(aname, avalue)
 
-    def _close_(self):
+    def _close_(self, scomm=None):
         """
         Close the file associated with the WriteNode
+
+        Parameters:
+            scomm (SimpleComm): If given, the ranks that opened the file together (only the
+                manager rank renames the file, after all ranks have closed it)
         """
         if self._file is not None:
             self._file.close()
             self._idims = set()
             self._file = None
-            tmp_fname = '{}{}'.format(self.label, self._tmp_ext)
-            if exists(tmp_fname):
-                rename(tmp_fname, self.label)
+            if scomm is not None:
+                scomm.sync()
+            if scomm is None or scomm.is_manager():
+                tmp_fname = '{}{}'.format(self.label, self._tmp_ext)
+                if exists(tmp_fname):
+                    rename(tmp_fname, self.label)
 
     @staticmethod
     def _chunk_iter_(dsizes, chunks={}):
@@ -917,25 +1497,50 @@ class WriteNode(FlowNode):
         else:
             return None
 
-    def execute(self, chunks={}, deflate=None):
+    @staticmethod
+    def _evaluate_(task):
+        vnode, rchunk, wchunk = task
+        return vnode, wchunk, vnode[rchunk]
+
+    def _evaluate_tasks_(self, tasks, pool=None, cache=None):
         """
-        Execute the writing of the WriteNode file at once
+        Evaluate the data for a list of (variable node, read-chunk, write-chunk) tasks
 
-        This method efficiently writes all of the data for each file only once, chunking
-        the data according to the 'chunks' parameter, as needed.
+        If a thread pool is given, the data is evaluated on the pool's threads, and each
+        (variable node, write-chunk, data) result is yielded as soon as it is ready.
+        """
+        # Attach the cache to shared nodes needed for these tasks
+        if cache is not None:
+            cache.begin([vnode for vnode, _, _ in tasks])
+
+        try:
+            if pool is None:
+                for task in tasks:
+                    yield WriteNode._evaluate_(task)
+            else:
+                for result in pool.imap_unordered(WriteNode._evaluate_, tasks):
+                    yield result
+        finally:
+            if cache is not None:
+                cache.end()
 
-        Parameters:
-            chunks (dict): A dictionary of output dimension names and chunk sizes for each
-                dimension given.  Output dimensions not included in the dictionary will not be
-                chunked.  (Use OrderedDict to preserve order of dimensions, where the first
-                dimension will be assumed to correspond to the fastest-varying index and the last
-                dimension will be assumed to correspond to the slowest-varying index.)
-            deflate (int): Override the output file deflate level with given value
+    def _write_data_(self, vname, wchunk, vdata):
+        """
+        Write data for one variable and write-chunk to the open file
         """
+        ncvar = self._file.variables[vname]
+        if isinstance(vdata, CharArray):
+            vdata = vdata.stretch(ncvar.shape[-1])
+        with dataset_pool().lock:
+            ncvar[wchunk] = vdata
 
-        # Open the file and write the header information
-        self._open_(deflate=deflate)
+    def _chunk_tasks_(self, chunks={}):
+        """
+        Generate the list of (variable node, read-chunk, write-chunk) tasks for each chunk
 
+        Each variable chunk is only included once (the first time it is needed).  The dimensions
+        to invert must be determined before generating the tasks.
+        """
         # Create data structure to keep track of which variable chunks we have written
         vchunks = {vnode.label: set() for vnode in self.inputs}
 
@@ -953,23 +1558,279 @@ class WriteNode(FlowNode):
             # Invert the necessary dimensions to get the read-chunk
             rchunk = self._invert_dims_(gdims, chunk, idims=self._idims)
 
-            # Loop over all variables and write the data, if necessary
+            # Find the variables (and their write-chunks) that have not already been written
+            tasks = []
             for vnode in self.inputs:
-                vname = vnode.label
-                vdesc = self._filedesc.variables[vname]
-                ncvar = self._file.variables[vname]
-
-                # Compute the write-chunk for the given variable
+                vdesc = self._filedesc.variables[vnode.label]
                 wchunk = tuple(chunk[d] for d in vdesc.dimensions)
+                if repr(wchunk) not in vchunks[vnode.label]:
+                    vchunks[vnode.label].add(repr(wchunk))
+                    tasks.append((vnode, rchunk, wchunk))
+            yield tasks
+
+    @staticmethod
+    def _windows_(chunktasks, nwindow=1):
+        """
+        Join the task lists of every 'nwindow' consecutive chunks
+        """
+        tasks = []
+        nchunks = 0
+        for ctasks in chunktasks:
+            tasks.extend(ctasks)
+            nchunks += 1
+            if nchunks == nwindow:
+                yield tasks
+                tasks = []
+                nchunks = 0
+        if nchunks > 0:
+            yield tasks
+
+    @staticmethod
+    def parallel_support():
+        """
+        Whether the NetCDF library supports parallel writing of a file by multiple MPI ranks
+        """
+        import netCDF4
+        return bool(getattr(netCDF4, '__has_parallel4_support__', False))
 
-                # Write the data to the variable, if it hasn't already been
-                # written
-                if repr(wchunk) not in vchunks[vname]:
-                    vdata = vnode[rchunk]
-                    if isinstance(vdata, CharArray):
-                        vdata = vdata.stretch(ncvar.shape[-1])
-                    ncvar[wchunk] = vdata
-                    vchunks[vname].add(repr(wchunk))
-
-        # Close the file after completion
-        self._close_()
+    @staticmethod
+    def _read_plan_(node, index, plan):
+        """
+        Add the ReadNode reads needed to evaluate a node at an index to an ordered plan of reads
+
+        Only the reads found along paths that pass the index to their inputs in a predictable way
+        (through ValidateNodes, MapNodes and elementwise EvalNodes without halos) are added.  The
+        plan is an OrderedDict mapping unique (ReadNode, index) keys to (ReadNode, index) pairs.
+
+        Parameters:
+            node (FlowNode): The node to be evaluated
+            index: The index at which the node will be evaluated
+            plan (OrderedDict): The plan of reads to which to add
+        """
+        if isinstance(node, ReadNode):
+            plan.setdefault((node, ChunkCache._index_key_(index)), (node, index))
+        elif isinstance(node, ValidateNode):
+            WriteNode._read_plan_(node.inputs[0], index, plan)
+        elif isinstance(node, MapNode):
+            WriteNode._read_plan_(node.inputs[0], node._input_index_(index), plan)
+        elif isinstance(node, EvalNode) and not node.halo_widths:
+            function = node._function
+            if isinstance(function, ElementwiseKernel) or is_elementwise(function):
+                for inp in node.inputs:
+                    WriteNode._read_plan_(inp, index, plan)
+
+    def _write_pipelined_(self, chunktasks, pool=None, cache=None, depth=1):
+        """
+        Read, evaluate and write the tasks of each chunk in a three-stage pipeline
+
+        A prefetch thread reads the ReadNode data for upcoming chunks, a compute thread evaluates
+        the tasks of each chunk, and the calling thread writes the data as it is ready.  Each
+        stage runs ahead of the next by up to 'depth' chunks (prefetch) or variable chunks
+        (compute).  Only the reads that can be predicted from the graph are prefetched (see
+        '_read_plan_'); any other data is read by the compute stage.  The NetCDF library is not
+        thread-safe, so all pooled reads and writes hold the dataset pool lock:  reads never
+        overlap writes, but both overlap the computation.
+        """
+        prefetched = Queue(maxsize=depth)
+        computed = Queue(maxsize=depth)
+        buffer = ReadAheadBuffer()
+        stop = Event()
+
+        def put(queue, item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def get(queue):
+            while not stop.is_set():
+                try:
+                    return queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            return ('done', None)
+
+        def prefetch():
+            try:
+                for tasks in chunktasks:
+                    plan = OrderedDict()
+                    for vnode, rchunk, _ in tasks:
+                        WriteNode._read_plan_(vnode, rchunk, plan)
+                    for node, index in plan.itervalues():
+                        if stop.is_set():
+                            return
+                        buffer.read(node, index)
+                    if not put(prefetched, ('tasks', (tasks, plan.values()))):
+                        return
+                put(prefetched, ('done', None))
+            except:
+                put(prefetched, ('error', sys.exc_info()))
+
+        def compute():
+            try:
+                while True:
+                    kind, item = get(prefetched)
+                    if kind != 'tasks':
+                        put(computed, (kind, item))
+                        return
+                    tasks, reads = item
+                    try:
+                        for result in self._evaluate_tasks_(tasks, pool, cache):
+                            if not put(computed, ('data', result)):
+                                return
+                    finally:
+                        for node, index in reads:
+                            buffer.pop(node, index)
+            except:
+                put(computed, ('error', sys.exc_info()))
+
+        stages = [Thread(target=prefetch, name='{} prefetch'.format(self.label)),
+                  Thread(target=compute, name='{} compute'.format(self.label))]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+        try:
+            while True:
+                kind, item = computed.get()
+                if kind == 'done':
+                    break
+                elif kind == 'error':
+                    raise item[0], item[1], item[2]
+                vnode, wchunk, vdata = item
+                self._write_data_(vnode.label, wchunk, vdata)
+        finally:
+            stop.set()
+            for stage in stages:
+                stage.join()
+            buffer.clear()
+
+    def execute(self, chunks={}, deflate=None, cache=None, threads=1, scomm=None, pipeline=0):
+        """
+        Execute the writing of the WriteNode file at once
+
+        This method efficiently writes all of the data for each file only once, chunking
+        the data according to the 'chunks' parameter, as needed.
+
+        If a SimpleComm with more than one rank is given, all of its ranks must call this method
+        together, and the chunks are divided between the ranks.  If the NetCDF library supports
+        parallel writes, each rank writes its own chunks to the file.  Otherwise, the manager rank
+        writes all of the data, which is computed by (and gathered from) the other ranks.
+
+        Parameters:
+            chunks (dict): A dictionary of output dimension names and chunk sizes for each
+                dimension given.  Output dimensions not included in the dictionary will not be
+                chunked.  (Use OrderedDict to preserve order of dimensions, where the first
+                dimension will be assumed to correspond to the fastest-varying index and the last
+                dimension will be assumed to correspond to the slowest-varying index.)
+            deflate (int): Override the output file deflate level with given value
+            cache (ChunkCache): A cache used to share data pulled from nodes with more than
+                one consumer between those consumers for each chunk [Default: no caching]
+            threads (int): Number of threads used to evaluate the data for different variables
+                (and, without a cache, different chunks) at the same time.  All data is written
+                by the calling thread.  [Default: 1]
+            scomm (SimpleComm): The group of ranks writing this file together [Default: None]
+            pipeline (int): If positive, prefetch the input data of upcoming chunks and compute the
+                data on background threads while the data already computed is written, with each
+                stage running at most this many chunks ahead of the next (0 disables
+                pipelining) [Default: 0]
+        """
+        if not isinstance(threads, int) or threads < 1:
+            raise ValueError('Number of threads must be a positive integer')
+        if not isinstance(pipeline, int) or pipeline < 0:
+            raise ValueError('Pipeline depth must be a non-negative integer')
+
+        # Evaluate the chunks on a thread pool, if requested, a number of chunks at a time (only
+        # one chunk at a time when caching, because the cache is attached for a single chunk)
+        pool = ThreadPool(threads) if threads > 1 else None
+        nwindow = threads if (pool is not None and cache is None) else 1
+
+        try:
+            if scomm is None or scomm.get_size() == 1:
+                self._open_(deflate=deflate)
+                chunktasks = WriteNode._windows_(self._chunk_tasks_(chunks), nwindow)
+                if pipeline > 0:
+                    self._write_pipelined_(chunktasks, pool, cache, depth=pipeline)
+                else:
+                    for tasks in chunktasks:
+                        for vnode, wchunk, vdata in self._evaluate_tasks_(tasks, pool, cache):
+                            self._write_data_(vnode.label, wchunk, vdata)
+                self._close_()
+            elif WriteNode.parallel_support():
+                self._execute_parallel_(chunks, deflate, pool, cache, scomm)
+            else:
+                self._execute_gather_(chunks, deflate, pool, cache, nwindow, scomm)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _execute_parallel_(self, chunks, deflate, pool, cache, scomm):
+        """
+        Write the file with all ranks, each writing its own chunks (in parallel NetCDF)
+        """
+        self._open_(deflate=deflate, scomm=scomm)
+        for ncvar in self._file.variables.itervalues():
+            ncvar.set_collective(ncvar.ndim > 0)
+
+        # Collective writes need every rank to write every variable in each round of chunks
+        size = scomm.get_size()
+        rank = scomm.get_rank()
+        chunktasks = list(self._chunk_tasks_(chunks))
+        for r in xrange(0, len(chunktasks), size):
+            tasks = chunktasks[r + rank] if r + rank < len(chunktasks) else []
+            results = {vnode.label: (wchunk, vdata) for vnode, wchunk, vdata in
+                       self._evaluate_tasks_(tasks, pool, cache)}
+            for vname, wchunk, vdata in self._parallel_writes_(results):
+                if wchunk is None:
+                    ncvar = self._file.variables[vname]
+                    empty = tuple(slice(0, 0) for _ in ncvar.dimensions)
+                    ncvar[empty] = numpy.empty((0,) * len(ncvar.dimensions), dtype=ncvar.dtype)
+                else:
+                    self._write_data_(vname, wchunk, vdata)
+        self._close_(scomm=scomm)
+
+    def _parallel_writes_(self, results):
+        """
+        List the (variable name, write-chunk, data) writes of one rank in a round of parallel writes
+
+        A variable not computed by the rank in the round is written with an empty selection
+        (with write-chunk and data of None), so that every rank takes part in the collective
+        write.  Scalar variables have no empty selection, so they are written independently (not
+        collectively) and only by the rank that computed them.
+
+        Parameters:
+            results (dict): The (write-chunk, data) computed by the rank for each variable name
+        """
+        writes = []
+        for vnode in self.inputs:
+            if vnode.label in results:
+                writes.append((vnode.label,) + tuple(results[vnode.label]))
+            elif len(self._filedesc.variables[vnode.label].dimensions) > 0:
+                writes.append((vnode.label, None, None))
+        return writes
+
+    def _execute_gather_(self, chunks, deflate, pool, cache, nwindow, scomm):
+        """
+        Write the file with the manager rank, gathering the data computed by the other ranks
+        """
+        if scomm.is_manager():
+            self._open_(deflate=deflate)
+            ntasks = sum(len(tasks) for tasks in self._chunk_tasks_(chunks))
+            for _ in xrange(ntasks):
+                _, (vname, wchunk, vdata) = scomm.collect()
+                self._write_data_(vname, wchunk, vdata)
+            self._close_()
+        else:
+            nworkers = scomm.get_size() - 1
+            worker = scomm.get_rank() - 1
+            self._idims = self._inverted_dims_()
+            mychunks = (tasks for i, tasks in enumerate(self._chunk_tasks_(chunks))
+                        if i % nworkers == worker)
+            for tasks in WriteNode._windows_(mychunks, nwindow):
+                for vnode, wchunk, vdata in self._evaluate_tasks_(tasks, pool, cache):
+                    scomm.collect((vnode.label, wchunk, vdata))
+            self._idims = set()
+        scomm.sync()
@@ -6,9 +6,10 @@ LICENSE: See the LICENSE.rst file for details
 """
 
 from abc import ABCMeta, abstractmethod
-from pyconform.physarray import PhysArray, UnitsError, getname
+from pyconform.physarray import PhysArray, PhysInfo, UnitsError, getname, getinfo
 from numpy.ma import sqrt, where
 from cf_units import Unit
+from itertools import chain
 import numpy as np
 
 
@@ -48,6 +49,8 @@ def find(key, numargs=None):
 class FunctionBase(object):
     __metaclass__ = ABCMeta
     key = 'function'
+    cost = 1.0  # Relative compute cost per element of input and output data
+    precision = None  # 'double' if the input must be computed in double precision
 
     def __init__(self, *args, **kwds):
         self.arguments = args
@@ -57,6 +60,15 @@ class FunctionBase(object):
     def __getitem__(self):
         return None
 
+    def infer(self):
+        """
+        Infer the metadata (PhysInfo) of the result from the metadata of the arguments
+
+        This does not allocate or compute any data.  Returns None if the metadata cannot be
+        inferred, in which case the metadata is computed by calling the function with index None.
+        """
+        return None
+
 
 ##########################################################################
 ##### OPERATORS ##########################################################
@@ -118,6 +130,11 @@ class NegationOperator(Operator):
             self.arguments[0]) else self.arguments[0][index]
         return -arg
 
+    def infer(self):
+        if is_constant(self.arguments[0]):
+            return None
+        return -getinfo(self.arguments[0])
+
 
 #=========================================================================
 # AdditionOperator
@@ -136,6 +153,11 @@ class AdditionOperator(Operator):
             self.arguments[1]) else self.arguments[1][index]
         return left + right
 
+    def infer(self):
+        if all(is_constant(arg) for arg in self.arguments):
+            return None
+        return getinfo(self.arguments[0]) + getinfo(self.arguments[1])
+
 
 #=========================================================================
 # SubtractionOperator
@@ -154,6 +176,11 @@ class SubtractionOperator(Operator):
             self.arguments[1]) else self.arguments[1][index]
         return left - right
 
+    def infer(self):
+        if all(is_constant(arg) for arg in self.arguments):
+            return None
+        return getinfo(self.arguments[0]) - getinfo(self.arguments[1])
+
 
 #=========================================================================
 # PowerOperator
@@ -161,6 +188,7 @@ class SubtractionOperator(Operator):
 class PowerOperator(Operator):
     key = '**'
     numargs = 2
+    cost = 4.0
 
     def __init__(self, left, right):
         super(PowerOperator, self).__init__(left, right)
@@ -172,6 +200,12 @@ class PowerOperator(Operator):
             self.arguments[1]) else self.arguments[1][index]
         return left ** right
 
+    def infer(self):
+        left, right = self.arguments
+        if is_constant(left) or not isinstance(right, (int, float)):
+            return None
+        return getinfo(left) ** right
+
 
 #=========================================================================
 # MultiplicationOperator
@@ -190,6 +224,11 @@ class MultiplicationOperator(Operator):
             self.arguments[1]) else self.arguments[1][index]
         return left * right
 
+    def infer(self):
+        if all(is_constant(arg) for arg in self.arguments):
+            return None
+        return getinfo(self.arguments[0]) * getinfo(self.arguments[1])
+
 
 #=========================================================================
 # DivisionOperator
@@ -208,6 +247,11 @@ class DivisionOperator(Operator):
             self.arguments[1]) else self.arguments[1][index]
         return left / right
 
+    def infer(self):
+        if all(is_constant(arg) for arg in self.arguments):
+            return None
+        return getinfo(self.arguments[0]) / getinfo(self.arguments[1])
+
 
 #=========================================================================
 # Operator map - Fixed to prevent user-redefinition!
@@ -266,6 +310,7 @@ class Function(FunctionBase):
     def __init__(self, *args, **kwds):
         super(Function, self).__init__(*args, **kwds)
         self._sumlike_dimensions = set()
+        self._halo_widths = {}
 
     def __getitem__(self, _):
         return None
@@ -277,22 +322,46 @@ class Function(FunctionBase):
     def add_sumlike_dimensions(self, *dims):
         self._sumlike_dimensions.update(set(dims))
 
+    @property
+    def halo_widths(self):
+        """Dictionary of stencil dimensions and (before, after) numbers of neighboring points"""
+        return self._halo_widths
+
+    def add_halo_dimension(self, dim, before=1, after=None):
+        """
+        Declare that each point of the result needs neighboring points of the input along a dimension
+
+        When the data is chunked over a stencil dimension, each chunk is computed with a halo of
+        neighboring points on either side of it, and the halo is then trimmed from the result.
+
+        Parameters:
+            dim (str): The name of the stencil dimension (as indexed in the function's result)
+            before (int): The number of points needed before each point
+            after (int): The number of points needed after each point (if None, same as before)
+        """
+        after = before if after is None else after
+        if not isinstance(before, int) or not isinstance(after, int) or before < 0 or after < 0:
+            raise ValueError('Halo widths must be non-negative integers')
+        hbefore, hafter = self._halo_widths.get(dim, (0, 0))
+        self._halo_widths[dim] = (max(hbefore, before), max(hafter, after))
+
 
 #=========================================================================
 # SquareRoot
 #=========================================================================
 class SquareRootFunction(Function):
     key = 'sqrt'
+    cost = 2.0
 
     def __init__(self, data):
         super(SquareRootFunction, self).__init__(data)
-        data_info = data if is_constant(data) else data[None]
-        if isinstance(data_info, PhysArray):
+        data_info = data if is_constant(data) else getinfo(data)
+        if isinstance(data_info, PhysInfo):
             try:
                 units = data_info.units.root(2)
             except:
                 raise UnitsError(
-                    'sqrt: Cannot take square-root of units {!r}'.format(data.units))
+                    'sqrt: Cannot take square-root of units {!r}'.format(data_info.units))
             self._units = units
         else:
             self._units = None
@@ -301,123 +370,294 @@ class SquareRootFunction(Function):
         data_r = self.arguments[0]
         data = data_r if is_constant(data_r) else data_r[index]
         if isinstance(data, PhysArray):
-            return PhysArray(sqrt(data), units=self._units, name='sqrt({})'.format(data.name),
+            if np.ma.getmask(data) is np.ma.nomask:
+                # Unmasked data needs a mask only where the square-root is undefined
+                with np.errstate(invalid='ignore'):
+                    sqrtdata = np.sqrt(np.ma.getdata(data))
+                if not np.isfinite(sqrtdata).all():
+                    sqrtdata = sqrt(data)
+            else:
+                sqrtdata = sqrt(data)
+            return PhysArray(sqrtdata, units=self._units, name='sqrt({})'.format(data.name),
                              dimensions=data.dimensions, positive=data.positive)
         else:
             return sqrt(data)
 
+    def infer(self):
+        if is_constant(self.arguments[0]):
+            return None
+        info = getinfo(self.arguments[0])
+        return PhysInfo('sqrt({})'.format(info.name), units=self._units, dimensions=info.dimensions,
+                        dtype=np.result_type(info.dtype, np.float16), positive=info.positive)
+
+
+#=========================================================================
+# StreamingReduction - Mixin for functions reducing data over dimensions
+#=========================================================================
+class StreamingReduction(object):
+    """
+    Mixin for Functions that reduce their data over (sum-like) dimensions
+
+    The data is always reduced over the full extent of the reduced dimensions, regardless of any
+    index given for them.  If a block size is set, the data is pulled from the input in blocks
+    of that size along the first reduced dimension, and the partial result of each block is
+    merged into a running result, so that the input is never held in memory all at once.
+    """
+    blocksize = None  # Number of elements read along the streamed dimension at once (None: all)
+
+    @property
+    def stream_dimension(self):
+        """The reduced dimension along which the data is streamed in blocks"""
+        info = getinfo(self.arguments[0])
+        for d in self.arguments[1:]:
+            if d in info.dimensions:
+                return d
+        return None
+
+    def _blocks_(self, index):
+        """
+        Generate the blocks of input data to reduce for the given index
+        """
+        data = self.arguments[0]
+        if not isinstance(index, dict):
+            yield data[index]
+            return
+        index = {d: i for d, i in index.iteritems() if d not in self.arguments[1:]}
+        sdim = self.stream_dimension
+        if sdim is None or self.blocksize is None:
+            yield data[index]
+            return
+        start = 0
+        while True:
+            index[sdim] = slice(start, start + self.blocksize)
+            block = data[index]
+            nblock = block.shape[block.dimensions.index(sdim)] if sdim in block.dimensions else 0
+            if nblock > 0 or start == 0:
+                yield block
+            if nblock < self.blocksize:
+                break
+            start += self.blocksize
+
+    @staticmethod
+    def _stack_(result, partial, dim, name):
+        """
+        Stack two partial results along a new (leading) dimension, so they can be reduced again
+        """
+        stacked = np.ma.concatenate([np.ma.expand_dims(result.view(np.ma.MaskedArray), 0),
+                                     np.ma.expand_dims(partial.view(np.ma.MaskedArray), 0)])
+        return PhysArray(stacked, name=name, units=result.units, positive=result.positive,
+                         dimensions=(dim,) + tuple(result.dimensions))
+
+    def _reduce_(self, data):
+        """
+        Reduce a block of data (or a stack of partial results)
+        """
+        raise NotImplementedError()
+
+    def _streaming_getitem_(self, index):
+        result = None
+        for block in self._blocks_(index):
+            partial = self._reduce_(block)
+            if result is None:
+                result = partial
+                name = block.name
+            else:
+                stacked = StreamingReduction._stack_(result, partial, self.stream_dimension, name)
+                result = self._reduce_(stacked)
+        return result
+
 
 #=========================================================================
 # MeanFunction
 #=========================================================================
-class MeanFunction(Function):
+class MeanFunction(StreamingReduction, Function):
     key = 'mean'
+    precision = 'double'
 
     def __init__(self, data, *dimensions):
         super(MeanFunction, self).__init__(data, *dimensions)
         self.add_sumlike_dimensions(*dimensions)
-        data_info = data if is_constant(data) else data[None]
-        if not isinstance(data_info, PhysArray):
+        data_info = data if is_constant(data) else getinfo(data)
+        if not isinstance(data_info, PhysInfo):
             raise TypeError('mean: Data must be a PhysArray')
         if not all(isinstance(d, basestring) for d in dimensions):
             raise TypeError('mean: Dimensions must be strings')
 
     def __getitem__(self, index):
-        data = self.arguments[0][index]
         dimensions = self.arguments[1:]
+        blocks = self._blocks_(index)
+        data = next(blocks)
         indims = [d for d in dimensions if d in data.dimensions]
-        return data.mean(dimensions=indims)
+        nextdata = next(blocks, None)
+        if nextdata is None:
+            return data.mean(dimensions=indims)
+
+        # Merge the (masked-aware) sum and count of each block
+        axes = tuple(data.dimensions.index(d) for d in indims)
+        total, count = MeanFunction._sum_count_(data, axes)
+        for block in chain([nextdata], blocks):
+            btotal, bcount = MeanFunction._sum_count_(block, axes)
+            if np.ma.getmask(total) is np.ma.nomask and np.ma.getmask(btotal) is np.ma.nomask:
+                total += btotal
+            else:
+                total = np.ma.where(np.ma.getmaskarray(total), btotal,
+                                    np.ma.where(np.ma.getmaskarray(btotal), total, total + btotal))
+            count += bcount
+        meanval = total.filled(0) / np.maximum(count, 1)
+        if (count == 0).any():
+            meanval = np.ma.masked_where(count == 0, meanval)
+        new_dims = tuple(d for d in data.dimensions if d not in indims)
+        return PhysArray(meanval, name='mean({}, dims=[{}])'.format(data.name, ','.join(indims)),
+                         dimensions=new_dims, positive=data.positive, units=data.units)
+
+    @staticmethod
+    def _sum_count_(data, axes):
+        mdata = data.view(np.ma.MaskedArray)
+        return (np.ma.asarray(mdata.sum(axis=axes), dtype=np.float64),
+                np.asarray(mdata.count(axis=axes)))
+
+    def infer(self):
+        info = getinfo(self.arguments[0])
+        dimensions = self.arguments[1:]
+        indims = [d for d in info.dimensions if d in dimensions]
+        new_dims = tuple(d for d in info.dimensions if d not in indims)
+        dtype = info.dtype if info.dtype.kind in 'fc' else np.dtype(np.float64)
+        new_name = 'mean({}, dims=[{}])'.format(info.name, ','.join(str(d) for d in indims))
+        return PhysInfo(new_name, units=info.units, dimensions=new_dims, dtype=dtype, positive=info.positive)
 
 
 #=========================================================================
 # SumFunction
 #=========================================================================
-class SumFunction(Function):
+class SumFunction(StreamingReduction, Function):
     key = 'sum'
+    precision = 'double'
 
     def __init__(self, data, *dimensions):
         super(SumFunction, self).__init__(data, *dimensions)
         self.add_sumlike_dimensions(*dimensions)
-        data_info = data if is_constant(data) else data[None]
-        if not isinstance(data_info, PhysArray):
+        data_info = data if is_constant(data) else getinfo(data)
+        if not isinstance(data_info, PhysInfo):
             raise TypeError('sum: Data must be a PhysArray')
         if not all(isinstance(d, basestring) for d in dimensions):
             raise TypeError('sum: Dimensions must be strings')
 
     def __getitem__(self, index):
-        data = self.arguments[0][index]
+        return self._streaming_getitem_(index)
+
+    def _reduce_(self, data):
         dimensions = self.arguments[1:]
         indims = []
         for d in dimensions:
-            # print d, 'in', data.dimensions, '?'
             if d in data.dimensions:
-                # print 'will append ', data.dimensions.index(d)
                 indims.append(data.dimensions.index(d))
         return np.sum(data, indims[0])
 
+    def infer(self):
+        info = getinfo(self.arguments[0])
+        indims = [d for d in self.arguments[1:] if d in info.dimensions]
+        if len(indims) == 0:
+            return None
+        new_dims = tuple(d for d in info.dimensions if d != indims[0])
+        dtype = info.dtype
+        if dtype.kind == 'b' or (dtype.kind == 'i' and dtype.itemsize < np.dtype(np.int_).itemsize):
+            dtype = np.dtype(np.int_)
+        elif dtype.kind == 'u' and dtype.itemsize < np.dtype(np.uint).itemsize:
+            dtype = np.dtype(np.uint)
+        new_name = 'sum({}, dims=[{}])'.format(info.name, indims[0])
+        return PhysInfo(new_name, units=info.units, dimensions=new_dims, dtype=dtype, positive=info.positive)
+
 
 #=========================================================================
 # MinFunction
 #=========================================================================
-class MinFunction(Function):
+class MinFunction(StreamingReduction, Function):
     key = 'min'
 
     def __init__(self, data, *dimensions):
         super(MinFunction, self).__init__(data, *dimensions)
         self.add_sumlike_dimensions(*dimensions)
-        data_info = data if is_constant(data) else data[None]
-        if not isinstance(data_info, PhysArray):
+        data_info = data if is_constant(data) else getinfo(data)
+        if not isinstance(data_info, PhysInfo):
             raise TypeError('min: Data must be a PhysArray')
         if not all(isinstance(d, basestring) for d in dimensions):
             raise TypeError('min: Dimensions must be strings')
 
     def __getitem__(self, index):
-        data = self.arguments[0][index]
+        if index is None:
+            return self._reduce_(self.arguments[0][index], index)
+        return self._streaming_getitem_(index)
+
+    def _reduce_(self, data, index=slice(None)):
         dimensions = self.arguments[1:]
         indims = []
-        if index is None:
-            return PhysArray(np.zeros((0, 0, 0)), dimensions=[data.dimensions[0],
-                                                              data.dimensions[2],
-                                                              data.dimensions[3]])
         for d in dimensions:
             if d in data.dimensions:
                 indims.append(data.dimensions.index(d))
+        new_dims = [d for i, d in enumerate(data.dimensions) if i != indims[0]]
         new_name = 'min({},{})'.format(data.name, dimensions)
-        m = np.amin(data, axis=indims[0])
-        return PhysArray(m, name=new_name, positive=data.positive, units=data.units,
-                         dimensions=[data.dimensions[0], data.dimensions[2], data.dimensions[3]])
+        if index is None:
+            new_shape = tuple(s for i, s in enumerate(data.shape) if i != indims[0])
+            m = np.zeros(new_shape, dtype=data.dtype)
+        else:
+            m = np.amin(data, axis=indims[0])
+        return PhysArray(m, name=new_name, positive=data.positive, units=data.units, dimensions=new_dims)
+
+    def infer(self):
+        info = getinfo(self.arguments[0])
+        dimensions = self.arguments[1:]
+        indims = [d for d in dimensions if d in info.dimensions]
+        if len(indims) == 0:
+            return None
+        new_dims = tuple(d for d in info.dimensions if d != indims[0])
+        new_name = 'min({},{})'.format(info.name, dimensions)
+        return PhysInfo(new_name, units=info.units, dimensions=new_dims, dtype=info.dtype, positive=info.positive)
 
 
 #=========================================================================
 # MaxFunction
 #=========================================================================
-class MaxFunction(Function):
+class MaxFunction(StreamingReduction, Function):
     key = 'max'
 
     def __init__(self, data, *dimensions):
         super(MaxFunction, self).__init__(data, *dimensions)
         self.add_sumlike_dimensions(*dimensions)
-        data_info = data if is_constant(data) else data[None]
-        if not isinstance(data_info, PhysArray):
+        data_info = data if is_constant(data) else getinfo(data)
+        if not isinstance(data_info, PhysInfo):
             raise TypeError('max: Data must be a PhysArray')
         if not all(isinstance(d, basestring) for d in dimensions):
             raise TypeError('max: Dimensions must be strings')
 
     def __getitem__(self, index):
-        data = self.arguments[0][index]
+        if index is None:
+            return self._reduce_(self.arguments[0][index], index)
+        return self._streaming_getitem_(index)
+
+    def _reduce_(self, data, index=slice(None)):
         dimensions = self.arguments[1:]
         indims = []
-        if index is None:
-            return PhysArray(np.zeros((0, 0, 0)), units=data.units, dimensions=[data.dimensions[0],
-                                                                                data.dimensions[2],
-                                                                                data.dimensions[3]])
         for d in dimensions:
             if d in data.dimensions:
                 indims.append(data.dimensions.index(d))
+        new_dims = [d for i, d in enumerate(data.dimensions) if i != indims[0]]
         new_name = 'max({},{})'.format(data.name, dimensions[0])
-        m = np.amax(data, axis=indims[0])
-        return PhysArray(m, name=new_name, positive=data.positive, units=data.units,
-                         dimensions=[data.dimensions[0], data.dimensions[2], data.dimensions[3]])
+        if index is None:
+            new_shape = tuple(s for i, s in enumerate(data.shape) if i != indims[0])
+            m = np.zeros(new_shape, dtype=data.dtype)
+        else:
+            m = np.amax(data, axis=indims[0])
+        return PhysArray(m, name=new_name, positive=data.positive, units=data.units, dimensions=new_dims)
+
+    def infer(self):
+        info = getinfo(self.arguments[0])
+        dimensions = self.arguments[1:]
+        indims = [d for d in dimensions if d in info.dimensions]
+        if len(indims) == 0:
+            return None
+        new_dims = tuple(d for d in info.dimensions if d != indims[0])
+        new_name = 'max({},{})'.format(info.name, dimensions[0])
+        return PhysInfo(new_name, units=info.units, dimensions=new_dims, dtype=info.dtype, positive=info.positive)
 
 
 #=========================================================================
@@ -434,6 +674,9 @@ class PositiveUpFunction(Function):
         data = data_r if is_constant(data_r) else data_r[index]
         return PhysArray(data).up()
 
+    def infer(self):
+        return getinfo(self.arguments[0]).copy().up()
+
 
 #=========================================================================
 # PositiveDownFunction
@@ -449,18 +692,22 @@ class PositiveDownFunction(Function):
         data = data_r if is_constant(data_r) else data_r[index]
         return PhysArray(data).down()
 
+    def infer(self):
+        return getinfo(self.arguments[0]).copy().down()
+
 
 #=========================================================================
 # ChangeUnitsFunction
 #=========================================================================
 class ChangeUnitsFunction(Function):
     key = 'chunits'
+    cost = 2.0
 
     def __init__(self, data, units=None, refdate=None, calendar=None):
         super(ChangeUnitsFunction, self).__init__(
             data, units=units, refdate=refdate, calendar=calendar)
 
-        dunits = Unit(1) if is_constant(data) else data[None].units
+        dunits = Unit(1) if is_constant(data) else getinfo(data).units
         dcal = dunits.calendar
         if dunits.is_time_reference():
             dunit, dref = [s.strip() for s in dunits.origin.split('since')]
@@ -468,7 +715,7 @@ class ChangeUnitsFunction(Function):
             dunit = dunits.origin
             dref = None
 
-        uobj = Unit(units) if is_constant(units) else units[None].units
+        uobj = Unit(units) if is_constant(units) else getinfo(units).units
         ucal = uobj.calendar
         if uobj.is_time_reference():
             uunit, uref = [s.strip() for s in uobj.origin.split('since')]
@@ -508,6 +755,17 @@ class ChangeUnitsFunction(Function):
         new_name = 'chunits({}, units={})'.format(data.name, unit_str)
         return PhysArray(data, name=new_name, units=self._newunits)
 
+    def infer(self):
+        if is_constant(self.arguments[0]):
+            return None
+        info = getinfo(self.arguments[0])
+        cal_str = '' if self._newunits.calendar is None else '|{}'.format(
+            self._newunits.calendar)
+        unit_str = '{}{}'.format(self._newunits, cal_str)
+        new_name = 'chunits({}, units={})'.format(info.name, unit_str)
+        return PhysInfo(new_name, units=self._newunits, dimensions=info.dimensions, dtype=info.dtype,
+                        positive=info.positive)
+
 
 #=========================================================================
 # LimitFunction
@@ -544,6 +802,22 @@ class LimitFunction(Function):
         new_name = 'limit({}{}{})'.format(data.name, above_str, below_str)
         return PhysArray(data, name=new_name)
 
+    def infer(self):
+        if is_constant(self.arguments[0]):
+            return None
+        info = getinfo(self.arguments[0])
+        above_val = self.keywords['above']
+        below_val = self.keywords['below']
+        if above_val is None and below_val is None:
+            return info
+        elif len(info.dimensions) == 0:
+            return None
+        above_str = '' if above_val is None else ', above={}'.format(above_val)
+        below_str = '' if below_val is None else ', below={}'.format(below_val)
+        new_info = info.copy()
+        new_info.name = 'limit({}{}{})'.format(info.name, above_str, below_str)
+        return new_info
+
 
 #=========================================================================
 # RemoveUnitsFunction
@@ -560,6 +834,11 @@ class RemoveUnitsFunction(Function):
         new_name = 'rmunits({!s})'.format(getname(data))
         return PhysArray(data, name=new_name, units=1)
 
+    def infer(self):
+        info = getinfo(self.arguments[0])
+        return PhysInfo('rmunits({!s})'.format(info.name), units=1, dimensions=info.dimensions,
+                        dtype=info.dtype, positive=info.positive)
+
 
 #=========================================================================
 # RenameDimensionsFunction
@@ -581,3 +860,19 @@ class RenameDimensionsFunction(Function):
         dlen = min(len(dims), len(new_dims))
         new_dims[:dlen] = dims[:dlen]
         return PhysArray(data, name=new_name, dimensions=new_dims)
+
+    def infer(self):
+        if is_constant(self.arguments[0]):
+            return None
+        info = getinfo(self.arguments[0])
+        if len(self.arguments) == 1:
+            return info
+        dims = self.arguments[1:]
+        dim_names = ', '.join([repr(dim) for dim in dims])
+        new_info = info.copy()
+        new_info.name = 'chdims({!s}, {!s})'.format(info.name, dim_names)
+        new_dims = list(info.dimensions)
+        dlen = min(len(dims), len(new_dims))
+        new_dims[:dlen] = dims[:dlen]
+        new_info.dimensions = tuple(new_dims)
+        return new_info
@@ -0,0 +1,156 @@
+"""
+Input File Header Cache
+
+This module contains the HeaderCache class, which stores the header information read from input
+NetCDF files in an SQLite database on disk, so that repeated runs over the same input files do
+not need to read every file header again.  Entries are keyed by the absolute path of the file,
+and they are only reused if the size and modification time of the file have not changed.
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from os import stat, makedirs
+from os.path import abspath, dirname, exists, expanduser, join
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+from pyconform.datasets import FileDesc
+
+import sqlite3
+
+
+#=========================================================================
+# Default location of the header cache file
+#=========================================================================
+DEFAULT_PATH = join(expanduser('~'), '.cache', 'pyconform', 'headers.db')
+
+
+#=========================================================================
+# HeaderCache
+#=========================================================================
+class HeaderCache(object):
+    """
+    A persistent cache of input file headers, stored in an SQLite database
+
+    The cached values are the (FileDesc, first unlimited coordinate values) tuples produced when
+    reading the header of each input file.  The cache should only be used from one process at a
+    time (e.g., the manager rank).
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        Initializer
+
+        Parameters:
+            path (str): The path to the SQLite database file (created if it does not exist)
+        """
+        self._path = path
+        dpath = dirname(abspath(path))
+        if not exists(dpath):
+            makedirs(dpath)
+        self._conn = sqlite3.connect(path, timeout=60)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS headers (path TEXT PRIMARY KEY, '
+                               'size INTEGER, mtime REAL, header BLOB)')
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def path(self):
+        """The path to the SQLite database file"""
+        return self._path
+
+    @property
+    def hits(self):
+        """The number of headers found in the cache"""
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of headers not found in the cache (or out of date)"""
+        return self._misses
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM headers').fetchone()[0]
+
+    @staticmethod
+    def _key_(filename):
+        st = stat(filename)
+        return abspath(filename), st.st_size, st.st_mtime
+
+    @staticmethod
+    def _rename_(fdesc, filename):
+        variables = fdesc.variables.values()
+        for vdesc in variables:
+            vdesc.files.clear()
+        return FileDesc(filename, format=fdesc.format, deflate=fdesc.deflate, variables=variables,
+                        attributes=fdesc.attributes)
+
+    def get(self, filename):
+        """
+        Return the cached header of a file, or None if not cached (or if the file has changed)
+
+        Parameters:
+            filename (str): The name of the input file
+        """
+        path, size, mtime = HeaderCache._key_(filename)
+        row = self._conn.execute('SELECT size, mtime, header FROM headers WHERE path = ?',
+                                 (path,)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            self._misses += 1
+            return None
+        self._hits += 1
+        fdesc, ufirst = loads(str(row[2]))
+        if fdesc.name != filename:
+            fdesc = HeaderCache._rename_(fdesc, filename)
+        return fdesc, ufirst
+
+    def variable_names(self, filename):
+        """
+        Return the set of variable names in the cached header of a file, or None if not cached
+
+        This does not count as a hit or miss of the cache.
+
+        Parameters:
+            filename (str): The name of the input file
+        """
+        hits, misses = self._hits, self._misses
+        header = self.get(filename)
+        self._hits, self._misses = hits, misses
+        return None if header is None else set(header[0].variables)
+
+    def put(self, filename, header):
+        """
+        Store the header of a file in the cache
+
+        Parameters:
+            filename (str): The name of the input file
+            header (tuple): The header (FileDesc, first unlimited coordinate values) of the file
+        """
+        self.update([(filename, header)])
+
+    def update(self, headers):
+        """
+        Store the headers of multiple files in the cache (in one transaction)
+
+        Parameters:
+            headers (list): A list of (filename, header) tuples
+        """
+        rows = []
+        for filename, header in headers:
+            path, size, mtime = HeaderCache._key_(filename)
+            rows.append((path, size, mtime, sqlite3.Binary(dumps(header, HIGHEST_PROTOCOL))))
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?)', rows)
+
+    def clear(self):
+        """
+        Remove all entries from the cache
+        """
+        with self._conn:
+            self._conn.execute('DELETE FROM headers')
+
+    def close(self):
+        """
+        Close the connection to the cache database
+        """
+        self._conn.close()
@@ -119,6 +119,76 @@ def align_index(index, dimensions):
         return index_tuple(index, len(dimensions))
 
 
+#===================================================================================================
+# halo_index - Widen an index along one dimension by a halo of neighboring elements
+#===================================================================================================
+def halo_index(index, before, after):
+    """
+    Widen a 1D index by a number of elements before and after the indexed elements
+
+    Only integers, unit-step slices and reversed (step -1) slices with non-negative bounds are
+    widened.  The halo follows the order of the indexed data, so a reversed slice is widened by
+    'before' elements at higher indices and 'after' elements at lower indices.  Any other index is
+    returned unchanged.  The widened index never extends below the first element.
+
+    Parameters:
+        index: An integer or slice index along one dimension
+        before (int): The number of elements to add before the indexed elements
+        after (int): The number of elements to add after the indexed elements
+    """
+    if isinstance(index, int) and index >= 0:
+        return slice(max(index - before, 0), index + after + 1)
+    elif isinstance(index, slice) and index.step in (None, 1):
+        start = 0 if index.start is None else index.start
+        if start < 0 or (index.stop is not None and index.stop < 0):
+            return index
+        stop = None if index.stop is None else index.stop + after
+        return slice(max(start - before, 0), stop)
+    elif isinstance(index, slice) and index.step == -1:
+        if (index.start is not None and index.start < 0) or (index.stop is not None and index.stop < 0):
+            return index
+        start = None if index.start is None else index.start + before
+        stop = None if index.stop is None or index.stop < after else index.stop - after
+        return slice(start, stop, -1)
+    else:
+        return index
+
+
+#===================================================================================================
+# halo_trim - Index removing the halo from data read with a widened index
+#===================================================================================================
+def halo_trim(index, hindex, length):
+    """
+    Compute the index that removes the halo from data read with an index widened by 'halo_index'
+
+    Parameters:
+        index: The original integer or slice index along one dimension
+        hindex: The widened index returned by 'halo_index'
+        length (int): The length of the data read with the widened index
+    """
+    if hindex is index:
+        return slice(None)
+    elif isinstance(index, int):
+        return index - hindex.start
+    elif index.step == -1:
+        # Reversed data: the halo at higher indices comes first, and at lower indices last
+        if index.stop is None:
+            trailing = 0
+        elif hindex.stop is None:
+            trailing = index.stop + 1
+        else:
+            trailing = index.stop - hindex.stop
+        if index.start is None:
+            leading = 0
+        else:
+            count = index.start - (-1 if index.stop is None else index.stop)
+            leading = max(length - trailing - count, 0)
+        return slice(leading, length - trailing)
+    start = 0 if index.start is None else index.start
+    stop = length if index.stop is None else min(index.stop - hindex.start, length)
+    return slice(start - hindex.start, stop)
+
+
 #===================================================================================================
 # join
 #===================================================================================================
@@ -0,0 +1,428 @@
+"""
+Fused Elementwise Kernels
+
+This module contains the ElementwiseKernel class, which evaluates a tree of elementwise operators
+(+, -, *, /, ** and negation) as a single kernel.  The units, dimensions and positive direction of
+every operand are resolved once, when the kernel is constructed, and the data is then computed
+over cache-sized blocks of the result, so that the intermediate results of the tree are never
+allocated at full size.
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from pyconform.functions import FunctionBase, is_constant
+from pyconform.functions import NegationOperator, AdditionOperator, SubtractionOperator
+from pyconform.functions import MultiplicationOperator, DivisionOperator, PowerOperator
+from pyconform.physarray import PhysArray, PhysInfo, getinfo, getdata, getmask, unit_converter
+from pyconform.bufferpool import buffer_pool
+from cf_units import Unit
+from operator import add, sub, mul, div
+
+import numpy
+
+
+#=========================================================================
+# Operator strings of the elementwise operators that can be fused
+#=========================================================================
+_OPSTRS_ = {NegationOperator: 'neg', AdditionOperator: '+', SubtractionOperator: '-',
+            MultiplicationOperator: '*', DivisionOperator: '/', PowerOperator: '**'}
+
+# NumPy ufuncs and PhysArray operators implementing each operator
+_UFUNCS_ = {'neg': numpy.negative, '+': numpy.add, '-': numpy.subtract, '*': numpy.multiply,
+            '/': numpy.divide, '**': numpy.power}
+_BINOPS_ = {'+': add, '-': sub, '*': mul, '/': div}
+
+# Quotients smaller than this (with a margin for rounding) are never unsafe divisions
+_UNSAFE_QUOTIENT_ = 0.25 / numpy.finfo(float).tiny
+
+
+#=========================================================================
+# is_elementwise
+#=========================================================================
+def is_elementwise(function):
+    """
+    Whether a function object is an elementwise operator that can be fused into a kernel
+
+    Operators on constants alone (which return constants) and powers with non-constant exponents
+    cannot be fused.
+
+    Parameters:
+        function (FunctionBase): The function object of an EvalNode
+    """
+    if type(function) not in _OPSTRS_:
+        return False
+    args = function.arguments
+    if isinstance(function, PowerOperator):
+        return (not is_constant(args[0]) and isinstance(args[1], (int, float)) and
+                not isinstance(args[1], bool))
+    return not all(is_constant(arg) for arg in args)
+
+
+#=========================================================================
+# _portable_units_ - Units that survive pickling
+#=========================================================================
+def _portable_units_(units):
+    """
+    Return equivalent units constructed from their string representation
+
+    Units derived with arithmetic (e.g., Unit('km') * 0.5) do not survive pickling, so the units
+    stored in a kernel are reconstructed from strings when the kernel is sent to other processes.
+    """
+    return Unit(str(units), calendar=units.calendar)
+
+
+def _portable_info_(info):
+    """Return a copy of a PhysInfo object with units that survive pickling"""
+    info = info.copy()
+    info.units = _portable_units_(info.units)
+    return info
+
+
+#=========================================================================
+# _blocks_ - Iterate over cache-sized blocks of an array shape
+#=========================================================================
+def _blocks_(shape, blocksize):
+    """
+    Return the maximum number of elements in a block, and an iterator over the block indices
+
+    Blocks cover whole trailing axes of the shape, and a range of the last axis that does not fit
+    whole into the block size.
+    """
+    inner = 1
+    k = len(shape)
+    while k > 0 and inner * shape[k - 1] <= blocksize:
+        k -= 1
+        inner *= shape[k]
+    if k == 0:
+        return inner, iter([()])
+    step = max(1, blocksize // inner)
+
+    def blocks():
+        for outer in numpy.ndindex(*shape[:k - 1]):
+            for s in xrange(0, shape[k - 1], step):
+                yield outer + (slice(s, min(s + step, shape[k - 1])),)
+
+    return step * inner, blocks()
+
+
+#=========================================================================
+# _Scratch - Block-sized buffers reused within one kernel evaluation
+#=========================================================================
+class _Scratch(object):
+
+    def __init__(self, size):
+        self._size = size
+        self._free = {}
+        self._flats = []
+
+    def get(self, shape, dtype):
+        """Return a (flat buffer, shaped view) pair with the given shape and datatype"""
+        dtype = numpy.dtype(dtype)
+        free = self._free.setdefault(dtype.str, [])
+        if free:
+            flat = free.pop()
+        else:
+            flat = buffer_pool().get((self._size,), dtype)
+            self._flats.append(flat)
+        return flat, flat[:reduce(mul, shape, 1)].reshape(shape)
+
+    def put(self, flat):
+        """Return a flat buffer for reuse within the evaluation"""
+        if flat is not None:
+            self._free[flat.dtype.str].append(flat)
+
+    def release(self):
+        """Return all buffers to the process-wide BufferPool"""
+        buffer_pool().release(*self._flats)
+        self._flats = []
+        self._free = {}
+
+
+#=========================================================================
+# ElementwiseKernel
+#=========================================================================
+class ElementwiseKernel(FunctionBase):
+    """
+    A tree of elementwise operators evaluated as a single blocked kernel
+
+    The kernel is compiled from the function object of the root EvalNode of the tree and the set
+    of EvalNodes whose functions are fused into it.  The arguments of the kernel are the leaves of
+    the tree (FlowNodes and constants).  If the data of the leaves does not match the metadata
+    resolved when compiling (or for index None), the tree is evaluated with PhysArray operators,
+    one operator at a time.
+    """
+    key = 'kernel'
+
+    # Number of elements in each block of the result
+    blocksize = 2**14
+
+    def __init__(self, function, interior):
+        """
+        Initializer
+
+        Parameters:
+            function (FunctionBase): The function object of the root EvalNode of the tree
+            interior (set): The EvalNodes (with elementwise functions) to fuse into the kernel
+        """
+        self._function = function
+        self._leaves = []
+        self._leafinfos = []
+        self._steps = []
+        self.cost = 0.0
+        info = self._compile_(function, interior)[1]
+        self._template = info.name
+        self._info = PhysInfo(None, units=info.units, dimensions=info.dimensions, dtype=info.dtype,
+                              positive=info.positive)
+        super(ElementwiseKernel, self).__init__(*self._leaves)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_info'] = _portable_info_(self._info)
+        state['_leafinfos'] = [(_portable_info_(pinfo), _portable_info_(info)) for pinfo, info in self._leafinfos]
+        state['_steps'] = [step[:3] + (None if step[3] is None else tuple(_portable_units_(u) for u in step[3]),) +
+                           step[4:] for step in self._steps]
+        return state
+
+    @property
+    def size(self):
+        """The number of operators fused into the kernel"""
+        return len(self._steps)
+
+    def _leaf_(self, arg):
+        for i, leaf in enumerate(self._leaves):
+            if leaf is arg and not is_constant(arg):
+                return ('leaf', i), self._leafinfos[i][0]
+        i = len(self._leaves)
+        info = getinfo(arg).copy()
+        self._leaves.append(arg)
+        self._leafinfos.append((PhysInfo('{{{}}}'.format(i), units=info.units, dimensions=info.dimensions,
+                                         dtype=info.dtype, positive=info.positive), info))
+        return ('leaf', i), self._leafinfos[i][0]
+
+    def _compile_(self, function, interior):
+        operands = []
+        args = function.arguments[:1] if isinstance(function, PowerOperator) else function.arguments
+        for arg in args:
+            if arg in interior:
+                operands.append(self._compile_(arg.function, interior))
+            else:
+                operands.append(self._leaf_(arg))
+        opstr = _OPSTRS_[type(function)]
+        left, linfo = operands[0]
+        if opstr == 'neg':
+            step = (opstr, left, None, None, False)
+            info = -linfo
+        elif opstr == '**':
+            exponent = function.arguments[1]
+            step = (opstr, left, exponent, None, False)
+            info = linfo ** exponent
+        else:
+            right, rinfo = operands[1]
+            info, convert, negate = linfo._binary_op_(rinfo, opstr)
+            units = (rinfo.units, linfo.units) if convert else None
+            step = (opstr, left, right, units, negate)
+        self._steps.append(step)
+        self.cost += function.cost
+        return ('step', len(self._steps) - 1), info
+
+    def infer(self):
+        return self._function.infer()
+
+    def __getitem__(self, index):
+        values = [PhysArray(leaf if is_constant(leaf) else leaf[index]) for leaf in self._leaves]
+        if index is None or not self._fusible_(values):
+            return self._evaluate_(values)
+        result = self._evaluate_blocked_(values)
+        if result is None:
+            return self._evaluate_(values)
+        return result
+
+    def _fusible_(self, values):
+        """Whether the leaf data matches the metadata resolved when compiling"""
+        for value, (_, info) in zip(values, self._leafinfos):
+            if (value.dtype.kind not in 'ifc' or value.dimensions != info.dimensions or
+                    value.units != info.units or value.positive != info.positive):
+                return False
+            if value.ndim == 0 and numpy.ma.getmask(value) is not numpy.ma.nomask:
+                return False
+        return len(self._info.dimensions) > 0
+
+    def _evaluate_(self, values):
+        """Evaluate the tree with PhysArray operators, one operator at a time"""
+        results = []
+        for opstr, left, right, _, _ in self._steps:
+            lval = values[left[1]] if left[0] == 'leaf' else results[left[1]]
+            if opstr == 'neg':
+                results.append(-lval)
+            elif opstr == '**':
+                results.append(lval ** right)
+            else:
+                rval = values[right[1]] if right[0] == 'leaf' else results[right[1]]
+                results.append(_BINOPS_[opstr](lval, rval))
+        return results[-1]
+
+    @staticmethod
+    def _apply_(step, a, b, out=None, scratch=None):
+        """Apply one operator to block data, converting and flipping the second operand as needed"""
+        opstr, _, _, units, negate = step
+        if opstr == 'neg':
+            return numpy.negative(a, out=out)
+        elif opstr == '**':
+            return numpy.power(a, b, out=out)
+        ufunc = _UFUNCS_[opstr]
+        if negate and opstr == '+':
+            ufunc = numpy.subtract
+        elif negate and opstr == '-':
+            ufunc = numpy.add
+        flat = None
+        if units is not None or (negate and opstr == '/'):
+            flat, bout = (None, None) if scratch is None else scratch.get(b.shape, b.dtype)
+            if units is not None:
+                b = unit_converter(*units)(b, out=bout)
+            if negate and opstr == '/':
+                b = numpy.negative(b, out=bout)
+        result = ufunc(a, b, out=out)
+        if negate and opstr == '*':
+            result = numpy.negative(result, out=out)
+        if scratch is not None:
+            scratch.put(flat)
+        return result
+
+    @staticmethod
+    def _mask_invalid_(a, b, result, mask, scratch):
+        """
+        Mask the non-finite results (and the unsafe divisions, if b is given) of an operator
+
+        Like NumPy's masked arrays, divisions are unsafe where |a| * tiny >= |b|.  Apart from
+        division by zero (which gives non-finite results for inexact datatypes), this can only
+        happen where |a / b| >= 1 / tiny, so only results that large need the full test.
+        """
+        flat, invalid = scratch.get(result.shape, numpy.bool_)
+        if result.dtype.kind in 'iu':
+            if b is not None:
+                numpy.equal(b, 0, out=invalid)
+                numpy.logical_or(mask, invalid, out=mask)
+        else:
+            numpy.isfinite(result, out=invalid)
+            numpy.logical_not(invalid, out=invalid)
+            numpy.logical_or(mask, invalid, out=mask)
+            if b is not None and numpy.finfo(result.dtype).max >= _UNSAFE_QUOTIENT_:
+                rflat, absr = scratch.get(result.shape, numpy.finfo(result.dtype).dtype)
+                numpy.greater_equal(numpy.absolute(result, out=absr), _UNSAFE_QUOTIENT_, out=invalid)
+                if invalid.any():
+                    av = numpy.broadcast_to(a, result.shape)[invalid]
+                    bv = numpy.broadcast_to(b, result.shape)[invalid]
+                    invalid[invalid] = numpy.absolute(av) * numpy.finfo(float).tiny >= numpy.absolute(bv)
+                    numpy.logical_or(mask, invalid, out=mask)
+                scratch.put(rflat)
+        scratch.put(flat)
+
+    @staticmethod
+    def _block_index_(block, shape):
+        """Index of a block of the result into an array broadcast to the result dimensions"""
+        return tuple((0 if isinstance(i, int) else slice(None)) if n == 1 else i for i, n in zip(block, shape))
+
+    def _evaluate_blocked_(self, values):
+        """Evaluate the tree over blocks of the result, or return None if it must not be fused"""
+        rdims = self._info.dimensions
+
+        # Find the shape of the result and view the data (and masks) of the leaves in the result dimensions
+        sizes = {}
+        for value in values:
+            for d, s in zip(value.dimensions, value.shape):
+                if sizes.setdefault(d, s) != s:
+                    return None
+        shape = tuple(sizes[d] for d in rdims)
+        views = []
+        masks = []
+        for value in values:
+            if value.ndim == 0:
+                views.append(getdata(value))
+                continue
+            xdims = value.dimensions + tuple(d for d in rdims if d not in value.dimensions)
+            expand = (Ellipsis,) + (None,) * (len(rdims) - value.ndim)
+            axes = tuple(xdims.index(d) for d in rdims)
+            views.append(getdata(value)[expand].transpose(axes))
+            if getmask(value) is not numpy.ma.nomask:
+                masks.append(getmask(value)[expand].transpose(axes))
+
+        # Resolve the datatype of each operator, and the values of operators on scalars alone
+        # (with zero-size arrays standing in for the arrays, so that NumPy's casting rules apply).
+        # Scalars combined with arrays are given one dimension, as the PhysArray operators do, so
+        # that their values do not determine the datatype of the result.
+        dtypes = []
+        constants = []
+
+        def sample(ref):
+            if ref[0] == 'leaf':
+                view = views[ref[1]]
+                return view if view.ndim == 0 else numpy.empty((0,), dtype=view.dtype)
+            const = constants[ref[1]]
+            return numpy.empty((0,), dtype=dtypes[ref[1]]) if const is None else const
+
+        for step in self._steps:
+            opstr, left, right = step[:3]
+            a = sample(left)
+            b = None if opstr == 'neg' else numpy.asarray(right) if opstr == '**' else sample(right)
+            if opstr not in ('neg', '**') and a.ndim != b.ndim:
+                a, b = a.reshape((-1,)), b.reshape((-1,))
+            with numpy.errstate(all='ignore'):
+                value = ElementwiseKernel._apply_(step, a, b)
+                if value.ndim == 0 and opstr in ('/', '**'):
+                    if not numpy.isfinite(value):
+                        return None
+                    if opstr == '/' and numpy.absolute(a) * numpy.finfo(float).tiny >= numpy.absolute(b):
+                        return None
+            dtypes.append(value.dtype)
+            constants.append(value if value.ndim == 0 else None)
+
+        # Evaluate the operators over each block of the result, reusing block-sized buffers
+        data = numpy.empty(shape, dtype=dtypes[-1])
+        masked = len(masks) > 0 or any(step[0] in ('/', '**') for step in self._steps)
+        mask = numpy.zeros(shape, dtype=numpy.bool_) if masked else numpy.ma.nomask
+        size, blocks = _blocks_(shape, self.blocksize)
+        scratch = _Scratch(size)
+        nsteps = len(self._steps)
+
+        def operand(ref, block):
+            if ref[0] == 'step':
+                return results[ref[1]]
+            view = views[ref[1]]
+            return view.reshape((1,)) if view.ndim == 0 else view[ElementwiseKernel._block_index_(block, view.shape)]
+
+        try:
+            for block in blocks:
+                mblock = mask[block] if masked else None
+                for m in masks:
+                    numpy.logical_or(mblock, m[ElementwiseKernel._block_index_(block, m.shape)], out=mblock)
+                results = [None] * nsteps
+                flats = [None] * nsteps
+                for j, step in enumerate(self._steps):
+                    if constants[j] is not None:
+                        results[j] = constants[j].reshape((1,))
+                        continue
+                    opstr, left, right = step[:3]
+                    a = operand(left, block)
+                    b = None if opstr == 'neg' else numpy.asarray(right) if opstr == '**' else operand(right, block)
+                    if j == nsteps - 1:
+                        out = data[block]
+                    else:
+                        flats[j], out = scratch.get(numpy.broadcast(a, a if b is None else b).shape, dtypes[j])
+                    with numpy.errstate(all='ignore'):
+                        results[j] = ElementwiseKernel._apply_(step, a, b, out=out, scratch=scratch)
+                        if opstr in ('/', '**'):
+                            ElementwiseKernel._mask_invalid_(a, b if opstr == '/' else None, results[j],
+                                                             mblock, scratch)
+                    for ref in (left, right):
+                        if isinstance(ref, tuple) and ref[0] == 'step':
+                            scratch.put(flats[ref[1]])
+                            flats[ref[1]] = None
+        finally:
+            scratch.release()
+        if masked and len(masks) == 0 and not mask.any():
+            mask = numpy.ma.nomask  # Unmasked leaves with safe divisions and powers stay unmasked
+
+        names = [value.name for value in values]
+        return PhysArray(numpy.ma.MaskedArray(data, mask=mask, copy=False), name=self._template.format(*names),
+                         units=self._info.units, dimensions=rdims, positive=self._info.positive)
@@ -272,6 +272,7 @@ class BoundsFunction(Function):
 #        self.add_sumlike_dimensions(data_info.dimensions[0])
         if idata is None:
             self._compute_idata = True
+            self.add_halo_dimension(data_info.dimensions[0], int(location > 0), int(location < 2))
         else:
             self._compute_idata = False
             idata_info = idata if is_constant(idata) else idata[None]
@@ -565,11 +566,20 @@ class diff_axis1_ind0bczero_4dFunction(Function):
             raise TypeError('diff_axis1_ind0bczero_4d: data must be a PhysArray')
         if len(data_info.dimensions) != 4:
             raise DimensionsError('diff_axis1_ind0bczero_4d: data can only be 4D')
+        coord_info = new_coord_var if is_constant(new_coord_var) else new_coord_var[None]
+        self._zdims = (coord_info.dimensions[0], data_info.dimensions[1])
+        self.add_halo_dimension(self._zdims[0], 1, 0)
 
     def __getitem__(self, index):
+        # The data is indexed along axis 1 with the index of the new coordinate dimension
+        zdim, ddim = self._zdims
+        dindex = index
+        if isinstance(index, dict) and zdim in index:
+            dindex = dict(index)
+            dindex[ddim] = dindex.pop(zdim)
         p_KMT = self.arguments[0][index]
         p_new_coord_var = self.arguments[1][index]
-        p_data = self.arguments[2][index]
+        p_data = self.arguments[2][dindex]
 
         if index is None:
             a = np.zeros((0, 0, 0, 0))
@@ -577,6 +587,8 @@ class diff_axis1_ind0bczero_4dFunction(Function):
         else:
             KMT = p_KMT.data
             data = p_data.data
+            zindex = dindex.get(ddim, slice(None)) if isinstance(dindex, dict) else slice(None)
+            k0 = (zindex.start or 0) if isinstance(zindex, slice) else zindex
 
             a = np.empty((p_data.shape))
             a[:, 0, :, :] = data[:, 0, :, :]
@@ -586,7 +598,7 @@ class diff_axis1_ind0bczero_4dFunction(Function):
             fv = 1e+20 
             for t in range(p_data.shape[0]):
                 for k in range(p_data.shape[1]):
-                    a[t, k, :, :] = np.where(k < KMT, a[t, k, :, :], fv)
+                    a[t, k, :, :] = np.where(k0 + k < KMT, a[t, k, :, :], fv)
 
         ma_a = np.ma.masked_values(a, fv)
         new_name = '{}({}{}{})'.format(self.key, p_KMT.name, p_new_coord_var.name, p_data.name)
@@ -1384,6 +1396,8 @@ class delpFunction(Function):
 
     def __init__(self, p_PO, p_PS, p_hyai, p_hybi):
         super(delpFunction, self).__init__(p_PO, p_PS, p_hyai, p_hybi)
+        hyai_info = p_hyai if is_constant(p_hyai) else p_hyai[None]
+        self.add_halo_dimension(hyai_info.dimensions[0], 0, 1)
 
     def __getitem__(self, index):
         p_PO = self.arguments[0][index]
@@ -6,7 +6,7 @@ LICENSE: See the LICENSE.rst file for details
 """
 
 from pyconform.physarray import PhysArray
-from pyconform.functions import Function
+from pyconform.functions import Function, is_constant
 
 import pyconform.modules.dynvarmipdiags as dvmd
 import numpy as np
@@ -17,12 +17,17 @@ import numpy as np
 #=========================================================================
 class DynVarMIPFunction(Function):
     key = 'dynvarmipfunc'
+    precision = 'double'
 
     def __init__(self, time, lev, lat, *args):
         super(DynVarMIPFunction, self).__init__(time, lev, lat, *args)
         self._dynvarmip_func = None
         self._units = None
         self._positive = None
+        # Stencil dimensions get a halo of 2 points per nested 'deriv' (its end-point formula
+        # needs 3 points), so that chunked results match the unchunked results
+        data_info = args[-1] if is_constant(args[-1]) else args[-1][None]
+        self._levdim, self._latdim = data_info.dimensions[1:3]
 
     def __getitem__(self, index):
         args = [np.ma.asarray(arg[index]) for arg in self.arguments]
@@ -43,6 +48,8 @@ class wtemDynVarMIPFunction(DynVarMIPFunction):
         super(wtemDynVarMIPFunction, self).__init__(
             time, lev, lat, wzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.wtem
+        self.add_halo_dimension(self._levdim, 2)
+        self.add_halo_dimension(self._latdim, 2)
         self._units = 'm s-1'
         self._positive = None
 
@@ -57,6 +64,8 @@ class utendwtemDynVarMIPFunction(DynVarMIPFunction):
         super(utendwtemDynVarMIPFunction, self).__init__(
             time, lev, lat, uzm, wzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.utendwtem
+        self.add_halo_dimension(self._levdim, 2)
+        self.add_halo_dimension(self._latdim, 2)
         self._units = 'm s-1 d-1'
         self._positive = None
 
@@ -71,6 +80,7 @@ class vtemDynVarMIPFunction(DynVarMIPFunction):
         super(vtemDynVarMIPFunction, self).__init__(
             time, lev, lat, vzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.vtem
+        self.add_halo_dimension(self._levdim, 4)
         self._units = 'm s-1'
         self._positive = None
 
@@ -85,6 +95,8 @@ class utendvtemDynVarMIPFunction(DynVarMIPFunction):
         super(utendvtemDynVarMIPFunction, self).__init__(
             time, lev, lat, uzm, vzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.utendvtem
+        self.add_halo_dimension(self._levdim, 4)
+        self.add_halo_dimension(self._latdim, 2)
         self._units = 'm s-1 d-1'
         self._positive = None
 
@@ -99,6 +111,7 @@ class epfyDynVarMIPFunction(DynVarMIPFunction):
         super(epfyDynVarMIPFunction, self).__init__(
             time, lev, lat, uzm, uvzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.epfy
+        self.add_halo_dimension(self._levdim, 2)
         self._units = 'm3 s-2'
         self._positive = None
 
@@ -113,6 +126,8 @@ class epfzDynVarMIPFunction(DynVarMIPFunction):
         super(epfzDynVarMIPFunction, self).__init__(
             time, lev, lat, uzm, uwzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.epfz
+        self.add_halo_dimension(self._levdim, 2)
+        self.add_halo_dimension(self._latdim, 2)
         self._units = 'm3 s-2'
         self._positive = 'up'
 
@@ -127,6 +142,8 @@ class utendepfdDynVarMIPFunction(DynVarMIPFunction):
         super(utendepfdDynVarMIPFunction, self).__init__(
             time, lev, lat, uzm, uvzm, uwzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.utendepfd
+        self.add_halo_dimension(self._levdim, 4)
+        self.add_halo_dimension(self._latdim, 2)
         self._units = 'm s-2'
         self._positive = None
 
@@ -141,5 +158,6 @@ class psitemDynVarMIPFunction(DynVarMIPFunction):
         super(psitemDynVarMIPFunction, self).__init__(
             time, lev, lat, vzm, vthzm, thzm)
         self._dynvarmip_func = dvmd.psitem
+        self.add_sumlike_dimensions(self._levdim)
         self._units = 'kg s-1'
         self._positive = None
@@ -274,3 +274,29 @@ yacc.yacc(debug=False)
 #=========================================================================
 def parse_definition(strexpr):
     return yacc.parse(strexpr)  # @UndefinedVariable
+
+
+#=========================================================================
+# Function to find the variable names referenced in a parsed definition
+#=========================================================================
+def variable_search(obj, vars=None):
+    """
+    Return the set of variable names referenced in a parsed definition
+
+    Parameters:
+        obj: A parsed definition object (VarType, OpType, FuncType or constant)
+        vars (set): A set of variable names to which the found names are added
+    """
+    if vars is None:
+        vars = set()
+    if isinstance(obj, VarType):
+        vars.add(obj.key)
+    elif isinstance(obj, OpType):
+        for arg in obj.args:
+            vars = variable_search(arg, vars=vars)
+    elif isinstance(obj, FuncType):
+        for arg in obj.args:
+            vars = variable_search(arg, vars=vars)
+        for kwd in obj.kwds:
+            vars = variable_search(obj.kwds[kwd], vars=vars)
+    return vars
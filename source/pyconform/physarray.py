@@ -11,6 +11,7 @@ LICENSE: See the LICENSE.rst file for details
 """
 
 from pyconform.indexing import align_index
+from pyconform.bufferpool import buffer_pool
 from cf_units import Unit
 from os import linesep
 from operator import mul, div
@@ -144,6 +145,150 @@ def getpositive(obj):
         return None
 
 
+#=======================================================================================================================
+# getinfo
+#=======================================================================================================================
+def getinfo(obj):
+    """
+    Retrieve the metadata (PhysInfo) associated with the object, without copying any data
+
+    Objects with an 'info' attribute (e.g., FlowNodes) return that attribute.
+    """
+    if isinstance(obj, PhysInfo):
+        return obj
+    elif isinstance(obj, PhysArray):
+        return PhysInfo(obj.name, units=obj.units, dimensions=obj.dimensions, dtype=obj.dtype,
+                        positive=obj.positive)
+    elif hasattr(obj, 'info'):
+        return obj.info
+    elif ischartype(obj):
+        return PhysInfo(getname(obj), units=Unit('no unit'), dimensions=getdimensions(CharArray._chararray_(obj)),
+                        dtype='S1')
+    else:
+        return PhysInfo(getname(obj), units=getunits(obj), dimensions=getdimensions(obj), dtype=getdtype(obj))
+
+
+#===================================================================================================
+# _reconstruct_
+#===================================================================================================
+def _reconstruct_(subtype, baseclass, baseshape, basetype):
+    """
+    Construct an empty PhysArray (or subclass) to be filled when unpickling
+
+    This is the same as the MaskedArray reconstructor, but it bypasses the PhysArray initializers.
+    """
+    data = numpy.ndarray.__new__(baseclass, baseshape, basetype)
+    mask = numpy.ndarray.__new__(numpy.ndarray, baseshape, numpy.ma.make_mask_descr(basetype))
+    return numpy.ma.MaskedArray.__new__(subtype, data, mask=mask, dtype=basetype)
+
+
+#===================================================================================================
+# UnitConverter
+#===================================================================================================
+class UnitConverter(object):
+    """
+    Converter of data from one unit to another
+
+    Linear conversions are resolved once into a scale factor and offset, which are then applied
+    to the data with NumPy (in place or into a given output array).  Conversions between time
+    reference units, and conversions that the scale factor and offset do not reproduce exactly,
+    are done with cf_units.
+    """
+
+    # Values used to check that the scale factor and offset reproduce the cf_units conversion
+    _PROBE_ = numpy.array([0.0, 1.0, -1.0, 2.5, -7.25, 1e-3, 1e3, -1e5, 3.14159e7])
+
+    def __init__(self, units1, units2):
+        """
+        Initializer
+
+        Parameters:
+            units1 (Unit): The units to convert from
+            units2 (Unit): The units to convert to
+        """
+        self._units1 = units1
+        self._units2 = units2
+        self._scale = None
+        self._offset = None
+        if not (units1.is_time_reference() or units2.is_time_reference()):
+            offset = float(units1.convert(0.0, units2))
+            scale = float(units1.convert(1.0, units2)) - offset
+            probe = UnitConverter._PROBE_
+            if numpy.array_equal(units1.convert(probe, units2), probe * scale + offset):
+                self._scale = scale
+                self._offset = offset
+
+    @property
+    def linear(self):
+        """Whether the conversion is applied as a scale factor and offset"""
+        return self._scale is not None
+
+    @property
+    def scale(self):
+        """The scale factor of a linear conversion (None if not linear)"""
+        return self._scale
+
+    @property
+    def offset(self):
+        """The offset of a linear conversion (None if not linear)"""
+        return self._offset
+
+    def __call__(self, data, out=None):
+        """
+        Convert data, returning the converted data with the same datatype as the input data
+
+        Parameters:
+            data (ndarray): The data to convert
+            out (ndarray): The array in which to store the converted data, which can be the input
+                data itself (if None, a new array is allocated)
+        """
+        if out is None:
+            out = numpy.empty_like(data)
+        if not self.linear:
+            out[...] = self._units1.convert(data, self._units2)
+            return out
+
+        # Compute in double precision, as cf_units does, with a single rounding of the result
+        if self._offset == 0.0:
+            numpy.multiply(data, self._scale, out=out, dtype=numpy.float64, casting='unsafe')
+        elif self._scale == 1.0:
+            numpy.add(data, self._offset, out=out, dtype=numpy.float64, casting='unsafe')
+        elif out.dtype == numpy.float64:
+            numpy.multiply(data, self._scale, out=out)
+            numpy.add(out, self._offset, out=out)
+        else:
+            scaled = numpy.multiply(data, self._scale, dtype=numpy.float64)
+            numpy.add(scaled, self._offset, out=out, casting='unsafe')
+        return out
+
+
+#===================================================================================================
+# Cache of UnitConverters keyed by the units (and calendars) they convert from and to
+#===================================================================================================
+_CONVERTERS_ = {}
+
+
+#===================================================================================================
+# unit_converter
+#===================================================================================================
+def unit_converter(units1, units2):
+    """
+    Return the (cached) UnitConverter from one unit to another
+
+    Parameters:
+        units1 (Unit): The units to convert from
+        units2 (Unit): The units to convert to
+    """
+    u1 = units1 if isinstance(units1, Unit) else Unit(units1)
+    u2 = units2 if isinstance(units2, Unit) else Unit(units2)
+    key = (str(u1), u1.calendar, str(u2), u2.calendar)
+    converter = _CONVERTERS_.get(key, None)
+    if converter is None:
+        converter = UnitConverter(u1, u2)
+        _CONVERTERS_[key] = converter
+    return converter
+
+
 #===================================================================================================
 # PhysArray
 #===================================================================================================
@@ -191,6 +336,17 @@ class PhysArray(numpy.ma.MaskedArray):
 
         return obj
 
+    def __reduce__(self):
+        """Support pickling, including the name, units, dimensions and positive direction"""
+        _, args, state = super(PhysArray, self).__reduce__()
+        return _reconstruct_, args, (state, dict(self._optinfo))
+
+    def __setstate__(self, state):
+        """Restore the pickled state, including the name, units, dimensions and positive direction"""
+        mastate, optinfo = state
+        super(PhysArray, self).__setstate__(mastate)
+        self._optinfo = dict(optinfo)
+
     def __repr__(self):
         datstr = super(PhysArray, self).__str__().replace(linesep, ' ')
         posstr = '' if self.positive is None else ', positive={!r}'.format(self.positive)
@@ -222,35 +378,42 @@ class PhysArray(numpy.ma.MaskedArray):
         self._optinfo['units'] = u if isinstance(u, Unit) else Unit(u)
 
     @staticmethod
-    def _safe_convert_(obj, units1, units2):
+    def _safe_convert_(obj, units1, units2, inplace=False):
         # Because netcdftime datetime conversion always returns an NDArray, even if the
         # original object is a subclass of NDArray, we have to wrap the convert function
         # to safely preserve the object type...  sigh.
         u1 = units1 if isinstance(units1, Unit) else Unit(units1)
         u2 = units2 if isinstance(units2, Unit) else Unit(units2)
+        converter = unit_converter(u1, u2)
         if isinstance(obj, PhysArray):
-            new_array = numpy.ma.MaskedArray(units1.convert(obj.data, units2), mask=obj.mask, dtype=obj.dtype)
             u1_str = '{}'.format(u1) + ('|{}'.format(u1.calendar) if u1.calendar else '')
             u2_str = '{}'.format(u2) + ('|{}'.format(u2.calendar) if u2.calendar else '')
             new_name = "convert({}, from={}, to={})".format(obj.name, u1_str, u2_str)
+            if inplace:
+                converter(obj.data, out=obj.data)
+                obj.name = new_name
+                obj.units = u2
+                return obj
+            new_array = numpy.ma.MaskedArray(converter(obj.data), mask=obj.mask, dtype=obj.dtype)
             return PhysArray(new_array, name=new_name, units=u2, dimensions=obj.dimensions)
         elif isinstance(obj, numpy.ma.MaskedArray):
-            return numpy.ma.MaskedArray(u1.convert(obj.data, u2), mask=obj.mask, dtype=obj.dtype)
+            return numpy.ma.MaskedArray(converter(obj.data), mask=obj.mask, dtype=obj.dtype)
         else:
             return u1.convert(obj, u2)
 
-    def convert(self, units):
+    def convert(self, units, inplace=False):
         """
         Return a new PhysArray with new units
 
         Parameters:
             units (Unit): The new units to which to convert the PhysArray
+            inplace (bool): Whether to convert the data in place (returning this PhysArray)
         """
         uunit = units if isinstance(units, Unit) else Unit(units)
         if self.units == uunit:
             return self
         elif self.units.is_convertible(uunit):
-            return PhysArray._safe_convert_(self, self.units, uunit)
+            return PhysArray._safe_convert_(self, self.units, uunit, inplace=inplace)
         else:
             raise UnitsError('Cannot convert units {!r} to {!r}'.format(self.units, uunit))
 
@@ -415,16 +578,121 @@ class PhysArray(numpy.ma.MaskedArray):
                     raise DimensionsError(('Cannot broadcast dimensions {} to {} in inplace operation'
                                            '').format(other.dimensions, self.dimensions))
 
+    # NumPy ufuncs and MaskedArray methods implementing the binary operators
+    _UFUNCS_ = {'+': numpy.add, '-': numpy.subtract, '*': numpy.multiply, '/': numpy.divide,
+                '//': numpy.floor_divide}
+    _MASKED_OPS_ = {'+': '__add__', '-': '__sub__', '*': '__mul__', '/': '__div__', '//': '__floordiv__'}
+
     def _add_sub_init_(self, other):
         other = self._broadcast_(PhysArray(other)).convert(self.units)
         self._match_positive_(other)
         return other
 
-    def __add__(self, other):
+    def _binary_op_(self, other, opstr):
+        other = PhysArray(other)
+        numeric = self.dtype.kind in 'ifc' and other.dtype.kind in 'ifc'
+        if not numeric or self.ndim + other.ndim == 0:
+            return self._masked_binary_op_(other, opstr)
+
+        # Determine the metadata of the result without touching any data
+        for d in set(self.dimensions).intersection(set(other.dimensions)):
+            if self.shape[self.dimensions.index(d)] != other.shape[other.dimensions.index(d)]:
+                raise DimensionsError('Cannot broadcast arrays with dimensions {} and '
+                                      '{}'.format(self.dimensions, other.dimensions))
+        info, convert, negate = getinfo(self)._binary_op_(getinfo(other), opstr)
+        converter = unit_converter(other.units, self.units) if convert else None
+
+        # Broadcast the operand data (and masks) to the result dimensions with strided views
+        rdims = info.dimensions
+        odims = other.dimensions + tuple(d for d in self.dimensions if d not in other.dimensions)
+        sindex = (Ellipsis,) + (None,) * (len(rdims) - self.ndim)
+        oindex = (Ellipsis,) + (None,) * (len(odims) - other.ndim)
+        oaxes = tuple(odims.index(d) for d in rdims)
+        masks = []
+        if getmask(self) is not numpy.ma.nomask:
+            masks.append(getmask(self)[sindex])
+        if getmask(other) is not numpy.ma.nomask:
+            masks.append(getmask(other)[oindex].transpose(oaxes))
+
+        # Flip the sign of the other operand by changing the operator (or by negating the result)
+        ufunc = PhysArray._UFUNCS_[opstr]
+        if negate and opstr == '+':
+            ufunc = numpy.subtract
+        elif negate and opstr == '-':
+            ufunc = numpy.add
+
+        pool = buffer_pool()
+        temps = []
+        try:
+            sdata = getdata(self)[sindex]
+            odata = getdata(other)
+            if converter is not None or (negate and opstr in ('/', '//')):
+                temps.append(pool.get(odata.shape, odata.dtype))
+                if converter is not None:
+                    odata = converter(odata, out=temps[-1])
+                if negate and opstr in ('/', '//'):
+                    odata = numpy.negative(odata, out=temps[-1])
+            odata = odata[oindex].transpose(oaxes)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                data = ufunc(sdata, odata)
+            if negate and opstr == '*':
+                numpy.negative(data, out=data)
+
+            # Combine the masks, and put back the data of the first operand where masked
+            if opstr in ('/', '//'):
+                mask = numpy.isfinite(data)
+                numpy.logical_not(mask, out=mask)
+                for m in masks:
+                    numpy.logical_or(mask, m, out=mask)
+                tolerance = numpy.finfo(float).tiny
+                temps.append(pool.get(sdata.shape, numpy.result_type(sdata, tolerance)))
+                temps.append(pool.get(odata.shape, odata.dtype))
+                temps.append(pool.get(data.shape, numpy.bool_))
+                with numpy.errstate(invalid='ignore'):
+                    numpy.multiply(numpy.absolute(sdata, out=temps[-3]), tolerance, out=temps[-3])
+                    numpy.absolute(odata, out=temps[-2])
+                    numpy.greater_equal(temps[-3], temps[-2], out=temps[-1])
+                numpy.logical_or(mask, temps[-1], out=mask)
+                if len(masks) == 0 and not mask.any():
+                    mask = numpy.ma.nomask  # Unmasked operands with safe divisions stay unmasked
+                elif numpy.can_cast(sdata.dtype, data.dtype, casting='safe'):
+                    numpy.copyto(data, sdata, where=mask)
+                else:
+                    numpy.copyto(data, 0, casting='unsafe', where=mask)
+            elif len(masks) > 0:
+                mask = numpy.empty(data.shape, dtype=numpy.bool_)
+                if len(masks) == 2:
+                    numpy.logical_or(masks[0], masks[1], out=mask)
+                else:
+                    mask[...] = masks[0]
+                numpy.copyto(data, sdata, casting='unsafe', where=mask)
+            else:
+                mask = numpy.ma.nomask
+        finally:
+            pool.release(*temps)
+
+        result = data.view(PhysArray)
+        result._mask = mask
+        result._update_from(self)
+        return PhysArray(result, name=info.name, units=info.units, dimensions=rdims, positive=info.positive)
+
+    def _masked_binary_op_(self, other, opstr):
         result = PhysArray(self)
-        other = result._add_sub_init_(other)
-        return PhysArray(super(PhysArray, result).__add__(other), name='({}+{})'.format(result.name, other.name),
-                         units=result.units, positive=result.positive)
+        other = PhysArray(other)
+        if None not in (self.positive, other.positive) and self.positive != other.positive:
+            other = other.copy()  # Flipping the sign of the other operand must not modify its data
+        if opstr in ('+', '-'):
+            other = result._add_sub_init_(other)
+            units = result.units
+        else:
+            other = result._mul_div_init_(other)
+            units = self._units_op_(other.units, mul if opstr == '*' else div)
+        data = getattr(super(PhysArray, result), PhysArray._MASKED_OPS_[opstr])(other)
+        return PhysArray(data, name='({}{}{})'.format(result.name, opstr, other.name), units=units,
+                         positive=result.positive)
+
+    def __add__(self, other):
+        return self._binary_op_(other, '+')
 
     def __radd__(self, other):
         return PhysArray(other).__add__(self)
@@ -437,10 +705,7 @@ class PhysArray(numpy.ma.MaskedArray):
         return self
 
     def __sub__(self, other):
-        result = PhysArray(self)
-        other = result._add_sub_init_(other)
-        return PhysArray(super(PhysArray, result).__sub__(other), name='({}-{})'.format(result.name, other.name),
-                         units=result.units, positive=result.positive)
+        return self._binary_op_(other, '-')
 
     def __rsub__(self, other):
         return PhysArray(other).__sub__(self)
@@ -467,10 +732,7 @@ class PhysArray(numpy.ma.MaskedArray):
         return other
 
     def __mul__(self, other):
-        result = PhysArray(self)
-        other = result._mul_div_init_(other)
-        return PhysArray(super(PhysArray, result).__mul__(other), name='({}*{})'.format(result.name, other.name),
-                         units=self._units_op_(other.units, mul), positive=result.positive)
+        return self._binary_op_(other, '*')
 
     def __rmul__(self, other):
         return PhysArray(other).__mul__(self)
@@ -489,10 +751,7 @@ class PhysArray(numpy.ma.MaskedArray):
                          name='(1/{!s})'.format(self), positive=self.positive)
 
     def __div__(self, other):
-        result = PhysArray(self)
-        other = result._mul_div_init_(other)
-        return PhysArray(super(PhysArray, result).__div__(other), name='({}/{})'.format(result.name, other.name),
-                         units=self._units_op_(other.units, div), positive=result.positive)
+        return self._binary_op_(other, '/')
 
     def __rdiv__(self, other):
         return PhysArray(other).__div__(self)
@@ -506,10 +765,7 @@ class PhysArray(numpy.ma.MaskedArray):
         return self
 
     def __floordiv__(self, other):
-        result = PhysArray(self)
-        other = result._mul_div_init_(other)
-        return PhysArray(super(PhysArray, result).__floordiv__(other), name='({}//{})'.format(result.name, other.name),
-                         units=self._units_op_(other.units, div), positive=result.positive)
+        return self._binary_op_(other, '//')
 
     def __rfloordiv__(self, other):
         return PhysArray(other).__floordiv__(self)
@@ -703,9 +959,9 @@ class CharArray(PhysArray):
             raise ValueError('CharArrays cannot be assigned a positive attribute')
         self._optinfo['positive'] = pos
 
-    def convert(self, units):
+    def convert(self, units, inplace=False):
         try:
-            new_self = PhysArray.convert(self, units)
+            new_self = PhysArray.convert(self, units, inplace=inplace)
         except UnitsError:
             raise UnitsError('CharArrays do not have units and cannot be converted to units {}'.format(units))
         return new_self
@@ -726,3 +982,242 @@ class CharArray(PhysArray):
             return CharArray(numpy.ma.concatenate((self, pad), axis=-1), name=self.name, dimensions=self.dimensions)
         else:
             return self
+
+
+#=======================================================================================================================
+# PhysInfo
+#=======================================================================================================================
+class PhysInfo(object):
+    """
+    The metadata of a PhysArray (name, units, dimensions, dtype and positive) without any data
+
+    PhysInfo objects follow the same naming, units, dimensions and positive-direction rules as the
+    PhysArray arithmetic operators, so that the metadata of a computed result can be determined
+    without allocating (or computing) any data.
+    """
+    __slots__ = ('name', '_units', 'dimensions', 'dtype', '_positive')
+
+    def __init__(self, name, units=None, dimensions=(), dtype=None, positive=None):
+        """
+        Initializer
+
+        Parameters:
+            name (str): String name for the data
+            units (Unit): Units of the data [Default: unitless]
+            dimensions (tuple): Named dimensions of the data
+            dtype (dtype): Numpy datatype of the data [Default: float64]
+            positive (str): Positive direction (up or down) for the data, or None
+        """
+        self.name = name
+        self.units = Unit(1) if units is None else units
+        self.dimensions = tuple(dimensions)
+        self.dtype = numpy.dtype('d' if dtype is None else dtype)
+        self.positive = positive
+
+    def __repr__(self):
+        posstr = '' if self.positive is None else ', positive={!r}'.format(self.positive)
+        return ('{!s}(units={!r}, name={!r}, dimensions={!s}, dtype={!s}{})').format(
+            self.__class__.__name__, str(self.units), self.name, self.dimensions, self.dtype, posstr)
+
+    def __str__(self):
+        return '{}'.format(self.name)
+
+    @property
+    def units(self):
+        """Units of the data"""
+        return self._units
+
+    @units.setter
+    def units(self, u):
+        """Units of the data"""
+        self._units = u if isinstance(u, Unit) else Unit(u)
+
+    @property
+    def positive(self):
+        """Positive direction (up or down) for the data"""
+        return self._positive
+
+    @positive.setter
+    def positive(self, pos):
+        """Positive direction (up or down) for the data"""
+        if isinstance(pos, basestring):
+            strpos = str(pos).lower()
+            if strpos not in ['up', 'down']:
+                raise ValueError('Positive attribute must be up/down or None, not {!r}'.format(pos))
+            pos = strpos
+        elif pos is not None:
+            raise ValueError('Positive attribute must be up/down or None, not {!r}'.format(pos))
+        self._positive = pos
+
+    def copy(self):
+        """Return a copy of the PhysInfo object"""
+        return PhysInfo(self.name, units=self.units, dimensions=self.dimensions, dtype=self.dtype,
+                        positive=self.positive)
+
+    def convert(self, units):
+        """
+        Return the PhysInfo of the data converted to new units
+
+        Parameters:
+            units (Unit): The new units to which to convert
+        """
+        uunit = units if isinstance(units, Unit) else Unit(units)
+        if self.units == uunit:
+            return self
+        elif self.units.is_convertible(uunit):
+            u1 = self.units
+            u1_str = '{}'.format(u1) + ('|{}'.format(u1.calendar) if u1.calendar else '')
+            u2_str = '{}'.format(uunit) + ('|{}'.format(uunit.calendar) if uunit.calendar else '')
+            new_name = "convert({}, from={}, to={})".format(self.name, u1_str, u2_str)
+            return PhysInfo(new_name, units=uunit, dimensions=self.dimensions, dtype=self.dtype)
+        else:
+            raise UnitsError('Cannot convert units {!r} to {!r}'.format(self.units, uunit))
+
+    def transpose(self, *dims):
+        """
+        Return the PhysInfo of the data with dimensions transposed in the order given
+
+        Parameters:
+            dims (tuple): Tuple of dimension names in the new order
+        """
+        if len(dims) == 1 and isinstance(dims[0], (list, tuple)):
+            dims = tuple(dims[0])
+        if set(dims) != set(self.dimensions):
+            raise DimensionsError(('Cannot transpose dimensions/axes {} to {}').format(self.dimensions, dims))
+        new_dims = tuple(dims)
+        if new_dims == self.dimensions:
+            return self
+        old_dims_str = ','.join([str(d) for d in self.dimensions])
+        new_dims_str = ','.join([str(d) for d in new_dims])
+        new_name = 'transpose({}, from=[{}], to=[{}])'.format(self.name, old_dims_str, new_dims_str)
+        return PhysInfo(new_name, units=self.units, dimensions=new_dims, dtype=self.dtype, positive=self.positive)
+
+    def flip(self):
+        """Flip the direction of the positive attribute, if set"""
+        if self.positive is not None:
+            self.positive = 'up' if self.positive == 'down' else 'down'
+            self.name = '{}({})'.format(self.positive, self.name)
+        return self
+
+    def up(self):
+        """Set the direction of the positive attribute to 'up'"""
+        if self.positive is None:
+            self.positive = 'up'
+            self.name = 'up({})'.format(self.name)
+        elif self.positive == 'down':
+            self.flip()
+        return self
+
+    def down(self):
+        """Set the direction of the positive attribute to 'down'"""
+        if self.positive is None:
+            self.positive = 'down'
+            self.name = 'down({})'.format(self.name)
+        elif self.positive == 'up':
+            self.flip()
+        return self
+
+    def _broadcast_(self, other):
+        self_dims = self.dimensions + tuple(d for d in other.dimensions if d not in self.dimensions)
+        other_dims = other.dimensions + tuple(d for d in self.dimensions if d not in other.dimensions)
+        if len(self.dimensions) > 0 and self_dims != self.dimensions:
+            fromdims = ','.join([str(d) for d in self.dimensions])
+            todims = ','.join([str(d) for d in self_dims])
+            self.name = 'broadcast({}, from=[{}], to=[{}])'.format(self.name, fromdims, todims)
+        self.dimensions = self_dims
+        if len(other.dimensions) > 0 and other_dims != other.dimensions:
+            fromdims = ','.join([str(d) for d in other.dimensions])
+            todims = ','.join([str(d) for d in other_dims])
+            other.name = 'broadcast({}, from=[{}], to=[{}])'.format(other.name, fromdims, todims)
+        other.dimensions = other_dims
+        return other.transpose(self_dims)
+
+    def _match_positive_(self, other):
+        if self.positive == other.positive:
+            pass
+        elif self.positive is None:
+            if other.positive == 'up':
+                self.up()
+            elif other.positive == 'down':
+                self.down()
+        elif other.positive is None:
+            if self.positive == 'up':
+                other.up()
+            elif self.positive == 'down':
+                other.down()
+        else:
+            other.flip()
+
+    def _binary_op_(self, other, opstr):
+        """
+        Resolve the metadata of a binary operator (+, -, *, /, //) applied to this and another PhysInfo
+
+        Returns the PhysInfo of the result, whether the data of the other operand must be converted
+        to the units of this operand, and whether the sign of the other operand must be flipped to
+        match the positive direction of this operand.
+        """
+        result = self.copy()
+        other = result._broadcast_(getinfo(other).copy())
+        convert = False
+        if opstr in ('+', '-'):
+            units = result.units
+            converted = other.convert(units)
+            convert = converted is not other
+            other = converted
+        else:
+            op = mul if opstr == '*' else div
+            try:
+                units = op(self.units, other.units)
+            except:
+                opnm = str(op.__name__)
+                raise UnitsError('Operator {!r} failed with units: {}, {}'.format(opnm, self.units, other.units))
+        negate = None not in (result.positive, other.positive) and result.positive != other.positive
+        result._match_positive_(other)
+        info = PhysInfo('({}{}{})'.format(result.name, opstr, other.name), units=units,
+                        dimensions=result.dimensions, dtype=numpy.result_type(result.dtype, other.dtype),
+                        positive=result.positive)
+        return info, convert, negate
+
+    def __neg__(self):
+        return self.copy()
+
+    def __add__(self, other):
+        return self._binary_op_(other, '+')[0]
+
+    def __radd__(self, other):
+        return getinfo(other).__add__(self)
+
+    def __sub__(self, other):
+        return self._binary_op_(other, '-')[0]
+
+    def __rsub__(self, other):
+        return getinfo(other).__sub__(self)
+
+    def __mul__(self, other):
+        return self._binary_op_(other, '*')[0]
+
+    def __rmul__(self, other):
+        return getinfo(other).__mul__(self)
+
+    def __div__(self, other):
+        return self._binary_op_(other, '/')[0]
+
+    def __rdiv__(self, other):
+        return getinfo(other).__div__(self)
+
+    def __truediv__(self, other):
+        return self.__div__(other)
+
+    def __rtruediv__(self, other):
+        return getinfo(other).__truediv__(self)
+
+    def __pow__(self, other):
+        """
+        Exponentiation by a known scalar constant (the exponent value determines the positive attribute)
+        """
+        if not isinstance(other, (int, long, float)):
+            raise TypeError('PhysInfo exponents must be scalar constants: {!r}'.format(other))
+        positive = None if other % 2 == 0 else self.positive
+        return PhysInfo('({!s}**{!s})'.format(self.name, getname(other)), units=self.units**other,
+                        dimensions=self.dimensions, dtype=numpy.result_type(self.dtype, other),
+                        positive=positive)
@@ -0,0 +1,105 @@
+"""
+BufferPool Unit Tests
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from pyconform import bufferpool
+from testutils import print_test_message
+from threading import Thread
+
+import unittest
+import sys
+
+
+#=========================================================================
+# BufferPoolTests
+#=========================================================================
+class BufferPoolTests(unittest.TestCase):
+    """
+    Unit tests for the bufferpool.BufferPool class
+    """
+
+    def test_init(self):
+        testname = 'BufferPool(maxbytes=100)'
+        pool = bufferpool.BufferPool(maxbytes=100)
+        actual = (pool.maxbytes, pool.nbytes, len(pool))
+        expected = (100, 0, 0)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_init_invalid(self):
+        testname = 'BufferPool(maxbytes=-1)'
+        expected = ValueError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, bufferpool.BufferPool, maxbytes=-1)
+
+    def test_get_release(self):
+        testname = 'BufferPool.get() after release()'
+        pool = bufferpool.BufferPool()
+        buf1 = pool.get((3, 4), 'd')
+        pool.release(buf1)
+        buf2 = pool.get((3, 4), 'd')
+        buf3 = pool.get((3, 4), 'f')
+        actual = (buf2 is buf1, buf3 is buf1, pool.allocated, pool.saved, len(pool))
+        expected = (True, False, 144, 96, 0)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_get_threads(self):
+        testname = 'BufferPool.get() from multiple threads'
+        pool = bufferpool.BufferPool()
+
+        def getmany():
+            for _ in xrange(5000):
+                pool.get((1,), 'd')
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [Thread(target=getmany) for _ in xrange(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        actual = pool.allocated
+        expected = 4 * 5000 * 8
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_release_maxbytes(self):
+        testname = 'BufferPool(maxbytes=100).release()'
+        pool = bufferpool.BufferPool(maxbytes=100)
+        pool.release(pool.get((8,), 'd'), pool.get((8,), 'd'), None)
+        actual = (len(pool), pool.nbytes)
+        expected = (1, 64)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_clear(self):
+        testname = 'BufferPool.clear()'
+        pool = bufferpool.BufferPool()
+        pool.release(pool.get((8,), 'd'))
+        pool.clear()
+        actual = (len(pool), pool.nbytes)
+        expected = (0, 0)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_buffer_pool(self):
+        testname = 'buffer_pool()'
+        actual = bufferpool.buffer_pool()
+        expected = bufferpool.buffer_pool()
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertIs(actual, expected, '{} failed'.format(testname))
+
+
+#===============================================================================
+# Command-Line Operation
+#===============================================================================
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
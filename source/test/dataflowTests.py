@@ -7,13 +7,16 @@ LICENSE: See the LICENSE.rst file for details
 
 from os import remove
 from os.path import exists
-from pyconform import dataflow, datasets
+from pyconform import dataflow, datasets, flownodes
+from pyconform.filepool import dataset_pool
+from pyconform.kernels import ElementwiseKernel
 from testutils import print_test_message, print_ncfile
 from collections import OrderedDict
 from netCDF4 import Dataset as NCDataset
 
 import unittest
 import numpy
+import cPickle as pickle
 
 
 #=========================================================================
@@ -347,6 +350,7 @@ class DataFlowTests(unittest.TestCase):
                 remove(fname)
 
     def tearDown(self):
+        dataset_pool().close()
         self.cleanInputFiles()
         self.cleanOutputFiles()
 
@@ -367,6 +371,174 @@ class DataFlowTests(unittest.TestCase):
         print_test_message(testname, actual=actual, expected=expected)
         self.assertEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_node_infos(self):
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        for vname in sorted(df._valnodes):
+            vnode = df._valnodes[vname]
+            for node in [vnode, vnode.inputs[0]] + list(vnode.inputs[0].inputs):
+                if not isinstance(node, flownodes.FlowNode):
+                    continue
+                testname = '{}.info'.format(node.label)
+                actual = node.info
+                expected = node._getitem_(None)
+                print_test_message(testname, actual=actual, expected=expected)
+                self.assertEqual(actual.name, expected.name, '{} failed - name'.format(testname))
+                self.assertEqual(actual.units, expected.units, '{} failed - units'.format(testname))
+                self.assertEqual(actual.dimensions, expected.dimensions,
+                                 '{} failed - dimensions'.format(testname))
+                self.assertEqual(actual.dtype, expected.dtype, '{} failed - dtype'.format(testname))
+                self.assertEqual(actual.positive, expected.positive, '{} failed - positive'.format(testname))
+
+    def test_deduplicated_nodes(self):
+        testname = 'DataFlow().deduplicated_nodes'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        actual = df.deduplicated_nodes
+        expected = 8
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_shared_subexpressions(self):
+        testname = 'DataFlow(V1 = u1 + u2, V2 = 2*(u1 + u2))'
+        vdicts = OrderedDict()
+        for vname, vdef in [('V1', 'u1 + u2'), ('V2', '2*(u2 + u1)'), ('V3', '2*(u1 + u2)')]:
+            vdicts[vname] = OrderedDict()
+            vdicts[vname]['datatype'] = 'double'
+            vdicts[vname]['dimensions'] = ('t', 'y', 'x')
+            vdicts[vname]['definition'] = vdef
+            vdicts[vname]['attributes'] = OrderedDict([('units', 'm')])
+        vdicts['V3']['file'] = OrderedDict([('filename', 'var3.nc')])
+        outds = datasets.OutputDatasetDesc('outds', vdicts)
+        df = dataflow.DataFlow(self.inpds, outds)
+        actual = df.deduplicated_nodes
+        expected = 5
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        defnodes = dict((n, df._valnodes[n].inputs[0].inputs[0]) for n in vdicts)
+        self.assertIs(defnodes['V1'], defnodes['V3'].inputs[1],
+                      '{} failed'.format(testname))
+        self.assertIsNot(defnodes['V2'], defnodes['V3'],
+                         '{} failed'.format(testname))
+
+    def test_precision(self):
+        testname = "DataFlow(precision={'V2': 'double'})"
+        vdicts = OrderedDict()
+        for vname, vdef in [('V1', 'u1 + u2'), ('V2', 'u1 + u2'), ('M', 'mean(u1 + u2, "time")')]:
+            vdicts[vname] = OrderedDict()
+            vdicts[vname]['datatype'] = 'float'
+            vdicts[vname]['dimensions'] = ('t', 'y', 'x') if vname != 'M' else ('y', 'x')
+            vdicts[vname]['definition'] = vdef
+            vdicts[vname]['attributes'] = OrderedDict([('units', 'm')])
+            vdicts[vname]['file'] = OrderedDict([('filename', '{}.nc'.format(vname))])
+        outds = datasets.OutputDatasetDesc('outds', vdicts)
+        df = dataflow.DataFlow(self.inpds, outds, precision={'V2': 'double'})
+        actual = {}
+        for vname in vdicts:
+            for nd in flownodes.iter_dfs(df._valnodes[vname]):
+                if isinstance(nd, flownodes.ReadNode):
+                    actual[vname] = (nd.precision, nd.info.dtype)
+        expected = {'V1': ('single', numpy.dtype('f')), 'V2': ('double', numpy.dtype('d')),
+                    'M': ('single', numpy.dtype('f'))}
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        actual = (df._valnodes['V1'].inputs[0].info.dtype, df._valnodes['M'].inputs[0].info.dtype)
+        expected = (numpy.dtype('f'), numpy.dtype('d'))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_fused_nodes(self):
+        testname = 'DataFlow().fused_nodes'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        actual = df.fused_nodes
+        expected = 2
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        actual = type(df._valnodes['V1'].inputs[0].inputs[0].function)
+        expected = ElementwiseKernel
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_unfused(self):
+        testname = 'DataFlow(fuse=False).execute()'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute()
+        expected = {}
+        for f in self.outfiles.itervalues():
+            with NCDataset(f) as ncf:
+                expected[f] = {v: ncf.variables[v][...] for v in ncf.variables}
+            remove(f)
+        df = dataflow.DataFlow(self.inpds, self.outds, fuse=False)
+        self.assertEqual(df.fused_nodes, 0, '{} failed'.format(testname))
+        df.execute()
+        for f in self.outfiles.itervalues():
+            with NCDataset(f) as ncf:
+                for v in ncf.variables:
+                    print_test_message(testname, file=f, variable=v)
+                    numpy.testing.assert_array_equal(ncf.variables[v][...], expected[f][v],
+                                                     '{} failed: {}'.format(testname, v))
+
+    def test_precision_invalid(self):
+        testname = "DataFlow(precision='half')"
+        expected = ValueError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, dataflow.DataFlow, self.inpds, self.outds, precision='half')
+
+    def test_execute_precision_double(self):
+        testname = "DataFlow(precision='double').execute()"
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute()
+        expected = {}
+        for f in self.outfiles.itervalues():
+            with NCDataset(f) as ncf:
+                expected[f] = {v: ncf.variables[v][:] for v in ncf.variables}
+            remove(f)
+        df = dataflow.DataFlow(self.inpds, self.outds, precision='double')
+        df.execute()
+        for f in self.outfiles.itervalues():
+            with NCDataset(f) as ncf:
+                for v in ncf.variables:
+                    actual = ncf.variables[v][:]
+                    print_test_message(testname, file=f, variable=v)
+                    if actual.dtype.kind == 'f':
+                        same = numpy.ma.allclose(actual, expected[f][v], rtol=1e-6)
+                    else:
+                        same = numpy.array_equal(actual, expected[f][v])
+                    self.assertTrue(same, '{} failed: {}'.format(testname, v))
+
+    def test_cost_estimates(self):
+        testname = 'DataFlow().cost_estimates'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        costs = df.cost_estimates
+        actual = (sorted(costs), costs['var6_19790101-19790104.nc']['written'])
+        expected = (sorted(df._writenodes), 8 * (4 * 7 + 7 + 4 + 4 + 4 * 2))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        for cost in costs.itervalues():
+            self.assertGreater(cost['read'], 0, '{} failed'.format(testname))
+            self.assertGreater(cost['seconds'], 0, '{} failed'.format(testname))
+        self.assertGreater(costs['var1_19790111-19790114.nc']['compute'],
+                           costs['var6_19790101-19790104.nc']['compute'], '{} failed'.format(testname))
+
+    def test_cost_estimates_no_reads(self):
+        testname = 'DataFlow()._compute_file_costs_() reads no data'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        for wnode in df._writenodes.itervalues():
+            for node in flownodes.iter_dfs(wnode):
+                if isinstance(node, flownodes.FlowNode):
+                    node._info = None
+                    node._nulldata = None
+        indices = []
+        getitem = flownodes.ReadNode._getitem_
+        flownodes.ReadNode._getitem_ = lambda node, index: indices.append(index) or getitem(node, index)
+        try:
+            df._compute_file_costs_()
+            df.chunk_sizes(2000)
+        finally:
+            flownodes.ReadNode._getitem_ = getitem
+        actual = indices
+        expected = []
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
     def test_execute_all(self):
         testname = 'DataFlow().execute()'
         df = dataflow.DataFlow(self.inpds, self.outds)
@@ -379,12 +551,176 @@ class DataFlowTests(unittest.TestCase):
             print_ncfile(self.outfiles[f])
             print
 
-    def test_execute_chunks_1D_x(self):
-        testname = 'DataFlow().execute()'
+    def test_pickle(self):
+        testname = 'pickle.loads(pickle.dumps(DataFlow())).execute()'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute()
+        expected = {}
+        for f in self.outfiles.itervalues():
+            with NCDataset(f) as ncf:
+                expected[f] = {v: ncf.variables[v][...] for v in ncf.variables}
+        self.cleanOutputFiles()
+        df = pickle.loads(pickle.dumps(dataflow.DataFlow(self.inpds, self.outds), pickle.HIGHEST_PROTOCOL))
+        df.execute()
+        actual = {}
+        for f in self.outfiles.itervalues():
+            with NCDataset(f) as ncf:
+                actual[f] = {v: ncf.variables[v][...] for v in ncf.variables}
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(sorted(actual), sorted(expected), '{} failed'.format(testname))
+        for f in expected:
+            self.assertEqual(sorted(actual[f]), sorted(expected[f]), '{} failed'.format(testname))
+            for v in expected[f]:
+                numpy.testing.assert_array_equal(actual[f][v], expected[f][v],
+                                                 '{} failed'.format(testname))
+
+    def test_execute_cache(self):
+        testname = 'DataFlow().execute(cachesize=1048576)'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(chunks={'t': 2}, cachesize=1048576)
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_dynamic(self):
+        testname = 'DataFlow().execute(schedule="dynamic")'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(schedule='dynamic')
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_affinity(self):
+        testname = 'DataFlow().execute(schedule="affinity")'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(schedule='affinity')
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_affinity_partition(self):
+        testname = 'DataFlow._affinity_partition_()'
+        costs = {'a': 4.0, 'b': 3.0, 'c': 3.0, 'd': 2.0}
+        inputs = {'a': {'T': 10}, 'b': {'U': 10}, 'c': {'T': 10, 'PS': 1}, 'd': {'U': 10}}
+        actual = dataflow.DataFlow._affinity_partition_(costs, inputs, 2, tolerance=0.2)
+        expected = [['a', 'c'], ['b', 'd']]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_affinity_partition_balance(self):
+        testname = 'DataFlow._affinity_partition_() with all shared inputs'
+        costs = {'a': 1.0, 'b': 1.0, 'c': 1.0, 'd': 1.0}
+        inputs = {f: {'T': 10} for f in costs}
+        actual = dataflow.DataFlow._affinity_partition_(costs, inputs, 2)
+        expected = [['a', 'b'], ['c', 'd']]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_workers(self):
+        testname = 'DataFlow().execute(workers=2)'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(workers=2)
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_threads(self):
+        testname = 'DataFlow().execute(threads=2)'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(chunks={'t': 2}, threads=2)
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_groupsize_serial(self):
+        testname = 'DataFlow().execute(groupsize=2) in serial'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(chunks={'t': 2}, groupsize=2)
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_groupsize_dynamic(self):
+        testname = 'DataFlow().execute(groupsize=2, schedule="dynamic")'
         df = dataflow.DataFlow(self.inpds, self.outds)
         expected = ValueError
         print_test_message(testname, expected=expected)
-        self.assertRaises(expected, df.execute, chunks={'x': 4})
+        self.assertRaises(expected, df.execute, groupsize=2, schedule='dynamic')
+
+    def test_execute_pipeline(self):
+        testname = 'DataFlow().execute(pipeline=2)'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(chunks={'t': 2}, pipeline=2)
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_chunk_sizes(self):
+        testname = 'DataFlow().chunk_sizes()'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        unlimited = df.chunk_sizes(10 ** 9)
+        limited = df.chunk_sizes(2000)
+        actual = ([dict(c) for c, _ in unlimited.itervalues()],
+                  dict(limited['var3_19790101-19790104.nc'][0]))
+        expected = ([{}] * len(df._writenodes), {'t': 1})
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        for fname, (_, nbytes) in limited.iteritems():
+            self.assertLess(nbytes, unlimited[fname][1] + 1, '{} failed'.format(testname))
+
+    def test_execute_memory_limit(self):
+        testname = 'DataFlow().execute(memory_limit=500)'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(memory_limit=500)
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_workers_invalid(self):
+        testname = 'DataFlow().execute(workers=0)'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        expected = ValueError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, df.execute, workers=0)
+
+    def test_execute_schedule_invalid(self):
+        testname = 'DataFlow().execute(schedule="random")'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        expected = ValueError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, df.execute, schedule='random')
+
+    def test_execute_chunks_1D_x(self):
+        testname = 'DataFlow().execute(chunks={"x": 4}) over streamed mean dimension'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute(chunks={'x': 4})
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_chunks_streamed_values(self):
+        testname = 'DataFlow().execute(chunks={"x": 3}) values of streamed mean'
+        fname = 'var5_19790101-19790104.nc'
+        df = dataflow.DataFlow(self.inpds, self.outds)
+        df.execute()
+        with NCDataset(fname) as ncf:
+            expected = ncf.variables['V5'][:]
+        df.execute(chunks={'x': 3})
+        with NCDataset(fname) as ncf:
+            actual = ncf.variables['V5'][:]
+        print_test_message(testname, actual=actual, expected=expected)
+        numpy.testing.assert_array_equal(numpy.ma.getmaskarray(actual), numpy.ma.getmaskarray(expected),
+                                         '{} failed'.format(testname))
+        self.assertTrue(numpy.ma.allclose(actual, expected, rtol=1e-6), '{} failed'.format(testname))
 
     def test_execute_chunks_1D_y(self):
         testname = 'DataFlow().execute()'
@@ -401,10 +737,11 @@ class DataFlowTests(unittest.TestCase):
     def test_execute_chunks_2D_x_y(self):
         testname = 'DataFlow().execute()'
         df = dataflow.DataFlow(self.inpds, self.outds)
-        expected = ValueError
-        print_test_message(testname, expected=expected)
-        self.assertRaises(expected, df.execute,
-                          chunks=OrderedDict([('x', 4), ('y', 3)]))
+        df.execute(chunks=OrderedDict([('x', 4), ('y', 3)]))
+        actual = all(exists(f) for f in self.outfiles.itervalues())
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
 
     def test_execute_chunks_2D_t_y(self):
         testname = 'DataFlow().execute()'
@@ -8,10 +8,11 @@ LICENSE: See the LICENSE.rst file for details
 from os import remove
 from os.path import exists
 from pyconform.datasets import DimensionDesc, VariableDesc, FileDesc
-from pyconform.datasets import DatasetDesc, InputDatasetDesc, OutputDatasetDesc
+from pyconform.datasets import DatasetDesc, InputDatasetDesc, OutputDatasetDesc, prune_filenames
 from collections import OrderedDict
 from netCDF4 import Dataset as NCDataset
 from cf_units import Unit
+from asaptools.simplecomm import create_comm
 from testutils import print_test_message
 
 import numpy as np
@@ -785,6 +786,21 @@ class DatasetDescTests(unittest.TestCase):
         print_test_message('InputDatasetDesc.dimensions', actual=actual, expected=expected)
         self.assertEqual(actual, expected, 'InputDatasetDesc has wrong dimensions')
 
+    def test_input_dataset_nprocs(self):
+        inds = InputDatasetDesc('myinds', self.filenames.values(), nprocs=2)
+        actual = {v.name: (v.files.keys(), v.dimensions.keys()) for v in inds.variables.itervalues()}
+        inds1 = InputDatasetDesc('myinds', self.filenames.values())
+        expected = {v.name: (v.files.keys(), v.dimensions.keys()) for v in inds1.variables.itervalues()}
+        print_test_message('InputDatasetDesc(nprocs=2).variables', actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'InputDatasetDesc has wrong variables')
+
+    def test_input_dataset_scomm(self):
+        inds = InputDatasetDesc('myinds', self.filenames.values(), scomm=create_comm(serial=True))
+        actual = inds.files.keys()
+        expected = self.filenames.values()
+        print_test_message('InputDatasetDesc(scomm).files', actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'InputDatasetDesc has wrong files')
+
     def test_output_dataset_type(self):
         outds = OutputDatasetDesc('myoutds', self.dsdict)
         actual = type(outds)
@@ -854,6 +870,180 @@ class DatasetDescTests(unittest.TestCase):
                 print '{}: Good'.format(msghdr)
 
         
+#===============================================================================
+# AggregatedInputDatasetDescTests
+#===============================================================================
+class AggregatedInputDatasetDescTests(unittest.TestCase):
+    """
+    Unit Tests for InputDatasetDesc objects aggregated along the unlimited dimension
+    """
+
+    def setUp(self):
+        self.filenames = ['agg2.nc', 'agg1.nc', 'agg3.nc']
+        self.tsizes = {'agg1.nc': 3, 'agg2.nc': 2, 'agg3.nc': 4}
+        self.tunits = {'agg1.nc': 'days since 2000-01-01', 'agg2.nc': 'days since 1999-12-30',
+                       'agg3.nc': 'days since 2000-01-01'}
+        self.tfirst = {'agg1.nc': 0, 'agg2.nc': 0, 'agg3.nc': 3}
+        for fname in self.filenames:
+            with NCDataset(fname, 'w') as ncf:
+                ncf.createDimension('time')
+                ncf.createDimension('lat', 3)
+                ncv = ncf.createVariable('time', 'd', ('time',))
+                ncv.setncatts({'units': self.tunits[fname], 'calendar': 'noleap'})
+                ncv[:] = np.arange(self.tfirst[fname], self.tfirst[fname] + self.tsizes[fname])
+                ncv = ncf.createVariable('lat', 'd', ('lat',))
+                ncv.setncatts({'units': 'degrees_north'})
+                ncv[:] = np.linspace(-90, 90, num=3)
+                ncv = ncf.createVariable('u', 'd', ('time', 'lat'))
+                ncv.setncatts({'units': 'm'})
+                ncv[:] = 1.0
+
+    def tearDown(self):
+        for fname in self.filenames:
+            if exists(fname):
+                remove(fname)
+
+    def test_dimensions(self):
+        inds = InputDatasetDesc('myinds', self.filenames, aggregate=True)
+        actual = {d.name: (d.size, d.unlimited) for d in inds.dimensions.itervalues()}
+        expected = {'time': (9, True), 'lat': (3, False)}
+        print_test_message('InputDatasetDesc(aggregate=True).dimensions', actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'InputDatasetDesc has wrong dimensions')
+
+    def test_aggregation(self):
+        inds = InputDatasetDesc('myinds', self.filenames, aggregate=True)
+        actual = {v.name: v.aggregation for v in inds.variables.itervalues()}
+        segments = (('agg2.nc', 0, 2), ('agg1.nc', 2, 5), ('agg3.nc', 5, 9))
+        expected = {'time': ('time', segments), 'lat': None, 'u': ('time', segments)}
+        print_test_message('InputDatasetDesc(aggregate=True).variables.aggregation',
+                           actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'InputDatasetDesc has wrong variable aggregation')
+
+    def test_aggregation_series(self):
+        filenames = ['agg4.nc', 'agg5.nc']
+        for fname, tfirst in zip(filenames, [0, 5]):
+            with NCDataset(fname, 'w') as ncf:
+                ncf.createDimension('time')
+                ncv = ncf.createVariable('time', 'd', ('time',))
+                ncv.setncatts({'units': 'days since 2000-01-01', 'calendar': 'noleap'})
+                ncv[:] = np.arange(tfirst, tfirst + (5 if tfirst == 0 else 4))
+                ncf.createVariable('w', 'd', ('time',))[:] = 2.0
+        self.filenames.extend(filenames)
+        inds = InputDatasetDesc('myinds', self.filenames, aggregate=True)
+        actual = {v.name: v.aggregation for v in inds.variables.itervalues()}
+        usegments = (('agg2.nc', 0, 2), ('agg1.nc', 2, 5), ('agg3.nc', 5, 9))
+        wsegments = (('agg4.nc', 0, 5), ('agg5.nc', 5, 9))
+        expected = {'time': ('time', usegments), 'lat': None, 'u': ('time', usegments),
+                    'w': ('time', wsegments)}
+        print_test_message('InputDatasetDesc(aggregate=True) with multiple series',
+                           actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'InputDatasetDesc has wrong variable aggregation')
+
+    def test_aggregation_series_extra_variable(self):
+        with NCDataset('agg3.nc', 'a') as ncf:
+            ncf.createVariable('area', 'd', ('lat',))[:] = 1.0
+        inds = InputDatasetDesc('myinds', self.filenames, aggregate=True)
+        actual = {v.name: v.aggregation for v in inds.variables.itervalues()}
+        segments = (('agg2.nc', 0, 2), ('agg1.nc', 2, 5), ('agg3.nc', 5, 9))
+        expected = {'time': ('time', segments), 'lat': None, 'u': ('time', segments), 'area': None}
+        print_test_message('InputDatasetDesc(aggregate=True) with an extra fixed variable',
+                           actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'InputDatasetDesc has wrong variable aggregation')
+
+    def test_aggregation_series_mismatch(self):
+        with NCDataset('agg4.nc', 'w') as ncf:
+            ncf.createDimension('time')
+            ncf.createVariable('w', 'd', ('time',))[0:3] = 2.0
+        self.filenames.append('agg4.nc')
+        expected = ValueError
+        print_test_message('InputDatasetDesc(aggregate=True) with mismatched series', expected=expected)
+        self.assertRaises(expected, InputDatasetDesc, 'myinds', self.filenames, aggregate=True)
+
+    def test_no_aggregation(self):
+        expected = ValueError
+        print_test_message('InputDatasetDesc(aggregate=False)', expected=expected)
+        self.assertRaises(expected, InputDatasetDesc, 'myinds', self.filenames)
+
+
+#===============================================================================
+# PruneFilenamesTests
+#===============================================================================
+class PruneFilenamesTests(unittest.TestCase):
+    """
+    Unit Tests for the prune_filenames function
+    """
+
+    def setUp(self):
+        self.filenames = ['case.h0.PS.0001-0002.nc', 'case.h0.TS.0001-0002.nc',
+                          'case.h0.PS.0003-0004.nc', 'case.h0.TS.0003-0004.nc', 'case.h0.fixed.nc']
+        for fname in self.filenames:
+            vname = fname.split('.')[2]
+            with NCDataset(fname, 'w') as ncf:
+                ncf.createDimension('time')
+                ncf.createDimension('lat', 3)
+                ncf.createVariable('lat', 'd', ('lat',))
+                if vname == 'fixed':
+                    ncf.createVariable('area', 'd', ('lat',))
+                else:
+                    ncf.createVariable('time', 'd', ('time',))
+                    ncf.createVariable(vname, 'd', ('time', 'lat'))
+
+    def tearDown(self):
+        for fname in self.filenames:
+            if exists(fname):
+                remove(fname)
+
+    def test_prune(self):
+        indata = set(['TS'])
+        actual = prune_filenames(self.filenames, indata)
+        expected = ['case.h0.TS.0001-0002.nc', 'case.h0.TS.0003-0004.nc']
+        print_test_message('prune_filenames()', indata=indata, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'prune_filenames failed')
+
+    def test_prune_coordinates(self):
+        indata = set(['TS', 'time'])
+        actual = prune_filenames(self.filenames, indata)
+        expected = [f for f in self.filenames if f != 'case.h0.fixed.nc']
+        print_test_message('prune_filenames()', indata=indata, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'prune_filenames failed')
+
+    def test_prune_fixed(self):
+        indata = set(['TS', 'area', 'notfound'])
+        actual = prune_filenames(self.filenames, indata, nprocs=2)
+        expected = ['case.h0.TS.0001-0002.nc', 'case.h0.TS.0003-0004.nc', 'case.h0.fixed.nc']
+        print_test_message('prune_filenames(nprocs=2)', indata=indata, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'prune_filenames failed')
+
+    def test_prune_segments(self):
+        filenames = ['case.h0.0001.nc', 'case.h0.0002.nc', 'case.h0.0003.nc']
+        for i, fname in enumerate(filenames):
+            with NCDataset(fname, 'w') as ncf:
+                ncf.createDimension('time')
+                ncf.createVariable('time', 'd', ('time',))[:] = [2 * i, 2 * i + 1]
+                ncf.createVariable('T', 'd', ('time',))[:] = 1.0
+                if i == 2:
+                    ncf.createVariable('X', 'd', ('time',))[:] = 2.0
+        self.filenames.extend(filenames)
+        indata = set(['T', 'time'])
+        actual = prune_filenames(filenames, indata)
+        expected = filenames
+        print_test_message('prune_filenames() with time segments', indata=indata, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'prune_filenames failed')
+
+    def test_prune_pattern(self):
+        indata = set(['PS', 'lat'])
+        filenames = self.filenames + ['case.h0.XX.0001-0002.nc']
+        actual = prune_filenames(filenames, indata, pattern=r'\.(?P<var>[^.]+)\.\d+-\d+\.nc$')
+        expected = ['case.h0.PS.0001-0002.nc', 'case.h0.PS.0003-0004.nc', 'case.h0.fixed.nc']
+        print_test_message('prune_filenames(pattern)', indata=indata, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'prune_filenames failed')
+
+    def test_prune_pattern_invalid(self):
+        expected = ValueError
+        print_test_message('prune_filenames(pattern) without var group', expected=expected)
+        self.assertRaises(expected, prune_filenames, self.filenames, set(['PS']), pattern=r'\.nc$')
+
+
 #===============================================================================
 # Command-Line Execution
 #===============================================================================
@@ -0,0 +1,118 @@
+"""
+DatasetPool Unit Tests
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from pyconform import filepool
+from testutils import print_test_message
+from os.path import exists
+from os import remove
+from netCDF4 import Dataset
+
+import unittest
+
+
+#=========================================================================
+# DatasetPoolTests
+#=========================================================================
+class DatasetPoolTests(unittest.TestCase):
+    """
+    Unit tests for the filepool.DatasetPool class
+    """
+
+    def setUp(self):
+        self.filenames = ['pool1.nc', 'pool2.nc', 'pool3.nc']
+        for i, fname in enumerate(self.filenames):
+            with Dataset(fname, 'w') as ncf:
+                ncf.createDimension('x', 4)
+                ncf.createVariable('v{}'.format(i), 'd', ('x',))[:] = i
+
+    def tearDown(self):
+        for fname in self.filenames:
+            if exists(fname):
+                remove(fname)
+
+    def test_init(self):
+        testname = 'DatasetPool(maxopen=2)'
+        pool = filepool.DatasetPool(maxopen=2)
+        actual = pool.maxopen
+        expected = 2
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_init_invalid(self):
+        testname = 'DatasetPool(maxopen=0)'
+        expected = ValueError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, filepool.DatasetPool, maxopen=0)
+
+    def test_dataset_hits_misses(self):
+        testname = 'DatasetPool.dataset() hits and misses'
+        pool = filepool.DatasetPool()
+        for fname in self.filenames + self.filenames:
+            with pool.dataset(fname) as ncf:
+                self.assertTrue(ncf.isopen(), '{} failed'.format(testname))
+        actual = (pool.hits, pool.misses)
+        expected = (3, 3)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        pool.close()
+
+    def test_dataset_lru(self):
+        testname = 'DatasetPool(maxopen=2).dataset() evicts least-recently used'
+        pool = filepool.DatasetPool(maxopen=2)
+        with pool.dataset(self.filenames[0]) as ncf0:
+            pass
+        with pool.dataset(self.filenames[1]):
+            pass
+        with pool.dataset(self.filenames[0]):
+            pass
+        with pool.dataset(self.filenames[2]):
+            pass
+        actual = [fname in pool for fname in self.filenames]
+        expected = [True, False, True]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        self.assertTrue(ncf0.isopen(), '{} failed'.format(testname))
+        pool.close()
+
+    def test_maxopen_trim(self):
+        testname = 'DatasetPool.maxopen = 1'
+        pool = filepool.DatasetPool()
+        for fname in self.filenames:
+            with pool.dataset(fname):
+                pass
+        pool.maxopen = 1
+        actual = len(pool)
+        expected = 1
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        pool.close()
+
+    def test_close(self):
+        testname = 'DatasetPool.close()'
+        pool = filepool.DatasetPool()
+        with pool.dataset(self.filenames[0]) as ncf:
+            pass
+        pool.close()
+        actual = (len(pool), ncf.isopen())
+        expected = (0, False)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_dataset_pool(self):
+        testname = 'dataset_pool()'
+        actual = filepool.dataset_pool()
+        expected = filepool.dataset_pool()
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertIs(actual, expected, '{} failed'.format(testname))
+
+
+#===============================================================================
+# Command-Line Operation
+#===============================================================================
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -5,10 +5,13 @@ Copyright 2017-2018, University Corporation for Atmospheric Research
 LICENSE: See the LICENSE.rst file for details
 """
 
-from pyconform.flownodes import FlowNode, DataNode, ReadNode, EvalNode, MapNode, ValidateNode, WriteNode
-from pyconform.physarray import PhysArray, DimensionsError, UnitsError
-from pyconform.datasets import DimensionDesc, VariableDesc, FileDesc
+from pyconform.flownodes import FlowNode, DataNode, ReadNode, EvalNode, MapNode, ValidateNode, WriteNode, ChunkCache
+from pyconform.flownodes import ReadAheadBuffer
+from pyconform.physarray import PhysArray, PhysInfo, DimensionsError, UnitsError
+from pyconform.datasets import DimensionDesc, VariableDesc, FileDesc, InputDatasetDesc
 from pyconform.functions import Function, find_operator
+from pyconform.filepool import dataset_pool
+from pyconform.modules.commonfunctions import delpFunction
 from testutils import print_test_message, print_ncfile
 from cf_units import Unit
 from os.path import exists
@@ -126,6 +129,14 @@ class DataNodeTests(BaseTests):
         print_test_message(testname, actual=actual, expected=expected)
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_precision(self):
+        indata = PhysArray(numpy.arange(10, dtype='f'), units='m', dimensions=('x',))
+        testname = "DataNode(precision='double'/'single').__getitem__(:)"
+        actual = (DataNode(indata, precision='double')[:].dtype, DataNode(indata)[:].dtype)
+        expected = (numpy.dtype('d'), numpy.dtype('f'))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
 
 #=======================================================================================================================
 # ReadNodeTests
@@ -165,6 +176,7 @@ class ReadNodeTests(BaseTests):
                 ncv[:] = self.vardata[v]
 
     def tearDown(self):
+        dataset_pool().close()
         if exists(self.filename):
             remove(self.filename)
 
@@ -177,6 +189,21 @@ class ReadNodeTests(BaseTests):
         print actual.dtype, expected.dtype
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_getitem_readahead(self):
+        testname = 'ReadNode.__getitem__(:2) after ReadAheadBuffer.read'
+        N = ReadNode(self.vardesc)
+        B = ReadAheadBuffer()
+        B.read(N, slice(None, 2))
+        dataset_pool().close()
+        remove(self.filename)
+        actual = N[:2]
+        expected = self.vardata[self.varname][:2]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
+        self.assertIsNone(B.pop(N, slice(None, 2)), '{} failed'.format(testname))
+        B.clear()
+        self.assertIsNone(N._readahead, '{} failed'.format(testname))
+
     def test_getitem_slice(self):
         testname = 'ReadNode.__getitem__(:2)'
         N = ReadNode(self.vardesc)
@@ -185,6 +212,23 @@ class ReadNodeTests(BaseTests):
         print_test_message(testname, actual=actual, expected=expected)
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_precision(self):
+        testname = "ReadNode(precision='double'/'single')"
+        vdesc = self.filedesc.variables['x']
+        N1 = ReadNode(vdesc, precision='double')
+        N2 = ReadNode(vdesc)
+        actual = (N1.info.dtype, N1[:].dtype, N2.info.dtype, N2[:].dtype)
+        expected = (numpy.dtype('d'), numpy.dtype('d'), numpy.dtype('f'), numpy.dtype('f'))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        self.assertPhysArraysEqual(N2[:], self.vardata['x'], '{} failed'.format(testname))
+
+    def test_precision_invalid(self):
+        testname = "ReadNode(precision='half')"
+        expected = ValueError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, ReadNode, self.vardesc, precision='half')
+
     def test_getitem_none(self):
         testname = 'ReadNode.__getitem__(None)'
         N = ReadNode(self.vardesc)
@@ -196,6 +240,31 @@ class ReadNodeTests(BaseTests):
         print_test_message(testname, actual=actual, expected=expected)
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_nbytes(self):
+        testname = 'ReadNode(v[3, ::2]).nbytes'
+        N = ReadNode(self.filedesc.variables['v'], index=(3, slice(None, None, 2)))
+        actual = (N.shape, N.nbytes)
+        expected = ((5,), 5 * 8)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_source(self):
+        testname = 'ReadNode(v).source'
+        N = ReadNode(self.filedesc.variables['v'])
+        actual = N.source
+        expected = (self.filedesc.name, 'v')
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_info(self):
+        testname = 'ReadNode(v[3]).info'
+        N = ReadNode(self.filedesc.variables['v'], index=(3, slice(None)))
+        actual = N.info
+        expected = PhysInfo('v[3, :]', units='K', dimensions=('y',), dtype='d')
+        print_test_message(testname, actual=actual, expected=expected)
+        for attr in ['name', 'units', 'dimensions', 'dtype', 'positive']:
+            self.assertEqual(getattr(actual, attr), getattr(expected, attr), '{} failed'.format(testname))
+
     def test_getitem_tuple(self):
         intuple = (3, slice(2, 4))
         testname = 'ReadNode.__getitem__({})'.format(intuple)
@@ -224,6 +293,78 @@ class ReadNodeTests(BaseTests):
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
 
+#=======================================================================================================================
+# AggregatedReadNodeTests
+#=======================================================================================================================
+class AggregatedReadNodeTests(BaseTests):
+    """
+    Unit tests for the flownodes.ReadNode class reading variables aggregated across files
+    """
+
+    def setUp(self):
+        self.filenames = ['agg_b.nc', 'agg_a.nc', 'agg_c.nc']
+        self.tsizes = [2, 3, 4]
+        self.tdata = numpy.arange(sum(self.tsizes), dtype='d')
+        self.vdata = numpy.arange(sum(self.tsizes) * 3, dtype='d').reshape(sum(self.tsizes), 3)
+        offset = 0
+        for fname, tsize in zip(self.filenames, self.tsizes):
+            with netCDF4.Dataset(fname, 'w') as ncfile:
+                ncfile.createDimension('t')
+                ncfile.createDimension('x', 3)
+                ncv = ncfile.createVariable('t', 'd', ('t',))
+                ncv.setncatts({'units': 'days since 2000-01-01', 'calendar': 'noleap'})
+                ncv[:] = self.tdata[offset:offset + tsize]
+                ncv = ncfile.createVariable('v', 'd', ('t', 'x'))
+                ncv.setncatts({'units': 'K'})
+                ncv[:] = self.vdata[offset:offset + tsize]
+            offset += tsize
+        self.inpds = InputDatasetDesc(filenames=self.filenames, aggregate=True)
+
+    def tearDown(self):
+        dataset_pool().close()
+        for fname in self.filenames:
+            if exists(fname):
+                remove(fname)
+
+    def test_getitem_all(self):
+        testname = 'ReadNode(aggregated).__getitem__(:)'
+        N = ReadNode(self.inpds.variables['v'])
+        actual = N[:]
+        expected = PhysArray(self.vdata, units='K', dimensions=('t', 'x'), name='v')
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_getitem_slices(self):
+        N = ReadNode(self.inpds.variables['v'])
+        for index in [slice(1, 6), slice(2, 5), slice(None, None, 2), slice(None, None, -3),
+                      slice(7, 0, -2), slice(4, 4)]:
+            testname = 'ReadNode(aggregated).__getitem__({})'.format(index)
+            actual = N[index]
+            expected = PhysArray(self.vdata[index], units='K', dimensions=('t', 'x'), name='v')
+            print_test_message(testname, actual=actual, expected=expected)
+            self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_getitem_int(self):
+        N = ReadNode(self.inpds.variables['v'])
+        for index in [(4, slice(None)), (-1, 2), (slice(1, 7), 1)]:
+            testname = 'ReadNode(aggregated).__getitem__({})'.format(index)
+            actual = N[index]
+            dims = tuple(d for d, i in zip(('t', 'x'), index) if isinstance(i, slice))
+            expected = PhysArray(self.vdata[index], units='K', dimensions=dims, name='v')
+            print_test_message(testname, actual=actual, expected=expected)
+            self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_getitem_opens_overlapping_files(self):
+        testname = 'ReadNode(aggregated).__getitem__(3:5) opens only overlapping files'
+        N = ReadNode(self.inpds.variables['v'])
+        dataset_pool().close()
+        N[3:5]
+        actual = [fname in dataset_pool() for fname in self.filenames]
+        expected = [False, True, False]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+
 #=======================================================================================================================
 # EvalNodeTests
 #=======================================================================================================================
@@ -305,6 +446,28 @@ class EvalNodeTests(BaseTests):
         print_test_message(testname, actual=actual, expected=expected)
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_getitem_none_memoized(self):
+        class counter(object):
+            calls = 0
+
+            def __init__(self, data):
+                self.data = data
+
+            def __getitem__(self, index):
+                counter.calls += 1
+                return self.data[index]
+        indata = PhysArray(range(10), units='m', dimensions=('x',))
+        testname = 'EvalNode.__getitem__(None) called 3 times'
+        N = EvalNode(0, counter, indata)
+        N[None]
+        N[None].units = 'km'
+        actual = N[None]
+        expected = PhysArray(numpy.zeros((0,), dtype=indata.dtype),
+                             units='m', dimensions=('x',), name='[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]')
+        print_test_message(testname, actual=actual, expected=expected, calls=counter.calls)
+        self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
+        self.assertEqual(counter.calls, 1, '{} failed'.format(testname))
+
     def test_sumlike_dimensions(self):
         class myfunc(Function):
             key = 'myfunc'
@@ -329,6 +492,79 @@ class EvalNodeTests(BaseTests):
         self.assertEqual(actual, expected, '{} failed'.format(testname))
 
 
+    def test_halo_widths(self):
+        class myfunc(Function):
+            key = 'myfunc'
+
+            def __init__(self, d):
+                super(myfunc, self).__init__(d)
+                self.add_halo_dimension('x', 1, 2)
+                self.add_halo_dimension('x', 0, 1)
+
+            def __getitem__(self, index):
+                return self.arguments[0][index]
+        d = PhysArray(numpy.arange(1, 5), name='d', units='m', dimensions=('x',))
+        N = EvalNode(1, myfunc, d)
+        testname = 'EvalNode.halo_widths'
+        actual = N.halo_widths
+        expected = {'x': (1, 2)}
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_getitem_halo(self):
+        class centerdiff(Function):
+            key = 'centerdiff'
+
+            def __init__(self, d):
+                super(centerdiff, self).__init__(d)
+                self.add_halo_dimension('x', 1)
+
+            def __getitem__(self, index):
+                d = self.arguments[0][index]
+                dd = numpy.ma.masked_all(d.shape, dtype='d')
+                dd[1:-1] = 0.5 * (d.data[2:] - d.data[:-2])
+                return PhysArray(dd, name='centerdiff({})'.format(d.name), units=d.units,
+                                 dimensions=d.dimensions)
+        x = numpy.arange(10, dtype='d')
+        d = PhysArray(x ** 2, name='d', units='m', dimensions=('x',))
+        N = EvalNode(1, centerdiff, DataNode(d))
+        expected = N[{'x': slice(None)}]
+        for index in [slice(0, 4), slice(4, 7), slice(7, None), 3, slice(8, 20)]:
+            testname = "EvalNode.__getitem__({{'x': {}}}) with halo".format(index)
+            actual = N[{'x': index}]
+            print_test_message(testname, actual=actual, expected=expected[index])
+            self.assertPhysArraysEqual(actual, expected[index], '{} failed'.format(testname))
+
+        expected = N[{'x': slice(None, None, -1)}]
+        for index, rindex in [(slice(9, 5, -1), slice(0, 4)), (slice(5, 2, -1), slice(4, 7)),
+                              (slice(2, None, -1), slice(7, None)), (slice(None, 6, -1), slice(0, 3))]:
+            testname = "EvalNode.__getitem__({{'x': {}}}) with halo".format(index)
+            actual = N[{'x': index}]
+            print_test_message(testname, actual=actual, expected=expected[rindex])
+            self.assertPhysArraysEqual(actual, expected[rindex], '{} failed'.format(testname))
+
+        index = slice(1, 8, 2)
+        testname = "EvalNode.__getitem__({{'x': {}}}) with halo".format(index)
+        expected = IndexError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, N.__getitem__, {'x': index})
+
+    def test_getitem_halo_delp(self):
+        PO = PhysArray(100000.0, name='PO', units='Pa')
+        PS = PhysArray(numpy.arange(1, 13, dtype='d').reshape(2, 2, 3) * 1000 + 90000,
+                       name='PS', units='Pa', dimensions=('time', 'lat', 'lon'))
+        hyai = PhysArray(numpy.linspace(0.0, 0.1, 6), name='hyai', units='1', dimensions=('ilev',))
+        hybi = PhysArray(numpy.linspace(0.0, 0.9, 6), name='hybi', units='1', dimensions=('ilev',))
+        N = EvalNode(1, delpFunction, DataNode(PO), DataNode(PS), DataNode(hyai), DataNode(hybi))
+        for whole, chunks in [(slice(None), [slice(0, 2), slice(2, 4), slice(4, None)]),
+                              (slice(None, None, -1), [slice(5, 3, -1), slice(3, 1, -1), slice(1, None, -1)])]:
+            testname = "EvalNode(delp).__getitem__({{'ilev': ...}}) in chunks {}".format(chunks)
+            actual = numpy.concatenate([N[{'ilev': index}].data for index in chunks])
+            expected = N[{'ilev': whole}].data
+            print_test_message(testname, actual=actual, expected=expected)
+            numpy.testing.assert_array_equal(actual, expected, '{} failed'.format(testname))
+
+
 #=======================================================================================================================
 # MapNodeTests
 #=======================================================================================================================
@@ -560,6 +796,20 @@ class ValidateNodeTests(BaseTests):
         print_test_message(testname, indata=indata, expected=UnitsError)
         self.assertRaises(UnitsError, N1.__getitem__, slice(None))
 
+    def test_info(self):
+        N0 = DataNode(PhysArray([[1., 2.], [3., 4.]], name='a', units='m', dimensions=('x', 'y'),
+                                positive='down'))
+        indata = VariableDesc('validate(a)', datatype='float', dimensions=(DimensionDesc('y'), DimensionDesc('x')),
+                              attributes={'units': 'cm', 'positive': 'up'})
+        testname = 'ValidateNode({!r}).info'.format(indata)
+        N1 = ValidateNode(indata, N0)
+        actual = N1.info
+        self.assertIsNone(N0._nulldata, '{} failed - input data accessed'.format(testname))
+        expected = N1[None]
+        print_test_message(testname, indata=indata, actual=actual, expected=expected)
+        for attr in ['name', 'units', 'dimensions', 'dtype', 'positive']:
+            self.assertEqual(getattr(actual, attr), getattr(expected, attr), '{} failed'.format(testname))
+
     def test_dimensions_error(self):
         N0 = DataNode(PhysArray(numpy.arange(10), name='x', units='m', dimensions=('x',)))
         indata = VariableDesc('validate(x)', dimensions=(DimensionDesc('y'),))
@@ -610,6 +860,87 @@ class ValidateNodeTests(BaseTests):
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
 
+#=======================================================================================================================
+# ChunkCacheTests
+#=======================================================================================================================
+class ChunkCacheTests(BaseTests):
+    """
+    Unit tests for the flownodes.ChunkCache class
+    """
+
+    class counter(object):
+        calls = 0
+
+        def __init__(self, data):
+            self.data = data
+
+        def __getitem__(self, index):
+            ChunkCacheTests.counter.calls += 1
+            return self.data[index]
+
+    def setUp(self):
+        ChunkCacheTests.counter.calls = 0
+        self.data = PhysArray(numpy.arange(10, dtype='d'), name='X', units='m', dimensions=('x',))
+        self.shared = EvalNode('S', ChunkCacheTests.counter, DataNode(self.data))
+        self.add = EvalNode('A', find_operator('+', numargs=2), self.shared, self.shared)
+        self.neg = EvalNode('N', find_operator('-', numargs=1), self.shared)
+
+    def test_get_once(self):
+        testname = 'ChunkCache.get() from a node shared 3 times'
+        cache = ChunkCache(1024)
+        cache.begin([self.add, self.neg])
+        add = self.add[0:5]
+        neg = self.neg[0:5]
+        cache.end()
+        actual = ChunkCacheTests.counter.calls
+        expected = 1
+        print_test_message(testname, actual=actual, expected=expected, hits=cache.hits, misses=cache.misses)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        self.assertEqual((cache.hits, cache.misses), (2, 1), '{} failed'.format(testname))
+        self.assertPhysArraysEqual(add, self.data[0:5] + self.data[0:5], testname)
+        self.assertPhysArraysEqual(neg, -self.data[0:5], testname)
+
+    def test_get_evicted(self):
+        testname = 'ChunkCache.get() evicts after last consumer'
+        cache = ChunkCache(1024)
+        cache.begin([self.add, self.neg])
+        self.add[0:5]
+        actual = cache._nbytes
+        expected = self.data[0:5].nbytes
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        self.neg[0:5]
+        actual = cache._nbytes
+        expected = 0
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        cache.end()
+        self.assertIsNone(self.shared._cache, '{} failed'.format(testname))
+
+    def test_get_over_budget(self):
+        testname = 'ChunkCache.get() with data larger than the budget'
+        cache = ChunkCache(8)
+        cache.begin([self.add, self.neg])
+        self.add[0:5]
+        self.neg[0:5]
+        cache.end()
+        actual = ChunkCacheTests.counter.calls
+        expected = 3
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_get_consumer_modifies(self):
+        testname = 'ChunkCache.get() returns independent data to each consumer'
+        cache = ChunkCache(1024)
+        cache.begin([self.add, self.neg])
+        first = self.shared[0:5]
+        first[:] = -1
+        second = self.shared[0:5]
+        cache.end()
+        print_test_message(testname, actual=second, expected=self.data[0:5])
+        self.assertPhysArraysEqual(second, self.data[0:5], testname)
+
+
 #=======================================================================================================================
 # WriteNodeTests
 #=======================================================================================================================
@@ -858,6 +1189,219 @@ class WriteNodeTests(BaseTests):
         self.assertEqual(actual, expected, '{} failed'.format(testname))
         print_ncfile(filename)
 
+    def test_execute_chunk_cache(self):
+        filename = 'v_x_y_chunk_cache.nc'
+        chunks = {'t': 2}
+        testname = 'WriteNode({}).execute(chunks={}, cache=ChunkCache())'.format(filename, chunks)
+        vnode = DataNode(self.data['V'])
+        vdesc = self.vardescs['V']
+        vdesc2 = VariableDesc('V2', datatype=vdesc.datatype, attributes=self.atts['V'],
+                              dimensions=vdesc.dimensions.values())
+        nodes = [self.nodes['X'], self.nodes['Y'], self.nodes['T'],
+                 ValidateNode(vdesc, vnode), ValidateNode(vdesc2, vnode)]
+        filedesc = FileDesc(filename, variables=self.vardescs.values() + [vdesc2])
+        N = WriteNode(filedesc, inputs=nodes)
+        cache = ChunkCache(1024)
+        N.execute(chunks=chunks, cache=cache)
+        actual = (cache.hits, cache.misses)
+        expected = (2, 2)
+        print_test_message(testname, actual=actual, expected=expected, chunks=chunks)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        with netCDF4.Dataset(filename) as ncf:
+            numpy.testing.assert_array_equal(ncf.variables['V'][:], ncf.variables['V2'][:])
+
+
+    def test_execute_threads(self):
+        filename = 'v_x_y_threads.nc'
+        chunks = {'t': 1, 'y': 2}
+        testname = 'WriteNode({}).execute(chunks={}, threads=3)'.format(filename, chunks)
+        filedesc = FileDesc(filename, variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=self.nodes.values())
+        N.execute(chunks=chunks, threads=3)
+        filedesc = FileDesc('v_x_y_nothreads.nc', variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=self.nodes.values())
+        N.execute(chunks=chunks)
+        with netCDF4.Dataset(filename) as ncf1, netCDF4.Dataset('v_x_y_nothreads.nc') as ncf2:
+            actual = {n: ncf1.variables[n][:] for n in ncf1.variables}
+            expected = {n: ncf2.variables[n][:] for n in ncf2.variables}
+        print_test_message(testname, actual=actual, expected=expected, chunks=chunks)
+        self.assertEqual(sorted(actual), sorted(expected), '{} failed'.format(testname))
+        for n in expected:
+            numpy.testing.assert_array_equal(actual[n], expected[n], '{} failed'.format(testname))
+
+    def test_execute_threads_cache(self):
+        filename = 'v_x_y_threads_cache.nc'
+        chunks = {'t': 2}
+        testname = 'WriteNode({}).execute(chunks={}, cache=ChunkCache(), threads=2)'.format(
+            filename, chunks)
+        vnode = DataNode(self.data['V'])
+        vdesc = self.vardescs['V']
+        vdesc2 = VariableDesc('V2', datatype=vdesc.datatype, attributes=self.atts['V'],
+                              dimensions=vdesc.dimensions.values())
+        nodes = [self.nodes['X'], self.nodes['Y'], self.nodes['T'],
+                 ValidateNode(vdesc, vnode), ValidateNode(vdesc2, vnode)]
+        filedesc = FileDesc(filename, variables=self.vardescs.values() + [vdesc2])
+        N = WriteNode(filedesc, inputs=nodes)
+        cache = ChunkCache(1024)
+        N.execute(chunks=chunks, cache=cache, threads=2)
+        actual = cache.hits + cache.misses
+        expected = 4
+        print_test_message(testname, actual=actual, expected=expected, chunks=chunks)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        with netCDF4.Dataset(filename) as ncf:
+            numpy.testing.assert_array_equal(ncf.variables['V'][:], ncf.variables['V2'][:])
+
+    def test_execute_pipeline(self):
+        filename = 'v_x_y_pipeline.nc'
+        chunks = {'t': 1, 'y': 2}
+        testname = 'WriteNode({}).execute(chunks={}, pipeline=2)'.format(filename, chunks)
+        filedesc = FileDesc(filename, variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=self.nodes.values())
+        N.execute(chunks=chunks, pipeline=2)
+        filedesc = FileDesc('v_x_y_nopipeline.nc', variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=self.nodes.values())
+        N.execute(chunks=chunks)
+        with netCDF4.Dataset(filename) as ncf1, netCDF4.Dataset('v_x_y_nopipeline.nc') as ncf2:
+            actual = {n: ncf1.variables[n][:] for n in ncf1.variables}
+            expected = {n: ncf2.variables[n][:] for n in ncf2.variables}
+        print_test_message(testname, actual=actual, expected=expected, chunks=chunks)
+        self.assertEqual(sorted(actual), sorted(expected), '{} failed'.format(testname))
+        for n in expected:
+            numpy.testing.assert_array_equal(actual[n], expected[n], '{} failed'.format(testname))
+
+    def test_execute_chunks_inverted_stencil(self):
+        filename = 'v_x_y_stencil.nc'
+        chunks = {'y': 1}
+        testname = 'WriteNode({}).execute(chunks={}) with a stencil over inverted y'.format(filename, chunks)
+
+        class ydiff(Function):
+            key = 'ydiff'
+
+            def __init__(self, d):
+                super(ydiff, self).__init__(d)
+                self.add_halo_dimension('y', 0, 1)
+
+            def __getitem__(self, index):
+                d = self.arguments[0][index]
+                dd = numpy.ma.zeros(d.shape, dtype=d.dtype)
+                dd[:, :-1] = d.data[:, 1:] - d.data[:, :-1]
+                return PhysArray(dd, name='ydiff({})'.format(d.name), units=d.units,
+                                 dimensions=d.dimensions)
+        vdata = PhysArray(self.data['V'].data ** 2, name='V', units='K', dimensions=('x', 'y', 't'))
+        nodes = dict(self.nodes)
+        nodes['V'] = ValidateNode(self.vardescs['V'], EvalNode('ydiff', ydiff, DataNode(vdata)))
+        filedesc = FileDesc(filename, variables=self.vardescs.values())
+        WriteNode(filedesc, inputs=nodes.values()).execute(chunks=chunks)
+        filedesc = FileDesc('v_x_y_stencil_whole.nc', variables=self.vardescs.values())
+        WriteNode(filedesc, inputs=nodes.values()).execute()
+        with netCDF4.Dataset(filename) as ncf1, netCDF4.Dataset('v_x_y_stencil_whole.nc') as ncf2:
+            actual = ncf1.variables['V'][:]
+            expected = ncf2.variables['V'][:]
+        print_test_message(testname, actual=actual, expected=expected, chunks=chunks)
+        numpy.testing.assert_array_equal(actual, expected, '{} failed'.format(testname))
+
+    def _read_nodes_(self, filename):
+        invdescs = [VariableDesc(n, datatype=self.data[n].dtype, attributes=self.atts[n],
+                                 dimensions=self.vardescs[n].dimensions.values()) for n in self.data]
+        FileDesc(filename, variables=invdescs)
+        with netCDF4.Dataset(filename, 'w') as ncfile:
+            for vdesc in invdescs:
+                for d in vdesc.dimensions.itervalues():
+                    if d.name not in ncfile.dimensions:
+                        ncfile.createDimension(d.name, d.size)
+                ncv = ncfile.createVariable(vdesc.name, vdesc.datatype, vdesc.dimensions.keys())
+                ncv.setncatts(self.atts[vdesc.name])
+                ncv[:] = self.data[vdesc.name]
+        return {vdesc.name: ReadNode(vdesc) for vdesc in invdescs}
+
+    def test_read_plan(self):
+        testname = 'WriteNode._read_plan_()'
+        R = self._read_nodes_('v_x_y_input.nc')
+        M = MapNode('M', R['V'], dmap={'x': 'u'})
+        E1 = EvalNode('E1', find_operator('+', numargs=2), M, R['X'])
+        E2 = EvalNode('E2', lambda x: x, R['T'])
+        N = ValidateNode(self.vardescs['V'], EvalNode('E', find_operator('*', numargs=2), E1, E2))
+        index = OrderedDict([('u', slice(0, 1)), ('y', slice(None)), ('t', slice(1, 3))])
+        plan = OrderedDict()
+        WriteNode._read_plan_(N, index, plan)
+        dataset_pool().close()
+        actual = plan.values()
+        expected = [(R['V'], {'x': slice(0, 1), 'y': slice(None), 't': slice(1, 3)}), (R['X'], index)]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_pipeline_prefetch(self):
+        filename = 'v_x_y_prefetch.nc'
+        chunks = {'t': 1, 'y': 2}
+        testname = 'WriteNode({}).execute(chunks={}, pipeline=1) from files'.format(filename, chunks)
+        R = self._read_nodes_('v_x_y_input.nc')
+        nodes = [ValidateNode(self.vardescs[n], R[n]) for n in self.data]
+        filedesc = FileDesc(filename, variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=nodes)
+        N.execute(chunks=chunks, pipeline=1)
+        filedesc = FileDesc('v_x_y_noprefetch.nc', variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=nodes)
+        N.execute(chunks=chunks)
+        dataset_pool().close()
+        with netCDF4.Dataset(filename) as ncf1, netCDF4.Dataset('v_x_y_noprefetch.nc') as ncf2:
+            actual = {n: ncf1.variables[n][:] for n in ncf1.variables}
+            expected = {n: ncf2.variables[n][:] for n in ncf2.variables}
+        print_test_message(testname, actual=actual, expected=expected, chunks=chunks)
+        self.assertEqual(sorted(actual), sorted(expected), '{} failed'.format(testname))
+        for n in expected:
+            numpy.testing.assert_array_equal(actual[n], expected[n], '{} failed'.format(testname))
+        self.assertTrue(all(node._readahead is None for node in R.itervalues()),
+                        '{} failed'.format(testname))
+
+    def test_execute_pipeline_error(self):
+        filename = 'v_x_y_pipeline_error.nc'
+        testname = 'WriteNode({}).execute(pipeline=1) with failing input'.format(filename)
+
+        class FailingNode(DataNode):
+
+            def _getitem_(self, index):
+                raise RuntimeError('Failed to read data')
+
+        nodes = dict(self.nodes)
+        nodes['V'] = ValidateNode(self.vardescs['V'], FailingNode(self.data['V']))
+        filedesc = FileDesc(filename, variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=nodes.values())
+        expected = RuntimeError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, N.execute, chunks={'t': 1}, pipeline=1)
+
+    def test_parallel_writes_scalar(self):
+        filename = 'v_x_y_scalar.nc'
+        testname = 'WriteNode({})._parallel_writes_() with a scalar variable'.format(filename)
+        sdesc = VariableDesc('S', datatype='double', attributes={'units': 'm'})
+        nodes = [self.nodes['X'], ValidateNode(sdesc, DataNode(PhysArray(2.0, name='S', units='m')))]
+        filedesc = FileDesc(filename, variables=[self.vardescs['X'], sdesc])
+        N = WriteNode(filedesc, inputs=nodes)
+        xdata = self.data['X']
+        actual = [N._parallel_writes_({}),
+                  N._parallel_writes_({'S': ((), 2.0)}),
+                  N._parallel_writes_({'X': ((slice(None),), xdata), 'S': ((), 2.0)})]
+        expected = [[('X', None, None)],
+                    [('X', None, None), ('S', (), 2.0)],
+                    [('X', (slice(None),), xdata), ('S', (), 2.0)]]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_parallel_support(self):
+        testname = 'WriteNode.parallel_support()'
+        actual = WriteNode.parallel_support()
+        expected = bool(getattr(netCDF4, '__has_parallel4_support__', False))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_execute_threads_invalid(self):
+        filename = 'v_x_y_threads_invalid.nc'
+        testname = 'WriteNode({}).execute(threads=0)'.format(filename)
+        filedesc = FileDesc(filename, variables=self.vardescs.values())
+        N = WriteNode(filedesc, inputs=self.nodes.values())
+        expected = ValueError
+        print_test_message(testname, expected=expected)
+        self.assertRaises(expected, N.execute, threads=0)
 
 #===============================================================================
 # Command-Line Operation
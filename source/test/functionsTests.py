@@ -6,7 +6,7 @@ LICENSE: See the LICENSE.rst file for details
 """
 
 from pyconform import functions
-from pyconform.physarray import PhysArray
+from pyconform.physarray import PhysArray, getinfo
 from cf_units import Unit
 from testutils import print_test_message
 
@@ -487,6 +487,15 @@ class EvaluationTests(unittest.TestCase):
         print_test_message(testname, indata=indata, actual=actual, expected=expected)
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_func_sqrt_unmasked(self):
+        key = 'sqrt'
+        func = functions.find(key)
+        for indata, expmask in [([9.0, 16.0, 4.0], np.ma.nomask), ([9.0, -16.0, 4.0], [False, True, False])]:
+            testname = '{}({}) mask'.format(key, indata)
+            actual = np.ma.getmask(func(PhysArray(indata, name='x', units='m^2'))[:])
+            print_test_message(testname, actual=actual, expected=expmask)
+            np.testing.assert_array_equal(actual, expmask, '{} failed'.format(testname))
+
     def test_func_mean_ndarray(self):
         key = 'mean'
         indata = PhysArray([1.0, 2.0, 3.0], name='x',
@@ -544,6 +553,34 @@ class EvaluationTests(unittest.TestCase):
         print_test_message(testname, actual=actual, expected=expected)
         self.assertEqual(actual, expected, '{} failed'.format(testname))
 
+    def test_func_reductions_streamed(self):
+        indata = PhysArray(np.ma.masked_array(np.arange(12.0).reshape(4, 3),
+                                              mask=[[0, 0, 1], [0, 0, 1], [1, 0, 1], [0, 0, 1]]),
+                           name='x', units='m', dimensions=('t', 'y'))
+        for key in ('mean', 'sum', 'min', 'max'):
+            testname = '{}({}, "t") with blocksize=3'.format(key, indata)
+            fobj = functions.find(key)(indata, 't')
+            expected = fobj[{}]
+            fobj.blocksize = 3
+            actual = fobj[{'t': slice(0, 1)}]
+            print_test_message(testname, actual=actual, expected=expected)
+            np.testing.assert_array_equal(np.ma.getmaskarray(actual), np.ma.getmaskarray(expected),
+                                          '{} failed'.format(testname))
+            np.testing.assert_array_equal(actual.filled(0), expected.filled(0),
+                                          '{} failed'.format(testname))
+            self.assertEqual(actual.name, expected.name, '{} failed'.format(testname))
+
+    def test_func_mean_streamed_unmasked(self):
+        key = 'mean'
+        indata = PhysArray(np.arange(12.0).reshape(4, 3), name='x', units='m', dimensions=('t', 'y'))
+        testname = '{}({}, "t") with blocksize=3 mask'.format(key, indata)
+        fobj = functions.find(key)(indata, 't')
+        fobj.blocksize = 3
+        actual = np.ma.getmask(fobj[{}])
+        expected = np.ma.nomask
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertIs(actual, expected, '{} failed'.format(testname))
+
     def test_func_mean_sumlike(self):
         key = 'mean'
         indata = PhysArray([1.0, 2.0, 3.0, 4.0, 5.0],
@@ -785,6 +822,97 @@ class EvaluationTests(unittest.TestCase):
         self.assertPhysArraysEqual(actual, expected, '{} failed'.format(testname))
 
 
+#=========================================================================
+# InferTests
+#=========================================================================
+class InferTests(unittest.TestCase):
+    """
+    Unit tests for inferring the metadata of function results (infer), compared with index None
+    """
+
+    def setUp(self):
+        self.x = PhysArray(np.arange(6, dtype='f').reshape(2, 3), name='x', units='m', dimensions=('a', 'b'),
+                           positive='up')
+        self.y = PhysArray(np.arange(6, dtype='d').reshape(3, 2), name='y', units='km', dimensions=('b', 'a'),
+                           positive='down')
+        self.z = PhysArray(np.arange(4, dtype='i').reshape(2, 2), name='z', units='s', dimensions=('a', 'c'))
+        self.w = PhysArray(np.arange(4, dtype='i'), name='w', dimensions=('d',))
+        self.v = PhysArray(np.ones((2, 3, 2, 2), dtype='d'), name='v', units='K', dimensions=('t', 'l', 'a', 'c'))
+        self.t = PhysArray(np.arange(3, dtype='d'), name='t', dimensions=('t',),
+                           units=Unit('days since 2001-01-01', calendar='noleap'))
+
+    def assertInferred(self, key, *args, **kwds):
+        numargs = kwds.pop('numargs', None)
+        func = functions.find(key, numargs=numargs)(*args, **kwds)
+        testname = '{}({}).infer()'.format(key, ', '.join(str(a) for a in args))
+        actual = func.infer()
+        expected = getinfo(func[None])
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual.name, expected.name, '{} failed - name'.format(testname))
+        self.assertEqual(actual.units, expected.units, '{} failed - units'.format(testname))
+        self.assertEqual(actual.dimensions, expected.dimensions, '{} failed - dimensions'.format(testname))
+        self.assertEqual(actual.dtype, expected.dtype, '{} failed - dtype'.format(testname))
+        self.assertEqual(actual.positive, expected.positive, '{} failed - positive'.format(testname))
+
+    def test_op_neg(self):
+        self.assertInferred('-', self.x, numargs=1)
+
+    def test_op_add(self):
+        self.assertInferred('+', self.x, self.y)
+        self.assertInferred('+', self.z, self.z)
+        self.assertInferred('+', 2, self.w)
+
+    def test_op_sub(self):
+        self.assertInferred('-', self.y, self.x, numargs=2)
+        self.assertInferred('-', self.w, 2.5, numargs=2)
+
+    def test_op_mul(self):
+        self.assertInferred('*', self.x, self.z)
+        self.assertInferred('*', 2, self.x)
+
+    def test_op_div(self):
+        self.assertInferred('/', self.y, self.z)
+        self.assertInferred('/', self.z, 2)
+
+    def test_op_pow(self):
+        self.assertInferred('**', self.x, 2)
+        self.assertInferred('**', self.x, 3)
+
+    def test_func_sqrt(self):
+        self.assertInferred('sqrt', self.w)
+        self.assertInferred('sqrt', self.x * self.x)
+
+    def test_func_mean(self):
+        self.assertInferred('mean', self.y, 'a')
+        self.assertInferred('mean', self.z, 'c', 'd')
+
+    def test_func_sum(self):
+        self.assertInferred('sum', self.z, 'c')
+
+    def test_func_min_max(self):
+        self.assertInferred('min', self.v, 'l')
+        self.assertInferred('max', self.v, 'l')
+
+    def test_func_up_down(self):
+        self.assertInferred('up', self.y)
+        self.assertInferred('down', self.x)
+        self.assertInferred('down', self.z)
+
+    def test_func_chunits(self):
+        self.assertInferred('chunits', self.t, units='hours since 2001-01-01')
+        self.assertInferred('chunits', self.t, units=self.t, refdate='2000-01-01')
+
+    def test_func_limit(self):
+        self.assertInferred('limit', self.x, above=3.0)
+        self.assertInferred('limit', self.x, below=1.0, above=3.0)
+
+    def test_func_rmunits(self):
+        self.assertInferred('rmunits', self.y)
+
+    def test_func_chdims(self):
+        self.assertInferred('chdims', self.x, 'A')
+
+
 #=========================================================================
 # Command-Line Operation
 #=========================================================================
@@ -0,0 +1,109 @@
+"""
+HeaderCache Unit Tests
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from pyconform.headercache import HeaderCache
+from pyconform.datasets import InputDatasetDesc, _scan_file_
+from testutils import print_test_message
+from os.path import exists
+from os import remove, utime, stat
+from netCDF4 import Dataset
+
+import unittest
+
+
+#=========================================================================
+# HeaderCacheTests
+#=========================================================================
+class HeaderCacheTests(unittest.TestCase):
+    """
+    Unit tests for the headercache.HeaderCache class
+    """
+
+    def setUp(self):
+        self.cachefile = 'headers.db'
+        self.filenames = ['hdr1.nc', 'hdr2.nc']
+        for fname in self.filenames:
+            with Dataset(fname, 'w') as ncf:
+                ncf.createDimension('t')
+                ncf.createDimension('x', 4)
+                ncv = ncf.createVariable('x', 'd', ('x',))
+                ncv.setncatts({'units': 'm'})
+                ncv[:] = 1.0
+                ncv = ncf.createVariable('v', 'd', ('t', 'x'))
+                ncv.setncatts({'units': 'K'})
+                ncv[0:2] = 2.0
+
+    def tearDown(self):
+        for fname in self.filenames + [self.cachefile]:
+            if exists(fname):
+                remove(fname)
+
+    def test_get_empty(self):
+        testname = 'HeaderCache.get() on empty cache'
+        cache = HeaderCache(self.cachefile)
+        actual = (cache.get(self.filenames[0]), cache.hits, cache.misses)
+        expected = (None, 0, 1)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        cache.close()
+
+    def test_put_get(self):
+        testname = 'HeaderCache.put() then get()'
+        cache = HeaderCache(self.cachefile)
+        header = _scan_file_(self.filenames[0])
+        cache.put(self.filenames[0], header)
+        fdesc, ufirst = cache.get(self.filenames[0])
+        actual = (fdesc == header[0], ufirst, len(cache), cache.hits)
+        expected = (True, header[1], 1, 1)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        cache.close()
+
+    def test_get_modified(self):
+        testname = 'HeaderCache.get() after file modified'
+        cache = HeaderCache(self.cachefile)
+        cache.put(self.filenames[0], _scan_file_(self.filenames[0]))
+        st = stat(self.filenames[0])
+        utime(self.filenames[0], (st.st_atime, st.st_mtime + 10))
+        actual = cache.get(self.filenames[0])
+        expected = None
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        cache.close()
+
+    def test_persistent(self):
+        testname = 'HeaderCache persistent across instances'
+        cache = HeaderCache(self.cachefile)
+        cache.put(self.filenames[0], _scan_file_(self.filenames[0]))
+        cache.close()
+        cache = HeaderCache(self.cachefile)
+        actual = cache.get(self.filenames[0]) is not None
+        expected = True
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        cache.close()
+
+    def test_input_dataset_desc(self):
+        testname = 'InputDatasetDesc(cache=HeaderCache)'
+        cache = HeaderCache(self.cachefile)
+        inds1 = InputDatasetDesc(filenames=self.filenames, cache=cache)
+        inds2 = InputDatasetDesc(filenames=self.filenames, cache=cache)
+        actual = ((cache.hits, cache.misses), inds2.files.keys(),
+                  {v.name: sorted(v.files) for v in inds2.variables.itervalues()})
+        expected = ((2, 2), inds1.files.keys(),
+                    {v.name: sorted(v.files) for v in inds1.variables.itervalues()})
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+        cache.close()
+
+
+#===============================================================================
+# Command-Line Operation
+#===============================================================================
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
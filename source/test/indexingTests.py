@@ -5,7 +5,7 @@ Copyright 2017-2018, University Corporation for Atmospheric Research
 LICENSE: See the LICENSE.rst file for details
 """
 
-from pyconform.indexing import index_str, index_tuple, join, align_index
+from pyconform.indexing import index_str, index_tuple, join, align_index, halo_index, halo_trim
 from testutils import print_test_message
 
 import unittest
@@ -141,6 +141,48 @@ class AlignIndexTests(unittest.TestCase):
         self.assertEqual(actual, expected, '{} failed'.format(testname))
 
 
+#===================================================================================================
+# HaloIndexTests
+#===================================================================================================
+class HaloIndexTests(unittest.TestCase):
+    """
+    Unit tests for the indexing.halo_index and indexing.halo_trim functions
+    """
+
+    def test_halo_index(self):
+        indata = [(slice(3, 6), 1, 2), (slice(1, None), 2, 2), (slice(None, 4), 1, 1), (0, 1, 1),
+                  (5, 2, 0), (slice(2, 8, 2), 1, 1), (slice(-3, None), 1, 1), (-1, 1, 1),
+                  (slice(5, 2, -1), 1, 2), (slice(2, None, -1), 1, 1), (slice(9, 0, -1), 2, 1),
+                  (slice(None, 3, -1), 1, 0), (slice(-1, None, -1), 1, 1)]
+        testname = 'halo_index(index, before, after)'
+        actual = [halo_index(*args) for args in indata]
+        expected = [slice(2, 8), slice(0, None), slice(0, 5), slice(0, 2),
+                    slice(3, 6), slice(2, 8, 2), slice(-3, None), -1,
+                    slice(6, 0, -1), slice(3, None, -1), slice(11, None, -1),
+                    slice(None, 3, -1), slice(-1, None, -1)]
+        print_test_message(testname, indata=indata, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_halo_trim(self):
+        A = numpy.arange(10)
+        indices = [slice(None), slice(0, 3), slice(3, 6), slice(7, 10), slice(7, None),
+                   slice(8, 20), slice(-3, None), 0, 4, 9, slice(None, None, -1),
+                   slice(9, 6, -1), slice(5, 2, -1), slice(2, None, -1), slice(3, 0, -1),
+                   slice(None, 4, -1), slice(12, 5, -1)]
+        nfailures = 0
+        for index in indices:
+            for before, after in [(0, 1), (1, 0), (2, 2), (5, 3)]:
+                hindex = halo_index(index, before, after)
+                hdata = A[hindex]
+                actual = hdata[halo_trim(index, hindex, len(hdata))]
+                expected = A[index]
+                if not numpy.array_equal(actual, expected):
+                    nfailures += 1
+                    print_test_message('halo_trim', index=index, before=before, after=after,
+                                       actual=actual, expected=expected)
+        self.assertEqual(nfailures, 0, 'halo_trim failed {} times'.format(nfailures))
+
+
 #===================================================================================================
 # JoinTests
 #===================================================================================================
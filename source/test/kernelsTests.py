@@ -0,0 +1,193 @@
+"""
+Fused Elementwise Kernel Unit Tests
+
+Copyright 2017-2018, University Corporation for Atmospheric Research
+LICENSE: See the LICENSE.rst file for details
+"""
+
+from pyconform.kernels import ElementwiseKernel, is_elementwise
+from pyconform.flownodes import DataNode, EvalNode
+from pyconform.physarray import PhysArray
+from pyconform.functions import find_operator, find_function
+from pyconform.bufferpool import buffer_pool
+from testutils import print_test_message
+
+import unittest
+import numpy
+import cPickle as pickle
+
+
+#=========================================================================
+# ElementwiseKernelTests
+#=========================================================================
+class ElementwiseKernelTests(unittest.TestCase):
+    """
+    Unit tests for the kernels.ElementwiseKernel class
+    """
+
+    def setUp(self):
+        x = numpy.arange(1, 21, dtype='f').reshape(4, 5)
+        y = numpy.arange(5, dtype='d') - 2
+        self.d1 = PhysArray(x, name='X', units='km', dimensions=('t', 'x'))
+        self.d2 = PhysArray(numpy.ma.masked_array(1000 * x, mask=(x % 7 == 0)), name='Y', units='m',
+                            dimensions=('t', 'x'), positive='up')
+        self.d3 = PhysArray(y, name='Z', units='km', dimensions=('x',), positive='down')
+        self.N1 = DataNode(self.d1)
+        self.N2 = DataNode(self.d2)
+        self.N3 = DataNode(self.d3)
+
+        # ((0.5*(X + Y)) / Z)**2 * X, with units conversion, masking, a positive flip and division by zero
+        self.A = EvalNode('A', find_operator('+', numargs=2), self.N1, self.N2)
+        self.B = EvalNode('B', find_operator('*', numargs=2), 0.5, self.A)
+        self.C = EvalNode('C', find_operator('/', numargs=2), self.B, self.N3)
+        self.D = EvalNode('D', find_operator('**', numargs=2), self.C, 2)
+        self.E = EvalNode('E', find_operator('*', numargs=2), self.D, self.N1)
+        self.interior = set([self.A, self.B, self.C, self.D])
+
+    def assertPhysArraysEqual(self, left, right, testname='Test'):
+        numpy.testing.assert_array_equal(numpy.ma.getmaskarray(left), numpy.ma.getmaskarray(right),
+                                         '{} failed - mask'.format(testname))
+        numpy.testing.assert_array_equal(numpy.ma.asarray(left), numpy.ma.asarray(right),
+                                         '{} failed - data'.format(testname))
+        self.assertEqual(left.dtype, right.dtype, '{} failed - dtype'.format(testname))
+        self.assertEqual(left.name, right.name, '{} failed - name'.format(testname))
+        self.assertEqual(left.units, right.units, '{} failed - units'.format(testname))
+        self.assertEqual(left.dimensions, right.dimensions, '{} failed - dimensions'.format(testname))
+        self.assertEqual(left.positive, right.positive, '{} failed - positive'.format(testname))
+
+    def test_is_elementwise(self):
+        indata = [(find_operator('+', numargs=2)(self.N1, self.N2), True),
+                  (find_operator('-', numargs=1)(self.N1), True),
+                  (find_operator('*', numargs=2)(2, 3), False),
+                  (find_operator('**', numargs=2)(self.N1, 2), True),
+                  (find_operator('**', numargs=2)(self.N1, self.N3), False),
+                  (find_operator('**', numargs=2)(2, self.N1), False),
+                  (find_function('rmunits')(self.N1), False)]
+        for function, expected in indata:
+            testname = 'is_elementwise({})'.format(type(function).__name__)
+            actual = is_elementwise(function)
+            print_test_message(testname, actual=actual, expected=expected)
+            self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_init(self):
+        testname = 'ElementwiseKernel.__init__()'
+        K = ElementwiseKernel(self.E.function, self.interior)
+        actual = (K.size, K.arguments)
+        expected = (5, (0.5, self.N1, self.N2, self.N3))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_getitem_all(self):
+        testname = 'ElementwiseKernel.__getitem__(:)'
+        K = ElementwiseKernel(self.E.function, self.interior)
+        actual = K[:]
+        expected = self.E[:]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+
+    def test_getitem_slice(self):
+        testname = "ElementwiseKernel.__getitem__({'x': slice(1, 4)})"
+        K = ElementwiseKernel(self.E.function, self.interior)
+        actual = K[{'x': slice(1, 4)}]
+        expected = self.E[{'x': slice(1, 4)}]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+
+    def test_getitem_none(self):
+        testname = 'ElementwiseKernel.__getitem__(None)'
+        K = ElementwiseKernel(self.E.function, self.interior)
+        actual = K[None]
+        expected = self.E[None]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+
+    def test_getitem_blocks(self):
+        testname = 'ElementwiseKernel.__getitem__(:) with blocksize=3'
+        K = ElementwiseKernel(self.E.function, self.interior)
+        K.blocksize = 3
+        actual = K[:]
+        expected = self.E[:]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+        buffer_pool().reset_counters()
+        K[:]
+        actual = (buffer_pool().allocated, buffer_pool().saved > 0)
+        expected = (0, True)
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
+    def test_getitem_unsafe_division(self):
+        testname = 'ElementwiseKernel.__getitem__(:) with unsafe divisions'
+        x = numpy.array([4.4e307, 4e307, 1.0, 1e-300, 5e-16, 1.0, 0.0, -3.0, 2.0, 1e-310])
+        y = numpy.array([0.9, 2.0, 1e-310, 1e-310, 5e-324, 0.0, 0.0, 5e-324, 1e-308, 1.0])
+        N1 = DataNode(PhysArray(x, name='X', units='m', dimensions=('x',)))
+        N2 = DataNode(PhysArray(y, name='Y', units='s', dimensions=('x',)))
+        A = EvalNode('A', find_operator('/', numargs=2), N1, N2)
+        B = EvalNode('B', find_operator('-', numargs=1), A)
+        K = ElementwiseKernel(B.function, set([A]))
+        actual = K[:]
+        expected = B[:]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+        numpy.testing.assert_array_equal(numpy.ma.getmaskarray(actual), numpy.ma.getmaskarray(-(x / numpy.ma.asarray(y))),
+                                         '{} failed'.format(testname))
+
+    def test_getitem_unmasked(self):
+        testname = 'ElementwiseKernel.__getitem__(:) with unmasked inputs'
+        N2 = DataNode(PhysArray(self.d2.filled(1.0), name='Y', units='m', dimensions=('t', 'x'), positive='up'))
+        N3 = DataNode(PhysArray(numpy.arange(1, 6, dtype='d'), name='Z', units='km', dimensions=('x',), positive='down'))
+        A = EvalNode('A', find_operator('+', numargs=2), self.N1, N2)
+        C = EvalNode('C', find_operator('/', numargs=2), A, N3)
+        D = EvalNode('D', find_operator('**', numargs=2), C, 2)
+        K = ElementwiseKernel(D.function, set([A, C]))
+        actual = K[:]
+        expected = D[:]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+        self.assertIs(numpy.ma.getmask(actual), numpy.ma.nomask, '{} failed - mask'.format(testname))
+
+    def test_getitem_inputs_unchanged(self):
+        testname = 'ElementwiseKernel.__getitem__(:) inputs unchanged'
+        K = ElementwiseKernel(self.E.function, self.interior)
+        expected = [d.copy() for d in (self.d1, self.d2, self.d3)]
+        K[:]
+        for actual, exp in zip((self.d1, self.d2, self.d3), expected):
+            print_test_message(testname, actual=actual, expected=exp)
+            self.assertPhysArraysEqual(actual, exp, testname)
+
+    def test_getitem_fallback(self):
+        testname = 'ElementwiseKernel.__getitem__(:) with changed input units'
+        K = ElementwiseKernel(self.E.function, self.interior)
+        self.N3._data = PhysArray(self.d3, units='m')
+        actual = K[:]
+        expected = self.E[:]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+
+    def test_pickle(self):
+        testname = 'pickle.loads(pickle.dumps(ElementwiseKernel()))'
+        K = pickle.loads(pickle.dumps(ElementwiseKernel(self.E.function, self.interior), pickle.HIGHEST_PROTOCOL))
+        actual = K[:]
+        expected = self.E[:]
+        print_test_message(testname, actual=actual, expected=expected)
+        numpy.testing.assert_array_equal(numpy.ma.asarray(actual), numpy.ma.asarray(expected),
+                                         '{} failed'.format(testname))
+        self.assertEqual(str(actual.units), str(expected.units), '{} failed'.format(testname))
+
+    def test_evalnode_fuse(self):
+        testname = 'EvalNode.fuse()'
+        expected = self.E[:]
+        self.E.fuse(self.interior)
+        actual = (type(self.E.function), self.E.inputs)
+        print_test_message(testname, actual=actual, expected=(ElementwiseKernel, [self.N1, self.N2, self.N3]))
+        self.assertEqual(actual, (ElementwiseKernel, [self.N1, self.N2, self.N3]), '{} failed'.format(testname))
+        actual = self.E[:]
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+
+
+#===============================================================================
+# Command-Line Operation
+#===============================================================================
+if __name__ == "__main__":
+    unittest.main()
@@ -789,6 +789,21 @@ class DefinitionParserTests(unittest.TestCase):
                          'Integrated #5 operator parsing failed')
 
 
+#=========================================================================
+# VariableSearchTests
+#=========================================================================
+class VariableSearchTests(unittest.TestCase):
+
+    def test_variable_search(self):
+        indata = 'mean(chunits(time_bnds, units=time), "bnds") + 2 * x[0:2] - f(y=-z)'
+        actual = parsing.variable_search(parsing.parse_definition(indata))
+        expected = set(['time_bnds', 'time', 'x', 'z'])
+        testname = 'variable_search({0!r})'.format(indata)
+        print_test_message(testname, indata=indata,
+                           actual=actual, expected=expected)
+        self.assertEqual(actual, expected, 'Variable search failed')
+
+
 #=========================================================================
 # Command-Line Operation
 #=========================================================================
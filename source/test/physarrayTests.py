@@ -5,7 +5,8 @@ Copyright 2017-2018, University Corporation for Atmospheric Research
 LICENSE: See the LICENSE.rst file for details
 """
 
-from pyconform.physarray import PhysArray, CharArray, UnitsError, DimensionsError
+from pyconform.physarray import PhysArray, CharArray, UnitsError, DimensionsError, unit_converter
+from pyconform.bufferpool import buffer_pool
 from testutils import print_test_message
 from cf_units import Unit
 
@@ -14,6 +15,7 @@ import numpy
 import operator
 from numpy import testing as npt
 from copy import deepcopy
+import cPickle as pickle
 
 
 #=======================================================================================================================
@@ -196,6 +198,27 @@ class PhysArrayTests(unittest.TestCase):
         self.assertIsNot(actual, expected, '{} failed - same objects'.format(testname))
         self.assertPhysArraysEqual(actual, expected, testname)
 
+    def test_pickle(self):
+        indata = PhysArray(numpy.ma.masked_array([1., 2., 3.], mask=[0, 1, 0]), name='X',
+                           units=Unit('days since 2000-01-01', calendar='noleap'),
+                           dimensions=('x',), positive='up')
+        testname = 'pickle.loads(pickle.dumps({!r}))'.format(indata)
+        actual = pickle.loads(pickle.dumps(indata, pickle.HIGHEST_PROTOCOL))
+        expected = indata
+        print_test_message(testname, indata=indata, actual=actual, expected=expected)
+        self.assertPhysArraysEqual(actual, expected, testname)
+        self.assertEqual(actual.units.calendar, expected.units.calendar, testname)
+        npt.assert_array_equal(actual.mask, expected.mask, testname)
+
+    def test_pickle_char(self):
+        indata = CharArray(['abc', 'de'], name='X', dimensions=('x', 'n'))
+        testname = 'pickle.loads(pickle.dumps({!r}))'.format(indata)
+        actual = pickle.loads(pickle.dumps(indata, pickle.HIGHEST_PROTOCOL))
+        expected = indata
+        print_test_message(testname, indata=indata, actual=actual, expected=expected)
+        self.assertEqual(type(actual), type(expected), testname)
+        self.assertPhysArraysEqual(actual, expected, testname)
+
     def test_flip(self):
         valid_input = [PhysArray(1.0, name='X', units='m'),
                        PhysArray(1.0, name='X', units='m', positive='up'),
@@ -523,6 +546,54 @@ class PhysArrayBinOpTests(unittest.TestCase):
         self._test_binary_operator_(operator.mod, expvals, 'X % Y')
         self._test_binary_operator_(operator.imod, expvals, 'X %= Y')
 
+    def test_binop_masked(self):
+        X = PhysArray(numpy.ma.MaskedArray([1.0, 2.0, 3.0], mask=[False, True, False]), name='X', dimensions=('x',))
+        Y = PhysArray(numpy.ma.MaskedArray([[1.0, 0.0, 2.0], [4.0, 5.0, 6.0]], mask=[[True, False, False], [False] * 3]),
+                      name='Y', dimensions=('y', 'x'))
+        for binop, opstr in [(operator.add, '+'), (operator.mul, '*'), (operator.div, '/')]:
+            testname = 'X {} Y (masked)'.format(opstr)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                expdata = binop(X.view(numpy.ma.MaskedArray)[:, None], Y.view(numpy.ma.MaskedArray).T)
+            expected = PhysArray(expdata, dimensions=('x', 'y'),
+                                 name=('(broadcast(X, from=[x], to=[x,y]){}transpose(Y, from=[y,x], to=[x,y]))'
+                                       '').format(opstr))
+            actual = binop(X, Y)
+            print_test_message(testname, actual=actual, expected=expected)
+            self.assertPhysArraysEqual(actual, expected, testname)
+            npt.assert_array_equal(actual.mask, expdata.mask, '{} failed - mask'.format(testname))
+
+    def test_binop_unmasked(self):
+        X = PhysArray([1.0, 2.0, 3.0], name='X', dimensions=('x',))
+        for ydata, expmask in [([4.0, 5.0, 6.0], numpy.ma.nomask), ([4.0, 0.0, 6.0], [False, True, False])]:
+            Y = PhysArray(ydata, name='Y', dimensions=('x',))
+            testname = 'X / {} (unmasked)'.format(ydata)
+            actual = numpy.ma.getmask(X / Y)
+            print_test_message(testname, actual=actual, expected=expmask)
+            npt.assert_array_equal(actual, expmask, '{} failed'.format(testname))
+
+    def test_binop_operands_unchanged(self):
+        X = PhysArray([1.0, 2.0], name='X', units='m', dimensions=('x',), positive='up')
+        Y = PhysArray([3.0, 4.0], name='Y', units='m', dimensions=('x',), positive='down')
+        for binop, opstr in [(operator.add, '+'), (operator.sub, '-'), (operator.mul, '*'), (operator.div, '/')]:
+            testname = 'X {} Y leaves Y unchanged'.format(opstr)
+            binop(X, Y)
+            actual = Y
+            expected = PhysArray([3.0, 4.0], name='Y', units='m', dimensions=('x',), positive='down')
+            print_test_message(testname, actual=actual, expected=expected)
+            self.assertPhysArraysEqual(actual, expected, testname)
+
+    def test_binop_buffer_pool(self):
+        X = PhysArray(numpy.ones((4, 5)), name='X', units='m', dimensions=('x', 'y'))
+        Y = PhysArray(numpy.ones((5, 4)), name='Y', units='cm', dimensions=('y', 'x'))
+        testname = 'X + Y reuses buffers'
+        X + Y
+        buffer_pool().reset_counters()
+        X + Y
+        actual = buffer_pool().saved
+        expected = Y.nbytes
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertEqual(actual, expected, '{} failed'.format(testname))
+
     def test_pow(self):
         expvals = {(1, 14): PhysArray(1.0, name='(X**2)'),
                    (15, 14): PhysArray(9.0, name='(X**2)'),
@@ -545,6 +616,18 @@ class PhysArrayBinOpTests(unittest.TestCase):
         print_test_message(testname, actual=actual, expected=expected, X=X)
         self.assertPhysArraysEqual(actual, expected, testname=testname)
 
+    def test_convert_inplace(self):
+        xdata = numpy.array([2., 3.], dtype='f')
+        X = PhysArray(xdata, name='X', units='degC', dimensions=('x',))
+        indata = 'K'
+        testname = 'X.convert({}, inplace=True)'.format(indata)
+        expected = PhysArray(X.copy(), name='X', units='degC', dimensions=('x',)).convert(indata)
+        actual = X.convert(Unit(indata), inplace=True)
+        print_test_message(testname, actual=actual, expected=expected, X=X)
+        self.assertPhysArraysEqual(actual, expected, testname=testname)
+        self.assertIs(actual, X, '{} failed'.format(testname))
+        self.assertEqual(actual.dtype, numpy.dtype('f'), '{} failed'.format(testname))
+
     def test_convert_error(self):
         xdata = numpy.array(2., dtype='d')
         X = PhysArray(xdata, name='X', units='km')
@@ -593,6 +676,48 @@ class PhysArrayBinOpTests(unittest.TestCase):
         self.assertPhysArraysEqual(actual, expected, testname=testname)
 
 
+#=======================================================================================================================
+# UnitConverterTests
+#=======================================================================================================================
+class UnitConverterTests(unittest.TestCase):
+    """
+    Unit tests for the physarray.UnitConverter class and unit_converter function
+    """
+
+    def test_cached(self):
+        testname = 'unit_converter(km, m) is cached'
+        actual = unit_converter(Unit('km'), 'm')
+        expected = unit_converter('km', Unit('m'))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertIs(actual, expected, '{} failed'.format(testname))
+
+    def test_linear(self):
+        indata = [('km', 'm'), ('K', 'degC'), ('degC', 'K'), ('Pa', 'hPa'), ('mm day-1', 'm s-1')]
+        for u1, u2 in indata:
+            testname = 'unit_converter({}, {})'.format(u1, u2)
+            converter = unit_converter(u1, u2)
+            for dtype in ('f', 'd', 'i'):
+                data = numpy.array([-1e5, -7.25, 0., 1e-3, 2.5, 300., 3.14e7]).astype(dtype)
+                expected = numpy.asarray(Unit(u1).convert(data.copy(), Unit(u2))).astype(dtype)
+                actual = converter(data)
+                print_test_message(testname, dtype=dtype, actual=actual, expected=expected)
+                self.assertTrue(converter.linear, '{} failed'.format(testname))
+                npt.assert_array_equal(actual, expected, '{} failed'.format(testname))
+                converter(data, out=data)
+                npt.assert_array_equal(data, expected, '{} failed (in place)'.format(testname))
+
+    def test_time(self):
+        u1 = Unit('days since 2000-01-01', calendar='noleap')
+        u2 = Unit('hours since 2000-01-01', calendar='noleap')
+        testname = 'unit_converter({}, {})'.format(u1, u2)
+        converter = unit_converter(u1, u2)
+        actual = (converter.linear, converter(numpy.array([1., 2.5])))
+        expected = (False, numpy.array([24., 60.]))
+        print_test_message(testname, actual=actual, expected=expected)
+        self.assertFalse(actual[0], '{} failed'.format(testname))
+        npt.assert_array_equal(actual[1], expected[1], '{} failed'.format(testname))
+
+
 #===============================================================================
 # Command-Line Operation
 #===============================================================================